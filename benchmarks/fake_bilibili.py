@@ -0,0 +1,332 @@
+# benchmarks/fake_bilibili.py
+
+"""
+离线基准测试用的模拟 B站服务 (本地 HTTP)。
+- 动态列表接口: /x/polymer/web-dynamic/v1/opus/feed/space (与 BilibiliAPI.FEED_API_URL 的路径相同)
+- CDN: /bfs/new_dyn/<动态ID>_<序号>.jpg 与 /bfs/dyn_video/<动态ID>_<序号>.mp4，
+  返回确定的合成数据，支持 Range 断点续传
+- /bench/extract?url=...: 供模拟 gallery-dl (fake_gallery_dl.py) 查询 '-j' 输出，
+  结构与 docs/examples 中的真实输出相同 (以该文件为模板替换 ID、时间与资源地址)
+延迟、带宽与错误率由 NetworkProfile 控制。
+"""
+
+import copy
+import json
+import time
+import random
+import hashlib
+import os
+import re
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+TEMPLATE_PATH = os.path.join(PROJECT_ROOT, 'docs', 'examples', '2025-12-11_1145003199878397958.json')
+
+FEED_PATH = "/x/polymer/web-dynamic/v1/opus/feed/space"
+EXTRACT_PATH = "/bench/extract"
+IMAGE_PATH = "/bfs/new_dyn/"
+VIDEO_PATH = "/bfs/dyn_video/"
+
+# 动态列表每页的条数 (与真实接口接近)
+FEED_PAGE_SIZE = 12
+# 第一条动态的发布时间 (2024-01-01 00:00:00 UTC)，之后每条动态间隔一小时
+BASE_PUB_TS = 1704067200
+# 合成数据分块发送的大小
+CHUNK_SIZE = 65536
+
+@dataclass
+class AccountSpec:
+    """一个模拟账号：动态数、每条动态的图片数，以及带实况视频的图片比例。"""
+    uid: int
+    name: str
+    posts: int
+    images_per_post: int = 3
+    live_ratio: float = 0.0
+
+    def opus_id(self, index: int) -> str:
+        """第 index 条动态 (从 0 开始，越大越新) 的动态ID，随发布时间递增，与真实动态ID的性质相同。"""
+        return str(1_000_000_000_000_000 + self.uid * 100_000 + index)
+
+    def has_live(self, index: int, num: int) -> bool:
+        # 按顺序均匀分配 (第 k 张图片在累计比例跨过整数时带实况)，保证每次运行相同
+        k = index * self.images_per_post + num
+        return int(k * self.live_ratio) != int((k - 1) * self.live_ratio)
+
+@dataclass
+class NetworkProfile:
+    """模拟网络条件。延迟单位为秒，带宽单位为 字节/秒 (每个连接)，None 表示不限速。"""
+    feed_latency: float = 0.0
+    metadata_latency: float = 0.0
+    cdn_latency: float = 0.0
+    bandwidth: Optional[float] = None
+    # CDN 请求出错的比例：一半返回 503，一半发送到一半时断开连接
+    cdn_error_rate: float = 0.0
+    image_size: int = 200_000
+    video_size: int = 1_000_000
+    seed: int = 0
+
+class _Template:
+    """从 docs/examples 读取的真实 gallery-dl 输出，作为生成模拟输出的模板。"""
+
+    def __init__(self, path: str = TEMPLATE_PATH):
+        with open(path, 'r', encoding='utf-8') as f:
+            example = json.load(f)
+        self.post_meta = example[0][-1]
+        self.image_meta = example[1][-1]
+
+    def render(self, account: AccountSpec, index: int, base_url: str) -> List[Any]:
+        id_str = account.opus_id(index)
+        pub_ts = BASE_PUB_TS + index * 3600
+        pictures = []
+        for num in range(1, account.images_per_post + 1):
+            picture = {
+                "aigc": None, "height": 1920, "width": 1080, "size": 200.0,
+                "url": f"{base_url}{IMAGE_PATH}{id_str}_{num}.jpg",
+            }
+            if account.has_live(index, num):
+                picture["live_url"] = f"{base_url}{VIDEO_PATH}{id_str}_{num}.mp4"
+            pictures.append(picture)
+
+        detail = copy.deepcopy(self.post_meta["detail"])
+        detail["id_str"] = id_str
+        detail["basic"]["uid"] = account.uid
+        author = detail["modules"]["module_author"]
+        author.update(mid=account.uid, name=account.name, pub_ts=pub_ts,
+                      pub_time=time.strftime('%Y年%m月%d日 %H:%M', time.gmtime(pub_ts)),
+                      jump_url=f"//space.bilibili.com/{account.uid}")
+        for paragraph in detail["modules"].get("module_content", {}).get("paragraphs", []):
+            if paragraph.get("para_type") == 2:
+                paragraph["pic"]["pics"] = pictures
+            elif paragraph.get("para_type") == 1:
+                paragraph["text"]["nodes"][0]["word"]["words"] = f"基准测试动态 {index}"
+
+        common = {"id": id_str, "username": account.name, "count": len(pictures), "detail": detail}
+        messages: List[Any] = [[2, dict(self.post_meta, **common)]]
+        for num, picture in enumerate(pictures, 1):
+            name = os.path.basename(picture["url"]).rsplit('.', 1)[0]
+            meta = dict(self.image_meta, **common)
+            meta.update(num=num, url=picture["url"], filename=name, extension="jpg",
+                        width=picture["width"], height=picture["height"], size=picture["size"])
+            if "live_url" in picture:
+                meta["live_url"] = picture["live_url"]
+            else:
+                meta.pop("live_url", None)
+            messages.append([3, picture["url"], meta])
+        return messages
+
+class FakeBilibili:
+    """
+    模拟服务：在后台线程中运行一个多线程 HTTP 服务 (HTTP/1.1 长连接)。
+    用法:
+        with FakeBilibili(accounts, profile) as server:
+            server.base_url  # 例如 http://127.0.0.1:54321
+    """
+
+    def __init__(self, accounts: List[AccountSpec], profile: Optional[NetworkProfile] = None,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.accounts = {account.uid: account for account in accounts}
+        self.profile = profile or NetworkProfile()
+        self.template = _Template()
+        self._random = random.Random(self.profile.seed)
+        self._random_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.stats = {"feed_requests": 0, "extract_requests": 0, "cdn_requests": 0,
+                      "cdn_errors": 0, "cdn_bytes": 0}
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeBilibili":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-bilibili", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeBilibili":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, key: str, value: int = 1):
+        with self._lock:
+            self.stats[key] += value
+
+    def _roll(self) -> float:
+        with self._random_lock:
+            return self._random.random()
+
+    # ---------- 数据 ----------
+
+    def _find_post(self, opus_id: str) -> Optional[Tuple[AccountSpec, int]]:
+        for account in self.accounts.values():
+            index = int(opus_id) - int(account.opus_id(0)) if opus_id.isdigit() else -1
+            if 0 <= index < account.posts:
+                return account, index
+        return None
+
+    def feed_page(self, uid: int, offset: str) -> Dict[str, Any]:
+        """动态列表的一页：从新到旧，offset 为上一页最后一条动态的ID。"""
+        account = self.accounts.get(uid)
+        if account is None:
+            return {"code": -404, "message": "啥都木有"}
+        end = account.posts
+        if offset:
+            found = self._find_post(offset)
+            end = found[1] if found else 0
+        start = max(0, end - FEED_PAGE_SIZE)
+        items = [
+            {
+                "opus_id": account.opus_id(index),
+                "jump_url": f"//www.bilibili.com/opus/{account.opus_id(index)}",
+                "content": f"基准测试动态 {index}",
+                "stat": {"like": "0"},
+            }
+            for index in range(end - 1, start - 1, -1)
+        ]
+        return {"code": 0, "message": "0", "data": {"items": items, "has_more": start > 0,
+                                                    "offset": items[-1]["opus_id"] if items else ""}}
+
+    def extract(self, url: str) -> Optional[List[Any]]:
+        """模拟 'gallery-dl -j <url>' 的输出；不认识的 URL 返回 None。"""
+        match = re.search(r'bilibili\.com/opus/(\d+)', url)
+        if match:
+            found = self._find_post(match.group(1))
+            if found is None:
+                return None
+            return self.template.render(found[0], found[1], self.base_url)
+        match = re.search(r'space\.bilibili\.com/(\d+)', url)
+        if match and int(match.group(1)) in self.accounts:
+            # 用户主页：每条动态一个 Queue 消息 (6)，从新到旧
+            account = self.accounts[int(match.group(1))]
+            return [
+                [6, f"https://www.bilibili.com/opus/{account.opus_id(index)}",
+                 {"category": "bilibili", "subcategory": "user-articles", "username": account.name}]
+                for index in range(account.posts - 1, -1, -1)
+            ]
+        return None
+
+    def resource_size(self, path: str) -> Optional[int]:
+        if path.startswith(IMAGE_PATH) and path.endswith(".jpg"):
+            return self.profile.image_size
+        if path.startswith(VIDEO_PATH) and path.endswith(".mp4"):
+            return self.profile.video_size
+        return None
+
+    @staticmethod
+    def resource_block(path: str) -> bytes:
+        """资源内容：由路径决定的 64KB 数据块重复填充，每个资源的内容不同且每次运行相同。"""
+        digest = hashlib.sha256(path.encode('utf-8')).digest()
+        return (digest * (CHUNK_SIZE // len(digest) + 1))[:CHUNK_SIZE]
+
+    # ---------- HTTP ----------
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, document: Any, status: int = 200):
+                body = json.dumps(document, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                if parsed.path == FEED_PATH:
+                    server._count("feed_requests")
+                    time.sleep(server.profile.feed_latency)
+                    uid = query.get("host_mid", ["0"])[0]
+                    self._send_json(server.feed_page(int(uid) if uid.isdigit() else 0, query.get("offset", [""])[0]))
+                elif parsed.path == EXTRACT_PATH:
+                    server._count("extract_requests")
+                    time.sleep(server.profile.metadata_latency)
+                    messages = server.extract(query.get("url", [""])[0])
+                    if messages is None:
+                        self._send_json({"error": "NotFoundError", "message": "Unsupported URL"}, 404)
+                    else:
+                        self._send_json(messages)
+                else:
+                    self._serve_resource(parsed.path)
+
+            def _serve_resource(self, path: str):
+                size = server.resource_size(path)
+                if size is None:
+                    self._send_json({"code": -404}, 404)
+                    return
+                server._count("cdn_requests")
+                time.sleep(server.profile.cdn_latency)
+
+                failure = server._roll() < server.profile.cdn_error_rate
+                if failure and server._roll() < 0.5:
+                    server._count("cdn_errors")
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                start = 0
+                match = re.match(r'bytes=(\d+)-', self.headers.get("Range", ""))
+                if match:
+                    start = int(match.group(1))
+                    if start >= size:
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{size}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Type", "video/mp4" if path.endswith(".mp4") else "image/jpeg")
+                self.send_header("Content-Length", str(size - start))
+                self.send_header("Accept-Ranges", "bytes")
+                self.end_headers()
+
+                # 出错时只发送一半就断开连接，客户端下次从断点继续
+                stop_at = start + (size - start) // 2 if failure else size
+                if failure:
+                    server._count("cdn_errors")
+                block = server.resource_block(path)
+                sent, began = start, time.perf_counter()
+                try:
+                    while sent < stop_at:
+                        # 块在资源中的位置按 CHUNK_SIZE 对齐，续传时内容与完整下载相同
+                        offset_in_block = sent % CHUNK_SIZE
+                        chunk = block[offset_in_block:min(CHUNK_SIZE, offset_in_block + stop_at - sent)]
+                        self.wfile.write(chunk)
+                        sent += len(chunk)
+                        if server.profile.bandwidth:
+                            ahead = (sent - start) / server.profile.bandwidth - (time.perf_counter() - began)
+                            if ahead > 0:
+                                time.sleep(ahead)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+                    return
+                finally:
+                    server._count("cdn_bytes", sent - start)
+                if failure:
+                    self.close_connection = True
+
+        return Handler
@@ -0,0 +1,69 @@
+# benchmarks/fake_gallery_dl.py
+
+"""
+离线基准测试用的模拟 gallery-dl 命令行程序。
+接受 SubprocessBackend 使用的参数 ('-j'、'-o output.jsonl=true'、'--sleep-request'、'--cookies')，
+向模拟服务 (fake_bilibili.py，地址由环境变量 FAKE_BILIBILI_URL 指定) 查询每个 URL 的输出并按
+gallery-dl 的格式打印：默认每个 URL 一个缩进的 JSON 数组，jsonl 模式下每条消息一行。
+不认识的 URL 与 gallery-dl 一样在 stderr 打印错误，并以非零状态退出。
+"""
+
+import os
+import sys
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+SERVER_ENV = "FAKE_BILIBILI_URL"
+EXTRACT_PATH = "/bench/extract"
+
+def _fetch(server: str, url: str):
+    request_url = f"{server}{EXTRACT_PATH}?{urllib.parse.urlencode({'url': url})}"
+    try:
+        with urllib.request.urlopen(request_url, timeout=60) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        print(f"[bilibili][error] {e.code} {url}", file=sys.stderr)
+        return None
+
+def main(argv) -> int:
+    server = os.environ.get(SERVER_ENV)
+    if not server:
+        print(f"[fake-gallery-dl][error] 未设置环境变量 {SERVER_ENV}", file=sys.stderr)
+        return 1
+
+    jsonl, sleep_request, urls = False, 0.0, []
+    args = iter(argv)
+    for arg in args:
+        if arg == '-o':
+            jsonl = jsonl or next(args, '') == 'output.jsonl=true'
+        elif arg == '--sleep-request':
+            sleep_request = float(next(args, '0'))
+        elif arg == '--cookies':
+            next(args, None)
+        elif not arg.startswith('-'):
+            urls.append(arg)
+
+    status = 0
+    for position, url in enumerate(urls):
+        if position and sleep_request:
+            time.sleep(sleep_request)
+        messages = _fetch(server, url)
+        if messages is None:
+            status = 4
+            continue
+        if jsonl:
+            for message in messages:
+                sys.stdout.write(json.dumps(message, ensure_ascii=False, separators=(',', ':')) + "\n")
+                sys.stdout.flush()
+        else:
+            sys.stdout.write(json.dumps(messages, indent=4, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+    return status
+
+if __name__ == '__main__':
+    # 与 gallery-dl 一样使用 UTF-8 输出
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,293 @@
+# benchmarks/run_benchmarks.py
+
+"""
+离线基准测试：在本地模拟的 B站接口 / CDN / gallery-dl 上完整运行 Application.run，
+以 JSON 输出每个场景的 动态数/秒、MB/秒、峰值内存 (RSS) 与总耗时，可与基线结果比较。
+
+用法 (在项目根目录下):
+    python benchmarks/run_benchmarks.py                       # 运行全部场景
+    python benchmarks/run_benchmarks.py -s full_backfill      # 只运行指定场景 (可重复)
+    python benchmarks/run_benchmarks.py --scale 0.2           # 按比例缩小动态数，快速试跑
+    python benchmarks/run_benchmarks.py -o after.json --baseline before.json
+
+每个场景 (及其准备阶段) 在独立的子进程中运行，峰值内存只包含该场景本身；
+模拟服务运行在父进程中，不计入。
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+SRC_DIR = os.path.join(PROJECT_ROOT, 'src')
+sys.path.insert(0, BENCH_DIR)
+
+from fake_bilibili import FakeBilibili, AccountSpec, NetworkProfile, FEED_PATH
+from fake_gallery_dl import SERVER_ENV
+
+FAKE_GALLERY_DL = os.path.join(BENCH_DIR, 'fake_gallery_dl.py')
+
+# 所有场景共用的配置 (写入生成的 config.toml)。
+# 限速设置得很宽松：基准测试衡量的是程序本身的吞吐量，而不是限速器的配置。
+BASE_CONFIG: Dict[str, Any] = {
+    "download_mode": "ITERATIVE",
+    "incremental_download": False,
+    "retry_failed": False,
+    "cookie_file_path": "",
+    "extraction_backend": "subprocess",
+    "max_concurrent_downloads": 4,
+    "max_parallel_users": 1,
+    "rate_limit": {"feed": 100.0, "metadata": 100.0, "cdn": 1000.0},
+}
+
+@dataclass
+class Scenario:
+    """
+    一个基准测试场景。
+    :param setup_config: 不为 None 时先用该配置 (在 BASE_CONFIG 基础上覆盖) 运行一次不计时的准备阶段，
+                         例如增量场景需要先完整下载一遍。
+    """
+    name: str
+    description: str
+    accounts: List[AccountSpec]
+    profile: NetworkProfile
+    config: Dict[str, Any] = field(default_factory=dict)
+    setup_config: Optional[Dict[str, Any]] = None
+
+SCENARIOS: Dict[str, Scenario] = {scenario.name: scenario for scenario in [
+    Scenario(
+        name="full_backfill",
+        description="首次完整下载一个中等规模的账号 (无实况)",
+        accounts=[AccountSpec(uid=10001, name="bench_backfill", posts=60, images_per_post=4)],
+        profile=NetworkProfile(feed_latency=0.05, metadata_latency=0.1, cdn_latency=0.02, image_size=200_000),
+    ),
+    Scenario(
+        name="incremental_noop",
+        description="已完整下载的账号再次增量同步，没有新动态",
+        accounts=[AccountSpec(uid=10002, name="bench_incremental", posts=60, images_per_post=4)],
+        profile=NetworkProfile(feed_latency=0.05, metadata_latency=0.1, cdn_latency=0.02, image_size=200_000),
+        config={"incremental_download": True},
+        setup_config={},
+    ),
+    Scenario(
+        name="flaky_cdn",
+        description="CDN 有 15% 的请求失败 (503 或传输中断)，每个连接限速 4 MB/s",
+        accounts=[AccountSpec(uid=10003, name="bench_flaky", posts=30, images_per_post=4, live_ratio=0.25)],
+        profile=NetworkProfile(feed_latency=0.05, metadata_latency=0.1, cdn_latency=0.05, bandwidth=4_000_000,
+                               cdn_error_rate=0.15, image_size=300_000, video_size=1_000_000),
+    ),
+    Scenario(
+        name="large_live_account",
+        description="大账号，每张图片都带实况视频",
+        accounts=[AccountSpec(uid=10004, name="bench_large", posts=120, images_per_post=6, live_ratio=1.0)],
+        profile=NetworkProfile(feed_latency=0.05, metadata_latency=0.1, cdn_latency=0.01,
+                               image_size=64_000, video_size=256_000),
+    ),
+]}
+
+# 与基线比较的指标，及其数值越大越好 (True) 还是越小越好 (False)
+COMPARED_METRICS = {
+    "posts_per_second": True,
+    "mb_per_second": True,
+    "wall_seconds": False,
+    "peak_rss_mb": False,
+}
+
+def _toml_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, str):
+        # JSON 字符串同时也是合法的 TOML 基本字符串
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, list):
+        return "[" + ", ".join(_toml_value(item) for item in value) + "]"
+    raise TypeError(f"不支持写入 TOML 的值: {value!r}")
+
+def write_config(path: str, config: Dict[str, Any]):
+    """把配置字典写成 config.toml (顶层键值在前，表在后)。"""
+    lines = [f"{key} = {_toml_value(value)}" for key, value in config.items() if not isinstance(value, dict)]
+    for key, table in config.items():
+        if isinstance(table, dict):
+            lines.append(f"\n[{key}]")
+            lines.extend(f"{json.dumps(str(k))} = {_toml_value(v)}" for k, v in table.items())
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+
+def _peak_rss_mb() -> Optional[float]:
+    """当前进程的峰值内存 (MB)；不支持的平台 (Windows) 返回 None。"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位为 KB，macOS 上为字节
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def run_phase(spec: Dict[str, str]):
+    """在子进程中执行：加载生成的配置，把接口与 gallery-dl 指向模拟服务，运行 Application 并写出结果。"""
+    sys.path.insert(0, SRC_DIR)
+    from config import Config
+    from api import BilibiliAPI
+    from app import Application
+    from gallery_dl_backend import SubprocessBackend
+    from services.metrics import COUNTER_DOWNLOAD_BYTES
+
+    BilibiliAPI.FEED_API_URL = spec["server"] + FEED_PATH
+    SubprocessBackend.EXECUTABLE = [sys.executable, FAKE_GALLERY_DL]
+
+    config = Config(spec["config_path"])
+    config.check_final_config()
+    app = Application(config, log_dir=spec["log_dir"])
+
+    start = time.perf_counter()
+    app.run()
+    wall_seconds = time.perf_counter() - start
+
+    entries = list(app.summary_log.iter_entries())
+    snapshot = app.metrics.snapshot()
+    posts = sum(entry.get("processed_posts", 0) for entry in entries)
+    download_bytes = snapshot["counters"].get(COUNTER_DOWNLOAD_BYTES, 0)
+    result = {
+        "wall_seconds": round(wall_seconds, 3),
+        "posts": posts,
+        "posts_per_second": round(posts / wall_seconds, 3) if wall_seconds > 0 else 0.0,
+        "files": sum(entry.get("downloaded_images", 0) + entry.get("downloaded_videos", 0) for entry in entries),
+        "failed_files": sum(entry.get("failed_images", 0) for entry in entries),
+        "bytes": int(download_bytes),
+        "mb_per_second": round(download_bytes / 1024 / 1024 / wall_seconds, 3) if wall_seconds > 0 else 0.0,
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": snapshot["stages"],
+    }
+    with open(spec["result_path"], 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+def _launch_phase(scenario: Scenario, phase: str, overrides: Dict[str, Any], server: FakeBilibili,
+                  workdir: str, verbose: bool) -> Dict[str, Any]:
+    """生成该阶段的配置并在子进程中运行，返回子进程写出的结果。"""
+    config = dict(BASE_CONFIG, **overrides)
+    config["output_dir_path"] = os.path.join(workdir, "output")
+    config["users_id"] = [account.uid for account in scenario.accounts]
+    config_path = os.path.join(workdir, f"{phase}.toml")
+    write_config(config_path, config)
+
+    spec = {
+        "server": server.base_url,
+        "config_path": config_path,
+        "log_dir": os.path.join(workdir, f"log_{phase}"),
+        "result_path": os.path.join(workdir, f"{phase}_result.json"),
+    }
+    spec_path = os.path.join(workdir, f"{phase}_spec.json")
+    with open(spec_path, 'w', encoding='utf-8') as f:
+        json.dump(spec, f)
+
+    env = dict(os.environ, **{SERVER_ENV: server.base_url, "PYTHONIOENCODING": "utf-8"})
+    command = [sys.executable, os.path.abspath(__file__), "--phase", spec_path]
+    output_path = os.path.join(workdir, f"{phase}.log")
+    if verbose:
+        completed = subprocess.run(command, env=env)
+    else:
+        with open(output_path, 'w', encoding='utf-8') as output:
+            completed = subprocess.run(command, env=env, stdout=output, stderr=subprocess.STDOUT)
+    if completed.returncode != 0 or not os.path.exists(spec["result_path"]):
+        raise RuntimeError(f"场景 '{scenario.name}' 的 {phase} 阶段运行失败 (退出码 {completed.returncode})，"
+                           f"输出见 {output_path}")
+    with open(spec["result_path"], 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _scaled(scenario: Scenario, scale: float) -> Scenario:
+    accounts = [replace(account, posts=max(1, round(account.posts * scale))) for account in scenario.accounts]
+    return replace(scenario, accounts=accounts)
+
+def run_scenario(scenario: Scenario, keep: bool = False, verbose: bool = False) -> Dict[str, Any]:
+    """运行一个场景 (有准备阶段时先运行准备阶段)，返回计时阶段的结果。"""
+    workdir = tempfile.mkdtemp(prefix=f"bench_{scenario.name}_")
+    try:
+        with FakeBilibili(scenario.accounts, scenario.profile) as server:
+            if scenario.setup_config is not None:
+                _launch_phase(scenario, "setup", scenario.setup_config, server, workdir, verbose)
+                for key in server.stats:
+                    server.stats[key] = 0
+            result = _launch_phase(scenario, "measure", scenario.config, server, workdir, verbose)
+            result["server"] = dict(server.stats)
+        if keep:
+            result["workdir"] = workdir
+        return result
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """与基线结果逐项比较，返回可打印的行。"""
+    lines = []
+    if results.get("scale") != baseline.get("scale"):
+        lines.append(f"  - 注意：本次的 --scale ({results.get('scale')}) 与基线 ({baseline.get('scale')}) 不同，结果不可直接比较")
+    for name, result in results.get("scenarios", {}).items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            lines.append(f"  - {name}: 基线中没有该场景")
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            current, previous = result.get(metric), base.get(metric)
+            if current is None or not previous:
+                continue
+            change = (current - previous) / previous * 100
+            better = change > 0 if higher_is_better else change < 0
+            verdict = "更好" if better else ("更差" if change else "持平")
+            lines.append(f"  - {name}.{metric}: {previous} -> {current} ({change:+.1f}%，{verdict})")
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description="Bilibili Downloader 离线基准测试")
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="要运行的场景，可重复指定；默认运行全部场景")
+    parser.add_argument("--scale", type=float, default=1.0, help="动态数的缩放比例 (默认 1.0)")
+    parser.add_argument("-o", "--output", help="把结果写入 JSON 文件")
+    parser.add_argument("--baseline", help="与之前保存的结果文件比较")
+    parser.add_argument("--keep", action="store_true", help="保留每个场景的工作目录 (下载结果与运行日志)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="显示程序运行时的输出")
+    parser.add_argument("--phase", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.phase:
+        with open(args.phase, 'r', encoding='utf-8') as f:
+            run_phase(json.load(f))
+        return
+
+    results: Dict[str, Any] = {
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": args.scale,
+        "scenarios": {},
+    }
+    for name in args.scenario or list(SCENARIOS):
+        scenario = _scaled(SCENARIOS[name], args.scale)
+        print(f"运行场景 {name}: {scenario.description} ...", file=sys.stderr)
+        results["scenarios"][name] = run_scenario(scenario, args.keep, args.verbose)
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print("与基线比较:", file=sys.stderr)
+        for line in compare(results, baseline):
+            print(line, file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,113 @@
 # src/api.py
 
-import random
-import time
 import subprocess
 import json
+import queue
+import threading
+import contextvars
 import requests
+import re
 import http.cookiejar
+from dataclasses import dataclass
 from typing import List, Dict, Any, Optional, Iterator
 
+from gallery_dl_backend import BACKEND_SUBPROCESS, SubprocessBackend, create_backend
+from services.rate_limiter import (AdaptiveRateLimiter, ENDPOINT_FEED, ENDPOINT_METADATA,
+                                   is_throttle_response, is_throttle_message)
+from services.metrics import (Metrics, STAGE_GALLERY_DL, STAGE_GALLERY_DL_BATCH, STAGE_FEED_PAGE,
+                              COUNTER_GALLERY_DL_FAILURES)
+
+@dataclass
+class FeedPost:
+    """
+    动态列表中的一项：动态 URL 及列表中已经附带的 ID / 发布时间戳。
+    【新增】page_offset: 请求该动态所在页面时使用的翻页游标 (第一页为空字符串)，用于断点续传。
+    【新增】pinned: 是否为置顶动态 (置顶动态不按时间排序，增量同步时需要特殊对待)。
+    """
+    url: str
+    opus_id: Optional[str] = None
+    pub_ts: Optional[int] = None
+    page_offset: Optional[str] = None
+    pinned: bool = False
+
+    @classmethod
+    def from_url(cls, url: str) -> "FeedPost":
+        """仅有 URL 时 (GET_ALL 模式)，从 URL 中解析动态 ID。"""
+        match = re.search(r'/(\d+)/?(?:[?#].*)?$', url)
+        return cls(url=url, opus_id=match.group(1) if match else None)
+
+# 预取线程结束标记
+_END_OF_PAGES = object()
+
+def _prefetch_pages(pages: Iterator[List[FeedPost]], depth: int) -> Iterator[List[FeedPost]]:
+    """
+    【新增】在后台线程中提前获取页面的惰性生成器。
+    - 已获取但尚未被取走的页面最多 depth 页，取走一页后才会开始请求下一页；
+    - 关闭本生成器时通知后台线程停止翻页：正在进行的请求完成后结果被丢弃，不会再发起新的请求。
+    """
+    buffer: "queue.Queue" = queue.Queue()
+    slots = threading.Semaphore(depth)
+    cancelled = threading.Event()
+
+    def producer():
+        try:
+            while True:
+                while not slots.acquire(timeout=0.1):
+                    if cancelled.is_set():
+                        return
+                if cancelled.is_set():
+                    return
+                page = next(pages, None)
+                if page is None:
+                    return
+                buffer.put(page)
+        except Exception as e:
+            print(f"  - 预取动态列表时出错: {e}")
+        finally:
+            pages.close()
+            buffer.put(_END_OF_PAGES)
+
+    # 预取线程沿用调用方的上下文 (例如并行处理用户时的输出前缀)
+    threading.Thread(target=contextvars.copy_context().run, args=(producer,), name="feed-prefetch", daemon=True).start()
+    try:
+        while True:
+            page = buffer.get()
+            if page is _END_OF_PAGES:
+                return
+            slots.release()
+            yield page
+    finally:
+        cancelled.set()
+
 class BilibiliAPI:
     """一个用于通过 gallery-dl 或直接API与 Bilibili 交互的封装器。"""
+
+    # 动态列表接口被限流时，同一页最多重试的次数
+    MAX_THROTTLE_RETRIES = 5
+    # 【新增】动态列表接口地址，基准测试中替换为本地的模拟服务 (见 benchmarks/)
+    FEED_API_URL = "https://api.bilibili.com/x/polymer/web-dynamic/v1/opus/feed/space"
     
-    def __init__(self, cookie_file: Optional[str]):
-        """初始化 API 封装器。"""
+    def __init__(self, cookie_file: Optional[str], backend: str = BACKEND_SUBPROCESS,
+                 rate_limiter: Optional[AdaptiveRateLimiter] = None, feed_prefetch_pages: int = 1,
+                 metrics: Optional[Metrics] = None):
+        """
+        初始化 API 封装器。
+        :param backend: gallery-dl 提取后端，'subprocess' (默认) 或 'inprocess'。
+        :param rate_limiter: 【新增】共享的自适应限速器，替代原来的固定随机休眠。
+        :param feed_prefetch_pages: 【新增】动态列表最多提前获取的页数，0 表示不预取。
+        :param metrics: 【新增】计时与计数层，默认与限速器共用同一个。
+        """
         self.cookie_file = cookie_file
+        self.feed_prefetch_pages = feed_prefetch_pages
+        # 动态列表已完整翻到最后一页的用户 (区别于因网络错误等原因中途停止)
+        self._exhausted_feeds = set()
+        # 【新增】GET_ALL 模式下已完整读取动态列表的用户主页 URL
+        self._complete_listings = set()
+        self.rate_limiter = rate_limiter if rate_limiter is not None else AdaptiveRateLimiter()
+        self.metrics = metrics if metrics is not None else self.rate_limiter.metrics
+        # 【新增】gallery-dl 提取后端，进程内后端不可用时自动回退到子进程
+        self.backend = create_backend(backend, cookie_file)
+        self.fallback_backend = None if self.backend.name == BACKEND_SUBPROCESS else SubprocessBackend(cookie_file)
         self.session = requests.Session()
         self.session.headers.update({
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
@@ -32,27 +126,37 @@ class BilibiliAPI:
             print(f"  - 警告：加载 cookie 文件失败: {e}")
 
     def _run_command(self, url: str) -> Optional[List[Dict[str, Any]]]:
-            """通过 gallery-dl 运行命令并解析其 JSON 输出。"""
-            command = ['gallery-dl', '-j', url]
-            if self.cookie_file:
-                command.extend(['--cookies', self.cookie_file])
+            """通过 gallery-dl 提取后端获取并解析 URL 的 JSON 元数据。"""
             # 防止解析的时候卡住
             # 最大重试次数设置为 2 次（初始 1 次 + 重试 1 次）
             max_retries = 2
             
             for attempt in range(max_retries):
+                # 【新增】进程内后端失败后，最后一次尝试回退到子进程后端
+                backend = self.backend
+                if attempt > 0 and self.fallback_backend:
+                    backend = self.fallback_backend
+                # 【新增】由集中限速器控制 gallery-dl 的请求速度
+                self.rate_limiter.acquire(ENDPOINT_METADATA)
                 try:
-                    # 【修改点】设置 timeout=30，单位为秒
-                    result = subprocess.run(command, check=True, capture_output=True, timeout=30)
-                    try:
-                        output_text = result.stdout.decode('utf-8')
-                    except UnicodeDecodeError:
-                        output_text = result.stdout.decode('gbk', errors='ignore')
-                    return json.loads(output_text)
+                    with self.metrics.timer(STAGE_GALLERY_DL):
+                        result = backend.run(url)
+                    error_message = self._find_error_message(result)
+                    if error_message and is_throttle_message(error_message):
+                        self.rate_limiter.report_throttled(ENDPOINT_METADATA)
+                        self.metrics.count(COUNTER_GALLERY_DL_FAILURES)
+                        print(f"  - 错误: gallery-dl 请求被限流 [尝试 {attempt + 1}/{max_retries}]: {error_message}")
+                    else:
+                        self.rate_limiter.report_success(ENDPOINT_METADATA)
+                        return result
 
                 except subprocess.TimeoutExpired:
+                    self.metrics.count(COUNTER_GALLERY_DL_FAILURES)
                     print(f"  - 错误: 获取元数据超时 (30s) [尝试 {attempt + 1}/{max_retries}]")
                 except (subprocess.CalledProcessError, json.JSONDecodeError, Exception) as e:
+                    self.metrics.count(COUNTER_GALLERY_DL_FAILURES)
+                    if is_throttle_message(getattr(e, 'stderr', None) or e):
+                        self.rate_limiter.report_throttled(ENDPOINT_METADATA)
                     print(f"  - 错误: gallery-dl 执行或解析失败 [尝试 {attempt + 1}/{max_retries}]: {e}")
                 
                 # 如果不是最后一次尝试，则打印重试提示
@@ -63,35 +167,217 @@ class BilibiliAPI:
 
             return None
     
+    @staticmethod
+    def _find_error_message(result: Any) -> Optional[str]:
+        """查找 gallery-dl 输出中的错误项 ([-1, {"error": ..., "message": ...}])。"""
+        if not isinstance(result, list):
+            return None
+        for entry in result:
+            if isinstance(entry, list) and entry and entry[0] == -1 and isinstance(entry[-1], dict):
+                return f"{entry[-1].get('error', '')}: {entry[-1].get('message', '')}"
+        return None
+
     def get_post_metadata(self, post_url: str) -> Optional[List[Dict[str, Any]]]:
         """获取单个动态的详细元数据。"""
         return self._run_command(post_url)
 
+    @staticmethod
+    def _document_post_id(document: Any) -> Optional[str]:
+        """从一个 gallery-dl 输出数组中读取动态 ID (detail.id_str)。"""
+        if not isinstance(document, list):
+            return None
+        for entry in document:
+            if isinstance(entry, list) and entry and isinstance(entry[-1], dict):
+                id_str = entry[-1].get('detail', {}).get('id_str')
+                if id_str:
+                    return str(id_str)
+        return None
+
+    def get_posts_metadata_batch(self, post_urls: List[str]) -> Dict[str, Optional[List[Any]]]:
+        """
+        【新增】批量获取多个动态的元数据，返回 {url: 元数据}。
+        子进程后端一次 'gallery-dl -j' 调用处理全部 URL，并按动态 ID 把输出拆分回各个 URL；
+        gallery-dl 内部的请求间隔按元数据端点的当前速度设置。
+        批量调用失败、输出中出错或未能匹配的 URL 会逐个重新获取，不会因为一个 URL 失败而丢失其他结果。
+        """
+        results: Dict[str, Optional[List[Any]]] = {}
+        if len(post_urls) > 1 and getattr(self.backend, 'supports_batch', False):
+            self.rate_limiter.acquire(ENDPOINT_METADATA)
+            try:
+                with self.metrics.timer(STAGE_GALLERY_DL_BATCH):
+                    documents = self.backend.run_many(post_urls, 1.0 / self.rate_limiter.current_rate(ENDPOINT_METADATA))
+            except Exception as e:
+                print(f"  - 批量获取元数据失败，将逐个获取: {e}")
+                documents = []
+
+            by_id: Dict[str, List[Any]] = {}
+            for document in documents:
+                error_message = self._find_error_message(document)
+                if error_message:
+                    if is_throttle_message(error_message):
+                        self.rate_limiter.report_throttled(ENDPOINT_METADATA)
+                    continue
+                post_id = self._document_post_id(document)
+                if post_id:
+                    by_id[post_id] = document
+            if by_id:
+                self.rate_limiter.report_success(ENDPOINT_METADATA)
+
+            for url in post_urls:
+                post_id = FeedPost.from_url(url).opus_id
+                if post_id in by_id:
+                    results[url] = by_id[post_id]
+            missing = len(post_urls) - len(results)
+            print(f"  - [批量] 一次调用获取了 {len(results)}/{len(post_urls)} 条动态的元数据"
+                  + (f"，{missing} 条将逐个重新获取。" if missing else "。"))
+
+        for url in post_urls:
+            if url not in results:
+                results[url] = self._run_command(url)
+        return results
+
     def get_initial_metadata(self, user_url: str) -> Optional[List[Dict[str, Any]]]:
         """【GET_ALL模式】获取用户所有动态的元数据。"""
         return self._run_command(user_url)
 
-    def get_post_urls_iterative(self, user_id: int) -> Iterator[str]:
+    def iter_initial_metadata(self, user_url: str) -> Iterator[List[Any]]:
+        """
+        【新增】【GET_ALL模式】流式获取用户所有动态的元数据，逐条产出 gallery-dl 的输出项。
+        与 get_initial_metadata 不同，不会把整个输出读入内存，第一条动态在列表读取完毕之前就可以开始处理。
+        列表中单条出错的输出项 ([-1, {...}]) 只记录并跳过，不影响其他动态；
+        gallery-dl 进程失败或超时时与 _run_command 一样重试，重试时跳过已经产出过的输出项，不会重复产出。
+        只有完整读取到列表末尾时，initial_metadata_complete 才返回 True。
+        """
+        max_retries = 2
+        yielded = 0
+        self._complete_listings.discard(user_url)
+
+        for attempt in range(max_retries):
+            backend = self.backend
+            if attempt > 0 and self.fallback_backend:
+                backend = self.fallback_backend
+            self.rate_limiter.acquire(ENDPOINT_METADATA)
+            entries = backend.stream(user_url)
+            skip = yielded
+            try:
+                for entry in entries:
+                    error_message = self._find_error_message([entry])
+                    if error_message:
+                        # 出错的输出项不计入已产出的数量，重试时同样跳过，不会打乱续读位置
+                        if not skip:
+                            print(f"  - 警告: 动态列表中的一项获取失败，已跳过: {error_message}")
+                            if is_throttle_message(error_message):
+                                self.rate_limiter.report_throttled(ENDPOINT_METADATA)
+                        continue
+                    if skip:
+                        skip -= 1
+                        continue
+                    yielded += 1
+                    yield entry
+                self.rate_limiter.report_success(ENDPOINT_METADATA)
+                self._complete_listings.add(user_url)
+                return
+            except subprocess.TimeoutExpired:
+                print(f"  - 错误: 读取动态列表超时 [尝试 {attempt + 1}/{max_retries}]")
+            except Exception as e:
+                if is_throttle_message(getattr(e, 'stderr', None) or e):
+                    self.rate_limiter.report_throttled(ENDPOINT_METADATA)
+                print(f"  - 错误: gallery-dl 执行或解析失败 [尝试 {attempt + 1}/{max_retries}]: {e}")
+            finally:
+                entries.close()
+
+            if attempt < max_retries - 1:
+                print(f"  - 正在重试 (跳过已读取的 {yielded} 项)...")
+            else:
+                print(f"  - 所有重试均失败，动态列表只读取了 {yielded} 项: {user_url}")
+
+    def initial_metadata_complete(self, user_url: str) -> bool:
+        """【新增】iter_initial_metadata 最近一次是否完整读取了该用户的动态列表。"""
+        return user_url in self._complete_listings
+
+    @staticmethod
+    def _parse_pub_ts(item: Dict[str, Any]) -> Optional[int]:
+        """尽量从动态列表项中读取发布时间戳，不存在时返回 None。"""
+        pub_ts = item.get("pub_ts") or item.get("modules", {}).get("module_author", {}).get("pub_ts")
+        try:
+            return int(pub_ts) if pub_ts else None
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _is_pinned_item(item: Dict[str, Any]) -> bool:
+        """根据列表项中的置顶标记判断是否为置顶动态。"""
+        if item.get("is_top"):
+            return True
+        tag = item.get("modules", {}).get("module_tag", {})
+        return isinstance(tag, dict) and tag.get("text") == "置顶"
+
+    @staticmethod
+    def _mark_pinned(posts: List[FeedPost]):
+        """
+        【新增】标记第一页中的置顶动态。
+        除了列表项中的置顶标记之外，动态ID 随发布时间递增，
+        因此 ID 比它后面某条动态还小的动态只可能是被置顶到前面的旧动态。
+        """
+        later_max = None
+        for post in reversed(posts):
+            if not (post.opus_id and post.opus_id.isdigit()):
+                continue
+            opus_id = int(post.opus_id)
+            if later_max is not None and opus_id < later_max:
+                post.pinned = True
+            later_max = opus_id if later_max is None else max(later_max, opus_id)
+
+    def get_post_urls_iterative(self, user_id: int, start_offset: str = "") -> Iterator[FeedPost]:
         """
         【ITERATIVE模式】
-        通过直接请求B站API，逐页获取并实时产出(yield)单个动态的URL。
+        通过直接请求B站API，逐页获取并实时产出(yield)单个动态。
         这是一个生成器，实现了边获取边处理。
+        【修改】产出 FeedPost，附带列表中已有的 opus_id 与 pub_ts，
+        以便调用方在不调用 gallery-dl 的情况下判断动态是否已下载。
+        【修改】feed_prefetch_pages > 0 时在后台线程中提前获取后续页面，
+        处理当前页的同时下一页已在请求中；关闭生成器 (例如增量模式提前停止) 时取消预取。
+        :param start_offset: 【新增】从指定的翻页游标开始获取 (断点续传)，默认从第一页开始。
         """
-        api_url = "https://api.bilibili.com/x/polymer/web-dynamic/v1/opus/feed/space"
-        params = {"host_mid": str(user_id), "offset": ""}
-
-        sleep_time = random.uniform(2.0, 4.0)
-        # 仅在不是第一次请求时打印休息信息，避免刷屏（可选）
-        if params["offset"]: 
-            # print(f"  - (防反爬) 翻页冷却中，休息 {sleep_time:.2f} 秒...")
-                pass 
-        time.sleep(sleep_time)
+        pages = self._iter_feed_pages(user_id, start_offset)
+        if self.feed_prefetch_pages > 0:
+            pages = _prefetch_pages(pages, self.feed_prefetch_pages)
+        for page in pages:
+            yield from page
+
+    def feed_exhausted(self, user_id: int) -> bool:
+        """【新增】该用户最近一次的动态列表是否已完整翻到最后一页。"""
+        return user_id in self._exhausted_feeds
+
+    def _iter_feed_pages(self, user_id: int, start_offset: str = "") -> Iterator[List[FeedPost]]:
+        """逐页请求动态列表接口，每次产出一页的 FeedPost 列表。"""
+        api_url = self.FEED_API_URL
+        params = {"host_mid": str(user_id), "offset": start_offset}
+        self._exhausted_feeds.discard(user_id)
+        throttle_retries = 0
         
         while True:
+            # 【修改】翻页冷却改由集中限速器控制，被限流时自动降速并重试当前页
+            self.rate_limiter.acquire(ENDPOINT_FEED)
             try:
-                response = self.session.get(api_url, params=params, timeout=20)
-                response.raise_for_status()
-                data = response.json()
+                with self.metrics.timer(STAGE_FEED_PAGE):
+                    response = self.session.get(api_url, params=params, timeout=20)
+                    data = {}
+                    throttled = is_throttle_response(status_code=response.status_code)
+                    if not throttled:
+                        response.raise_for_status()
+                        data = response.json()
+                        throttled = is_throttle_response(api_code=data.get("code"))
+
+                if throttled:
+                    self.rate_limiter.report_throttled(ENDPOINT_FEED)
+                    throttle_retries += 1
+                    if throttle_retries > self.MAX_THROTTLE_RETRIES:
+                        print(f"  - API持续限流，已重试 {self.MAX_THROTTLE_RETRIES} 次，停止获取。")
+                        break
+                    continue
+                throttle_retries = 0
+                self.rate_limiter.report_success(ENDPOINT_FEED)
 
                 if data.get("code") != 0:
                     print(f"  - API错误: {data.get('message', '未知错误')}")
@@ -99,13 +385,26 @@ class BilibiliAPI:
                 
                 items = data.get("data", {}).get("items", [])
                 if not items:
+                    self._exhausted_feeds.add(user_id)
                     break
 
-                for item in items:
-                    if item.get("opus_id"):
-                        yield f"https://www.bilibili.com/opus/{item['opus_id']}"
+                page = [
+                    FeedPost(
+                        url=f"https://www.bilibili.com/opus/{item['opus_id']}",
+                        opus_id=str(item['opus_id']),
+                        pub_ts=self._parse_pub_ts(item),
+                        page_offset=str(params["offset"]),
+                        pinned=self._is_pinned_item(item)
+                    )
+                    for item in items if item.get("opus_id")
+                ]
+                if not params["offset"]:
+                    # 置顶动态只会出现在第一页
+                    self._mark_pinned(page)
+                yield page
                 
                 if not data.get("data", {}).get("has_more"):
+                    self._exhausted_feeds.add(user_id)
                     break
                 
                 # 【修改点】更新 offset 以便进行翻页
@@ -120,4 +419,4 @@ class BilibiliAPI:
                 break
             except json.JSONDecodeError:
                 print(f"  - API响应解析失败。")
-                break
\ No newline at end of file
+                break
@@ -4,32 +4,66 @@ import os
 import sys
 import time
 import datetime
-import json
 import re
-from dataclasses import dataclass, asdict
+import queue
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional
+from tqdm import tqdm
 
 class Tee:
     """
     一个辅助类，用于将输出（如 sys.stdout）同时重定向到控制台和文件。
     【新增】此类现在能够移除ANSI颜色代码，确保日志文件是纯文本。
+    【新增】线程安全：每个线程的输出先缓存到换行为止，再整行写出，多个用户并行处理时不会交错；
+    写出时会暂时清除 tqdm 进度条，避免打印内容与进度条混在一起。
+    可以通过 set_line_prefix 为当前上下文设置行前缀 (例如用户ID)，使用 contextvars
+    复制上下文启动的工作线程 (下载线程池、流水线线程) 会继承该前缀。
     """
+
+    _line_prefix: contextvars.ContextVar = contextvars.ContextVar("tee_line_prefix", default="")
+
     def __init__(self, *files):
         self.files = files
         self.ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def set_line_prefix(self, prefix: str):
+        """设置当前上下文输出的行前缀。"""
+        self._line_prefix.set(prefix)
 
     def write(self, obj):
-        plain_text = self.ansi_escape.sub('', obj)
-        for f in self.files:
-            try:
-                if hasattr(f, 'isatty') and f.isatty():
-                    f.write(obj)
-                else:
-                    f.write(plain_text)
-                f.flush()
-            except Exception:
-                pass
+        pending = getattr(self._local, 'pending', '') + obj
+        if '\n' not in pending:
+            self._local.pending = pending
+            return
+        complete, _, self._local.pending = pending.rpartition('\n')
+        self._emit(complete + '\n')
+
+    def _emit(self, text: str):
+        prefix = self._line_prefix.get()
+        if prefix:
+            text = ''.join(prefix + line if line.strip() else line for line in text.splitlines(keepends=True))
+        plain_text = self.ansi_escape.sub('', text)
+        with self._lock, tqdm.external_write_mode(file=sys.stderr):
+            for f in self.files:
+                try:
+                    if hasattr(f, 'isatty') and f.isatty():
+                        f.write(text)
+                    else:
+                        f.write(plain_text)
+                    f.flush()
+                except Exception:
+                    pass
 
     def flush(self):
+        pending = getattr(self._local, 'pending', '')
+        if pending:
+            self._local.pending = ''
+            self._emit(pending)
         for f in self.files:
             try:
                 f.flush()
@@ -48,39 +82,146 @@ class LogEntry:
     downloaded_images: int
     downloaded_videos: int  # 【新增】视频下载统计
     failed_images: int
+    # 【新增】该用户各阶段的次数与耗时 (gallery-dl、翻页、CDN 下载、元数据写入、限速等待) 以及计数器
+    stages: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    counters: Dict[str, float] = field(default_factory=dict)
 
 from config import Config
 from api import BilibiliAPI
+from services.rate_limiter import AdaptiveRateLimiter, ENDPOINT_FEED, ENDPOINT_METADATA, ENDPOINT_CDN
+from services.summary_log import SummaryLog
+from services.metrics import Metrics, STAGE_CDN_DOWNLOAD, COUNTER_DOWNLOAD_BYTES, format_counter, format_stage_totals
 from processor.processor import PostProcessorFacade
 
 class Application:
     """主应用程序类，负责协调整个流程。"""
     
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, log_dir: Optional[str] = None):
+        """:param log_dir: 【新增】运行日志与摘要日志的目录，默认为项目根目录下的 log/。"""
         self.config = config
         os.makedirs(self.config.OUTPUT_DIR_PATH, exist_ok=True)
-        self.api = BilibiliAPI(self.config.COOKIE_FILE_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(self.config.ARCHIVE_DB_PATH)), exist_ok=True)
+        # 【新增】各阶段的计时与计数，由限速器、API、下载器与元数据保存共享
+        self.metrics = Metrics()
+        # 【新增】集中的自适应限速器，由 API 与下载器共享
+        self.rate_limiter = AdaptiveRateLimiter(
+            rates={
+                ENDPOINT_FEED: self.config.RATE_LIMIT_FEED,
+                ENDPOINT_METADATA: self.config.RATE_LIMIT_METADATA,
+                ENDPOINT_CDN: self.config.RATE_LIMIT_CDN,
+            },
+            recovery_successes=self.config.RATE_LIMIT_RECOVERY_SUCCESSES,
+            metrics=self.metrics
+        )
+        self.api = BilibiliAPI(self.config.COOKIE_FILE_PATH, self.config.EXTRACTION_BACKEND, self.rate_limiter,
+                               self.config.FEED_PREFETCH_PAGES, self.metrics)
         self.processor = PostProcessorFacade(self.config.OUTPUT_DIR_PATH, self.api, self.config)
         
-        project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-        self.log_dir = os.path.join(project_root, 'log')
+        if log_dir is None:
+            project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+            log_dir = os.path.join(project_root, 'log')
+        self.log_dir = log_dir
         os.makedirs(self.log_dir, exist_ok=True)
+        # 【修改】摘要日志改为按月轮转的 JSON Lines，每个用户只追加一行
+        self.summary_log = SummaryLog(self.log_dir)
 
-    def _write_log(self, log_file_path: str, data: dict):
-        records = []
-        if os.path.exists(log_file_path):
-            try:
-                with open(log_file_path, 'r', encoding='utf-8') as f:
-                    records = json.load(f)
-                if not isinstance(records, list):
-                    records = []
-            except (json.JSONDecodeError, FileNotFoundError):
-                records = []
+    def _process_one_user(self, user_id: int, progress_position: Optional[int] = None):
+        """处理单个用户，打印统计信息并写入摘要日志。"""
+        start_time = time.perf_counter()
+
+        user_url = f"https://space.bilibili.com/{user_id}/article"
+        # 【新增】该用户 (包括其工作线程) 的计时单独汇总，写入摘要日志
+        with self.metrics.user_scope() as user_metrics:
+            stats = self.processor.process_user(user_id, user_url, progress_position)
+
+        end_time = time.perf_counter()
+        duration = end_time - start_time
+        
+        user_name = stats.get("folder_name", str(user_id))
+        
+        minutes, seconds = divmod(duration, 60)
+        hours, minutes = divmod(minutes, 60)
+        time_str = f"{int(hours)}h {int(minutes)}m {seconds:.2f}s"
         
-        records.append(data)
+        # 【修改】更新控制台输出，增加视频统计
+        console_message = (
+            f"\n>>>>>>>>> 完成用户 '{user_name}' 的处理，总耗时: {time_str} <<<<<<<<<\n"
+            f"  - 本次处理动态数: {stats['processed_posts']}\n"
+            f"  - 成功下载图片数: {stats['downloaded_images']}\n"
+            f"  - 成功下载实况图片(live photo)数: {stats.get('downloaded_videos', 0)}\n"
+            f"  - 下载失败项目数: {stats['failed_images']}\n"
+            f">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>"
+        )
+        print(console_message)
         
-        with open(log_file_path, 'w', encoding='utf-8') as f:
-            json.dump(records, f, ensure_ascii=False, indent=4)
+        log_entry_obj = LogEntry(
+            user_id=user_id,
+            user_name=user_name,
+            timestamp=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            duration=time_str,
+            duration_seconds=round(duration, 2),
+            processed_posts=stats['processed_posts'],
+            downloaded_images=stats['downloaded_images'],
+            downloaded_videos=stats.get('downloaded_videos', 0), # 【新增】
+            failed_images=stats['failed_images'],
+            stages=user_metrics.stage_totals(),
+            counters=dict(user_metrics.counters)
+        )
+
+        # 【修改】只追加一行，不再读取并重写整个摘要日志 (多个用户同时完成时由 SummaryLog 加锁)
+        self.summary_log.append(asdict(log_entry_obj))
+
+    def _process_users_parallel(self, user_ids: List[int], max_parallel: int):
+        """
+        【新增】同时处理多个用户。
+        每个工作线程占用一个进度条位置 (每个用户一个 tqdm 进度条)，并为自己的输出加上用户ID前缀。
+        """
+        print(f"将同时处理 {max_parallel} 个用户。")
+        free_positions: "queue.Queue[int]" = queue.Queue()
+        for position in range(max_parallel):
+            free_positions.put(position)
+
+        def worker(user_id: int):
+            position = free_positions.get()
+            if isinstance(sys.stdout, Tee):
+                sys.stdout.set_line_prefix(f"[{user_id}] ")
+            try:
+                self._process_one_user(user_id, position)
+            except Exception as e:
+                print(f"处理用户 {user_id} 时发生错误: {e}")
+            finally:
+                if isinstance(sys.stdout, Tee):
+                    sys.stdout.set_line_prefix("")
+                free_positions.put(position)
+
+        executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="user")
+        try:
+            futures = [executor.submit(worker, user_id) for user_id in user_ids]
+            for future in futures:
+                future.result()
+        except KeyboardInterrupt:
+            # 取消尚未开始的用户，正在处理的用户会在当前步骤结束后退出
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+    def _print_metrics(self):
+        """打印整次运行的各阶段耗时与下载吞吐量。"""
+        snapshot = self.metrics.snapshot()
+        if not snapshot["stages"]:
+            return
+        print("阶段耗时统计:")
+        for line in format_stage_totals(snapshot["stages"]):
+            print(line)
+        download_bytes = snapshot["counters"].get(COUNTER_DOWNLOAD_BYTES, 0)
+        download_seconds = snapshot["stages"].get(STAGE_CDN_DOWNLOAD, {}).get("seconds", 0)
+        if download_bytes:
+            # 并发下载时各资源的传输时间相互重叠，这里是单个连接的平均速度
+            throughput = download_bytes / download_seconds / 1024 / 1024 if download_seconds > 0 else 0.0
+            print(f"  - 共下载 {download_bytes / 1024 / 1024:.2f} MB，单个连接平均 {throughput:.2f} MB/秒")
+        other_counters = {k: v for k, v in snapshot["counters"].items() if k != COUNTER_DOWNLOAD_BYTES}
+        if other_counters:
+            print("  - " + "，".join(f"{name}: {format_counter(value)}" for name, value in sorted(other_counters.items())))
 
     def run(self):
         """
@@ -103,11 +244,16 @@ class Application:
         
         sys.stdout = Tee(original_stdout, log_file)
         
-        summary_log_path = os.path.join(self.log_dir, "processing_time_log.json")
+        summary_log_path = self.summary_log.path_for(month_str)
 
         try:
             print(f"程序启动于: {timestamp}")
             print("-" * 40)
+
+            # 【新增】旧版 processing_time_log.json 自动迁移为按月的 JSON Lines (只执行一次)
+            migrated = self.summary_log.migrate_legacy()
+            if migrated:
+                print(f"已将旧版摘要日志中的 {migrated} 条记录迁移为按月的 JSON Lines 格式。")
             
             print(f"正在从 'config.py' 的 USERS_ID 列表读取用户 ID...")
             user_ids = self.config.USERS_ID
@@ -116,45 +262,25 @@ class Application:
                 print(f"错误：配置文件中的 USERS_ID 列表为空。")
                 return
 
-            for user_id in user_ids:
-                start_time = time.perf_counter()
-
-                user_url = f"https://space.bilibili.com/{user_id}/article"
-                stats = self.processor.process_user(user_id, user_url)
-
-                end_time = time.perf_counter()
-                duration = end_time - start_time
-                
-                user_name = stats.get("folder_name", str(user_id))
-                
-                minutes, seconds = divmod(duration, 60)
-                hours, minutes = divmod(minutes, 60)
-                time_str = f"{int(hours)}h {int(minutes)}m {seconds:.2f}s"
-                
-                # 【修改】更新控制台输出，增加视频统计
-                console_message = (
-                    f"\n>>>>>>>>> 完成用户 '{user_name}' 的处理，总耗时: {time_str} <<<<<<<<<\n"
-                    f"  - 本次处理动态数: {stats['processed_posts']}\n"
-                    f"  - 成功下载图片数: {stats['downloaded_images']}\n"
-                    f"  - 成功下载实况图片(live photo)数: {stats.get('downloaded_videos', 0)}\n"
-                    f"  - 下载失败项目数: {stats['failed_images']}\n"
-                    f">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>"
-                )
-                print(console_message)
-                
-                log_entry_obj = LogEntry(
-                    user_id=user_id,
-                    user_name=user_name,
-                    timestamp=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    duration=time_str,
-                    duration_seconds=round(duration, 2),
-                    processed_posts=stats['processed_posts'],
-                    downloaded_images=stats['downloaded_images'],
-                    downloaded_videos=stats.get('downloaded_videos', 0), # 【新增】
-                    failed_images=stats['failed_images']
-                )
-
-                self._write_log(summary_log_path, asdict(log_entry_obj))
+            max_parallel = min(self.config.MAX_PARALLEL_USERS, len(user_ids))
+            if max_parallel <= 1:
+                for user_id in user_ids:
+                    self._process_one_user(user_id)
+            else:
+                self._process_users_parallel(user_ids, max_parallel)
+
+            # 【新增】下载连接池的复用统计，用于确认 keep-alive 是否生效
+            conn_stats = self.processor.downloader.connection_stats()
+            print(f"\n下载连接统计: 共 {conn_stats['requests']} 次请求，"
+                  f"新建连接 {conn_stats['new_connections']} 个，复用连接 {conn_stats['reused_connections']} 次。")
+
+            # 【新增】限速等待统计
+            print("限速等待统计:")
+            for endpoint, info in self.rate_limiter.report().items():
+                print(f"  - {endpoint}: 累计等待 {info['wait_seconds']:.2f} 秒，被限流 {info['throttled']} 次，当前速度 {info['rate']} 次/秒")
+
+            # 【新增】各阶段耗时统计
+            self._print_metrics()
 
             print(f"\n所有任务已完成！")
             print(f"详细运行日志已保存到: {os.path.abspath(console_log_path)}")
@@ -163,5 +289,16 @@ class Application:
         except KeyboardInterrupt:
             print("\n\n程序被用户中断。正在退出...")
         finally:
+            # 【新增】写出 Prometheus textfile (中断时同样写出已有的统计)
+            if self.config.METRICS_TEXTFILE:
+                try:
+                    self.metrics.write_prometheus(self.config.METRICS_TEXTFILE)
+                except OSError as e:
+                    print(f"警告：写入 Prometheus 指标文件失败: {e}")
+            # 【新增】释放下载器的连接与线程 (asyncio 后端还会停止事件循环)
+            self.processor.downloader.close()
+            # 【新增】关闭下载归档数据库 (WAL 模式下会把日志合并回主文件)
+            self.processor.archive.close()
+            sys.stdout.flush()
             sys.stdout = original_stdout
             log_file.close()
\ No newline at end of file
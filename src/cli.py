@@ -36,7 +36,40 @@ def parse_args() -> Dict[str, Any]:
     retry_group.add_argument('--no-retry', action='store_false', dest='retry_failed', default=None,
                         help='强制关闭失败重试功能（覆盖配置文件）')
     
-    # 4. 解析参数
+    # --- 4. 【新增】断点续传 ---
+    parser.add_argument('--resume', action='store_true',
+                        help='从上次中断的位置继续翻页（仅 ITERATIVE 模式），不再从第一页重新遍历')
+
+    # --- 5. 【新增】维护命令 (执行后直接退出，不下载) ---
+    parser.add_argument('--migrate-archive', action='store_true',
+                        help='扫描输出目录中已下载的文件，导入 SQLite 下载归档后退出')
+
+    parser.add_argument('--rebuild-folder-index', action='store_true',
+                        help='并行扫描输出目录，重建 用户ID → 文件夹 索引后退出')
+
+    parser.add_argument('--convert-step2', action='store_true',
+                        help='将输出目录中旧格式 (缩进 JSON) 的 step2 元数据转换为紧凑格式后退出')
+
+    parser.add_argument('--rebuild-content', action='store_true',
+                        help='按当前的提取规则，用本地 step2 元数据并行重新生成内容信息文件后退出（可配合 -u 只处理指定用户）')
+
+    parser.add_argument('--retry-only', action='store_true',
+                        help='不翻页、不获取元数据，只重试失败表中已到重试时间的资源（多个用户并行，可配合 -u 只处理指定用户）后退出')
+
+    parser.add_argument('--force', action='store_true',
+                        help='配合 --rebuild-content 使用：不跳过内容信息文件比 step2 元数据新的动态；'
+                             '配合 --retry-only 使用：忽略重试时间，重试全部失败资源')
+
+    parser.add_argument('--dedup', action='store_true',
+                        help='按文件内容查找输出目录中重复的图片与视频，替换为硬链接 / reflink 并报告节省的空间后退出')
+
+    parser.add_argument('--dry-run', action='store_true',
+                        help='配合 --dedup 使用：只统计可以节省的空间，不修改文件')
+
+    parser.add_argument('--log-stats', action='store_true',
+                        help='按用户汇总处理摘要日志（平均 / P95 耗时、下载速度、失败率）后退出')
+
+    # 6. 解析参数
     args = parser.parse_args()
     
     # 将解析结果转换为字典返回
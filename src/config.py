@@ -2,18 +2,25 @@
 
 import os
 import tomllib
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+
+from gallery_dl_backend import SUPPORTED_BACKENDS
+from services.dedup import DEDUP_OFF, SUPPORTED_DEDUP_MODES
+from services.downloader import DOWNLOAD_BACKEND_THREADS, SUPPORTED_DOWNLOAD_BACKENDS
+from services.step2_store import STEP2_FORMAT_COMPACT, SUPPORTED_STEP2_FORMATS
 
 class Config:
     """
     应用程序配置类。
     支持 命令行 > 配置文件 > 报错 的优先级逻辑。
     """
-    def __init__(self):
+    def __init__(self, config_path: Optional[str] = None):
+        """:param config_path: 【新增】配置文件路径，默认为项目根目录下的 config.toml (基准测试使用生成的配置文件)。"""
         # 1. 自动定位 config.toml 文件
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        project_root = os.path.dirname(current_dir)
-        config_path = os.path.join(project_root, 'config.toml')
+        if config_path is None:
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            project_root = os.path.dirname(current_dir)
+            config_path = os.path.join(project_root, 'config.toml')
 
         if not os.path.exists(config_path):
             raise FileNotFoundError(f"配置文件未找到: {config_path}")
@@ -32,14 +39,58 @@ class Config:
         # 【关键修改】使用 .get()，如果 TOML 里没有，就先设为 None
         self.RETRY_FAILED = data.get("retry_failed") 
         self.USERS_ID = data.get("users_id")
+        # 【新增】断点续传，仅可通过命令行 --resume 开启
+        self.RESUME = False
         
         # 静态参数直接读取
         self.DOWNLOAD_MODE = data["download_mode"]
         self.INCREMENTAL_DOWNLOAD = data["incremental_download"]
+        # 【新增】增量模式下连续遇到多少条已下载的动态后停止 (置顶动态不计入)
+        self.INCREMENTAL_STOP_AFTER = data.get("incremental_stop_after", 3)
         self.COOKIE_FILE_PATH = data["cookie_file_path"]
         self.OUTPUT_DIR_PATH = data["output_dir_path"]
         self.USER_ID_TO_NAME_MAP = data.get("user_id_map", {})
 
+        # 【新增】可选的性能参数 (未填写时使用默认值)
+        self.EXTRACTION_BACKEND = data.get("extraction_backend", "subprocess")
+        self.HTTP_POOL_SIZE = data.get("http_pool_size", 10)
+        self.MAX_CONCURRENT_DOWNLOADS = data.get("max_concurrent_downloads", 4)
+        # 【新增】下载后端与 asyncio 后端的最大并发连接数
+        self.DOWNLOAD_BACKEND = data.get("download_backend", DOWNLOAD_BACKEND_THREADS)
+        self.ASYNC_MAX_CONNECTIONS = data.get("async_max_connections", 64)
+        self.MAX_PARALLEL_USERS = data.get("max_parallel_users", 1)
+        self.FEED_PREFETCH_PAGES = data.get("feed_prefetch_pages", 1)
+        self.METADATA_BATCH_SIZE = data.get("metadata_batch_size", 25)
+        # 【新增】step2 元数据的存储格式
+        self.STEP2_FORMAT = data.get("step2_format", STEP2_FORMAT_COMPACT)
+        # 【新增】下载归档数据库路径，默认保存在输出目录下
+        self.ARCHIVE_DB_PATH = data.get("archive_db_path") or os.path.join(self.OUTPUT_DIR_PATH, "archive.sqlite3")
+        # 【新增】跨用户去重方式
+        self.DEDUP_MODE = data.get("dedup_mode", DEDUP_OFF)
+        # 【新增】Prometheus textfile 路径，不填写时不写出
+        self.METRICS_TEXTFILE = data.get("metrics_textfile")
+
+        # 【新增】流水线模式 ([pipeline] 表)
+        pipeline = data.get("pipeline", {})
+        self.PIPELINE_ENABLED = pipeline.get("enabled", False)
+        self.PIPELINE_METADATA_WORKERS = pipeline.get("metadata_workers", 2)
+        self.PIPELINE_DOWNLOAD_WORKERS = pipeline.get("download_workers", 2)
+        self.PIPELINE_QUEUE_SIZE = pipeline.get("queue_size", 8)
+
+        # 【新增】延迟重试队列 ([retry_queue] 表)
+        retry_queue = data.get("retry_queue", {})
+        self.RETRY_QUEUE_ENABLED = retry_queue.get("enabled", True)
+        self.RETRY_QUEUE_MAX_ATTEMPTS = retry_queue.get("max_attempts", 3)
+        self.RETRY_QUEUE_BASE_DELAY = retry_queue.get("base_delay", 2.0)
+        self.RETRY_QUEUE_MAX_DELAY = retry_queue.get("max_delay", 60.0)
+
+        # 【新增】自适应限速 ([rate_limit] 表)，速度单位为 次/秒
+        rate_limit = data.get("rate_limit", {})
+        self.RATE_LIMIT_FEED = rate_limit.get("feed", 1.0)
+        self.RATE_LIMIT_METADATA = rate_limit.get("metadata", 1.0)
+        self.RATE_LIMIT_CDN = rate_limit.get("cdn", 20.0)
+        self.RATE_LIMIT_RECOVERY_SUCCESSES = rate_limit.get("recovery_successes", 20)
+
     def _validate_toml_basic(self, data: Dict[str, Any]):
         """仅验证那些 CLI 无法覆盖的基础字段，或者字段存在时的类型检查。"""
         
@@ -67,10 +118,90 @@ class Config:
                 if not isinstance(uid, int):
                     raise TypeError(f"配置错误: 'users_id' 列表包含非整数项")
 
+        if "extraction_backend" in data and data["extraction_backend"] not in SUPPORTED_BACKENDS:
+            raise ValueError(f"配置错误: 'extraction_backend' 必须是 'subprocess' 或 'inprocess'")
+
+        if "http_pool_size" in data and (not isinstance(data["http_pool_size"], int) or data["http_pool_size"] < 1):
+            raise TypeError(f"配置错误: 'http_pool_size' 必须是正整数")
+
+        if "max_concurrent_downloads" in data and (not isinstance(data["max_concurrent_downloads"], int) or data["max_concurrent_downloads"] < 1):
+            raise TypeError(f"配置错误: 'max_concurrent_downloads' 必须是正整数")
+
+        if "download_backend" in data and data["download_backend"] not in SUPPORTED_DOWNLOAD_BACKENDS:
+            raise ValueError(f"配置错误: 'download_backend' 必须是 'threads' 或 'asyncio'")
+
+        if "async_max_connections" in data and (not isinstance(data["async_max_connections"], int) or data["async_max_connections"] < 1):
+            raise TypeError(f"配置错误: 'async_max_connections' 必须是正整数")
+
+        if "max_parallel_users" in data and (not isinstance(data["max_parallel_users"], int) or data["max_parallel_users"] < 1):
+            raise TypeError(f"配置错误: 'max_parallel_users' 必须是正整数")
+
+        if "incremental_stop_after" in data and (not isinstance(data["incremental_stop_after"], int) or data["incremental_stop_after"] < 1):
+            raise TypeError(f"配置错误: 'incremental_stop_after' 必须是正整数")
+
+        if "feed_prefetch_pages" in data and (not isinstance(data["feed_prefetch_pages"], int) or data["feed_prefetch_pages"] < 0):
+            raise TypeError(f"配置错误: 'feed_prefetch_pages' 必须是非负整数")
+
+        if "metadata_batch_size" in data and (not isinstance(data["metadata_batch_size"], int) or data["metadata_batch_size"] < 1):
+            raise TypeError(f"配置错误: 'metadata_batch_size' 必须是正整数")
+
+        if "step2_format" in data and data["step2_format"] not in SUPPORTED_STEP2_FORMATS:
+            raise ValueError(f"配置错误: 'step2_format' 必须是 'compact' 或 'json'")
+
+        if "archive_db_path" in data and not isinstance(data["archive_db_path"], str):
+            raise TypeError(f"配置错误: 'archive_db_path' 必须是字符串")
+
+        if "dedup_mode" in data and data["dedup_mode"] not in SUPPORTED_DEDUP_MODES:
+            raise ValueError(f"配置错误: 'dedup_mode' 必须是 'off'、'hardlink' 或 'reflink'")
+
+        if "metrics_textfile" in data and not isinstance(data["metrics_textfile"], str):
+            raise TypeError(f"配置错误: 'metrics_textfile' 必须是字符串")
+
+        if "pipeline" in data:
+            self._validate_pipeline(data["pipeline"])
+
+        if "retry_queue" in data:
+            self._validate_retry_queue(data["retry_queue"])
+
+        if "rate_limit" in data:
+            self._validate_rate_limit(data["rate_limit"])
+
         # ... (其他静态字段的检查保持不变) ...
         if not isinstance(data["output_dir_path"], str):
              raise TypeError(f"配置错误: 'output_dir_path' 必须是字符串")
 
+    def _validate_pipeline(self, pipeline: Any):
+        """检查 [pipeline] 表中各字段的类型。"""
+        if not isinstance(pipeline, dict):
+            raise TypeError(f"配置错误: 'pipeline' 必须是表 ([pipeline])")
+        if "enabled" in pipeline and not isinstance(pipeline["enabled"], bool):
+            raise TypeError(f"配置错误: 'pipeline.enabled' 必须是 true 或 false")
+        for key in ("metadata_workers", "download_workers", "queue_size"):
+            if key in pipeline and (not isinstance(pipeline[key], int) or pipeline[key] < 1):
+                raise TypeError(f"配置错误: 'pipeline.{key}' 必须是正整数")
+
+    def _validate_retry_queue(self, retry_queue: Any):
+        """【新增】检查 [retry_queue] 表中各字段的类型。"""
+        if not isinstance(retry_queue, dict):
+            raise TypeError(f"配置错误: 'retry_queue' 必须是表 ([retry_queue])")
+        if "enabled" in retry_queue and not isinstance(retry_queue["enabled"], bool):
+            raise TypeError(f"配置错误: 'retry_queue.enabled' 必须是 true 或 false")
+        if "max_attempts" in retry_queue and (not isinstance(retry_queue["max_attempts"], int) or retry_queue["max_attempts"] < 1):
+            raise TypeError(f"配置错误: 'retry_queue.max_attempts' 必须是正整数")
+        for key in ("base_delay", "max_delay"):
+            if key in retry_queue and (not isinstance(retry_queue[key], (int, float)) or retry_queue[key] < 0):
+                raise TypeError(f"配置错误: 'retry_queue.{key}' 必须是非负数 (秒)")
+
+    def _validate_rate_limit(self, rate_limit: Any):
+        """检查 [rate_limit] 表中各字段的类型。"""
+        if not isinstance(rate_limit, dict):
+            raise TypeError(f"配置错误: 'rate_limit' 必须是表 ([rate_limit])")
+        for key in ("feed", "metadata", "cdn"):
+            if key in rate_limit and (not isinstance(rate_limit[key], (int, float)) or rate_limit[key] <= 0):
+                raise TypeError(f"配置错误: 'rate_limit.{key}' 必须是正数 (次/秒)")
+        if "recovery_successes" in rate_limit and (not isinstance(rate_limit["recovery_successes"], int) or rate_limit["recovery_successes"] < 1):
+            raise TypeError(f"配置错误: 'rate_limit.recovery_successes' 必须是正整数")
+
     def check_final_config(self):
         """
         【新增】最终校验方法。
@@ -1,11 +1,55 @@
 # database.py
 
+import os
+import re
+import time
 import sqlite3
-from typing import Optional
+import datetime
+import threading
+from typing import Any, Optional, Iterable, List, Tuple, Dict, Set
+
+# 资源类型
+KIND_CONTENT = "content"  # 内容信息文件 {date}_{id}.json (idx 固定为 0)
+KIND_IMAGE = "image"
+KIND_VIDEO = "video"
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov')
+
+# meta 表中记录文件夹索引建立时间的键
+FOLDER_INDEX_META_KEY = "folder_index_built_at"
+# 【新增】meta 表中记录某个用户文件夹已导入归档的键 (后接 uid)
+FOLDER_IMPORTED_META_PREFIX = "folder_imported:"
+
+# 【新增】失败资源的重试间隔：第 n 次失败后等待 min(上限, 基础间隔 * 2^(n-1)) 秒才会在正常运行中再次重试
+FAILURE_RETRY_BASE_DELAY = 3600
+FAILURE_RETRY_MAX_DELAY = 7 * 24 * 3600
+
+# 用户文件夹中的文件命名格式
+CONTENT_FILE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2}|unknown_date)_(\d+)\.json$')
+ASSET_FILE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2}|unknown_date)_(\d+)_(\d+)\.(jpg|jpeg|png|gif|webp|mp4|mov)$', re.IGNORECASE)
+
+def kind_from_filename(filename: str) -> str:
+    """根据扩展名判断资源类型。"""
+    return KIND_VIDEO if filename.lower().endswith(VIDEO_EXTENSIONS) else KIND_IMAGE
+
+def failure_retry_delay(attempts: int) -> float:
+    """【新增】资源累计失败 attempts 次后，距离下一次自动重试的秒数。"""
+    return min(FAILURE_RETRY_MAX_DELAY, FAILURE_RETRY_BASE_DELAY * (2 ** max(0, attempts - 1)))
+
+def uid_from_folder_name(folder_name: str) -> Optional[int]:
+    """从 'Name_UID' 格式的文件夹名称中解析用户ID。"""
+    match = re.search(r'_(\d+)$', folder_name)
+    return int(match.group(1)) if match else None
 
 class ArchiveDB:
-    """管理所有与 SQLite 归档数据库的交互。"""
-    
+    """
+    管理所有与 SQLite 归档数据库的交互。
+    【重构】按资源记录下载归档，主键为 (uid, post_id, idx, kind)：
+    - 判断动态 / 资源是否存在时使用主键前缀查询，可以直接利用索引；
+    - 每条动态的所有资源在同一个事务中批量写入；
+    - 开启 WAL 模式，读写互不阻塞；连接可在多个线程间共享 (内部加锁)。
+    """
+
     def __init__(self, db_path: str):
         """
         初始化数据库连接。
@@ -13,9 +57,12 @@ class ArchiveDB:
         """
         self.db_path = db_path
         self.conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
         try:
             # Application 类会提前创建好目录，所以这里直接连接
-            self.conn = sqlite3.connect(self.db_path)
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
             self._create_table()
         except sqlite3.Error as e:
             print(f"致命错误：无法连接到数据库 {self.db_path}: {e}")
@@ -25,61 +72,431 @@ class ArchiveDB:
         """如果归档表不存在，则创建它。"""
         if self.conn:
             with self.conn:
-                self.conn.execute("CREATE TABLE IF NOT EXISTS archive (entry TEXT PRIMARY KEY) WITHOUT ROWID")
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS assets ("
+                    " uid INTEGER NOT NULL,"
+                    " post_id TEXT NOT NULL,"
+                    " idx INTEGER NOT NULL,"
+                    " kind TEXT NOT NULL,"
+                    " filename TEXT,"
+                    " PRIMARY KEY (uid, post_id, idx, kind)"
+                    ") WITHOUT ROWID"
+                )
+                # 仅按动态ID查询时 (不知道 uid) 使用
+                self.conn.execute("CREATE INDEX IF NOT EXISTS idx_assets_post_id ON assets (post_id)")
+                # 【新增】用户ID → 文件夹名称 / 用户名 索引 (由 FolderNameResolver 维护)
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS user_folders ("
+                    " uid INTEGER PRIMARY KEY,"
+                    " folder_name TEXT NOT NULL,"
+                    " username TEXT"
+                    ")"
+                )
+                self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+                # 【新增】每个用户的动态列表翻页游标 (运行日志)，用于中断后的断点续传
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS feed_cursors ("
+                    " uid INTEGER PRIMARY KEY,"
+                    " page_offset TEXT NOT NULL,"
+                    " last_opus_id TEXT NOT NULL,"
+                    " updated_at TEXT NOT NULL"
+                    ")"
+                )
+                # 【新增】下载失败的资源 (替代各用户文件夹中的 undownloaded.json)
+                # attempts 为失败次数 (每次运行用完重试次数后记一次)，next_attempt_at 之前的正常运行不会重试
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS failures ("
+                    " uid INTEGER NOT NULL,"
+                    " post_id TEXT NOT NULL,"
+                    " idx INTEGER NOT NULL,"
+                    " kind TEXT NOT NULL,"
+                    " url TEXT NOT NULL,"
+                    " pub_ts INTEGER,"
+                    " user_name TEXT,"
+                    " folder_name TEXT NOT NULL,"
+                    " attempts INTEGER NOT NULL,"
+                    " last_error TEXT,"
+                    " next_attempt_at REAL NOT NULL,"
+                    " updated_at TEXT NOT NULL,"
+                    " PRIMARY KEY (uid, post_id, idx, kind)"
+                    ") WITHOUT ROWID"
+                )
+                # --retry-only 按到期时间取出所有用户的失败资源
+                self.conn.execute("CREATE INDEX IF NOT EXISTS idx_failures_next_attempt ON failures (next_attempt_at)")
+                # 【新增】内容寻址的资源索引：CDN 路径 → 第一次下载到的本地文件 (跨用户去重)
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS blobs ("
+                    " cdn_path TEXT PRIMARY KEY,"
+                    " filepath TEXT NOT NULL,"
+                    " size INTEGER NOT NULL"
+                    ") WITHOUT ROWID"
+                )
+                # 【新增】每个用户的增量同步高水位线
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS watermarks ("
+                    " uid INTEGER PRIMARY KEY,"
+                    " max_opus_id TEXT,"
+                    " max_pub_ts INTEGER,"
+                    " updated_at TEXT NOT NULL"
+                    ")"
+                )
 
-    def exists(self, entry: str) -> bool:
-        """
-        检查一个条目是否存在于归档中。
-        :param entry: 要检查的条目字符串。
-        :return: 如果存在则返回 True，否则返回 False。
-        """
+    def _query_one(self, sql: str, params: Tuple) -> bool:
         if not self.conn:
             return False
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT 1 FROM archive WHERE entry = ?", (entry,))
-            return cursor.fetchone() is not None
+            with self._lock:
+                return self.conn.execute(sql, params).fetchone() is not None
         except sqlite3.Error as e:
             print(f"  - 警告：无法查询归档数据库: {e}")
             return False
-            
-    # --- 新增方法 ---
+
+    def post_exists(self, uid: int, post_id: str) -> bool:
+        """动态是否已完整归档 (内容信息文件已生成)。"""
+        return self._query_one(
+            "SELECT 1 FROM assets WHERE uid = ? AND post_id = ? AND idx = 0 AND kind = ?",
+            (uid, str(post_id), KIND_CONTENT))
+
+    def asset_exists(self, uid: int, post_id: str, idx: int, kind: str) -> bool:
+        """单个资源 (图片 / 实况视频) 是否已归档。"""
+        return self._query_one(
+            "SELECT 1 FROM assets WHERE uid = ? AND post_id = ? AND idx = ? AND kind = ?",
+            (uid, str(post_id), idx, kind))
+
     def id_exists(self, id_str: str) -> bool:
         """
-        使用模糊搜索检查一个动态 ID 是否已存在于归档中。
-        这用于实现增量下载功能。
-        :param id_str: 要检查的 Bilibili 动态 ID 字符串。
-        :return: 如果数据库中存在任何以 'bilibili{id_str}_' 开头的条目，则返回 True。
+        检查一个动态 ID 是否已存在于归档中 (不限用户)。
+        【修改】使用 post_id 索引做等值查询，替代原来无法使用索引的 LIKE 'bilibili{id}_%' 扫描。
         """
+        return self._query_one("SELECT 1 FROM assets WHERE post_id = ? LIMIT 1", (str(id_str),))
+
+    def user_posts(self, uid: int) -> Dict[str, str]:
+        """返回用户所有已归档动态的 {post_id: 内容信息文件名}，使用主键前缀范围查询。"""
         if not self.conn:
-            return False
+            return {}
         try:
-            cursor = self.conn.cursor()
-            # 使用 LIKE 模式匹配，例如 'bilibili12345_%'
-            pattern = f"bilibili{id_str}_%"
-            cursor.execute("SELECT 1 FROM archive WHERE entry LIKE ? LIMIT 1", (pattern,))
-            return cursor.fetchone() is not None
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT post_id, filename FROM assets WHERE uid = ? AND kind = ?",
+                    (uid, KIND_CONTENT)).fetchall()
+            return {post_id: filename for post_id, filename in rows}
         except sqlite3.Error as e:
-            print(f"  - 警告：无法查询归档数据库中的 ID: {e}")
-            return False
-    # --- 新增结束 ---
+            print(f"  - 警告：无法查询归档数据库: {e}")
+            return {}
+
+    def post_assets(self, uid: int, post_id: str) -> Set[Tuple[int, str]]:
+        """返回一条动态已归档的资源集合 {(idx, kind)}。"""
+        if not self.conn:
+            return set()
+        try:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT idx, kind FROM assets WHERE uid = ? AND post_id = ?",
+                    (uid, str(post_id))).fetchall()
+            return {(idx, kind) for idx, kind in rows}
+        except sqlite3.Error as e:
+            print(f"  - 警告：无法查询归档数据库: {e}")
+            return set()
+
+    def has_user(self, uid: int) -> bool:
+        """归档中是否已有该用户的任何记录。"""
+        return self._query_one("SELECT 1 FROM assets WHERE uid = ? LIMIT 1", (uid,))
+
+    def user_folder_imported(self, uid: int) -> bool:
+        """
+        【新增】用户文件夹中已有的文件是否已导入过归档。
+        不能用 has_user 判断：导入之前重试成功的资源同样会写入该用户的记录。
+        """
+        return self._query_one("SELECT 1 FROM meta WHERE key = ?", (f"{FOLDER_IMPORTED_META_PREFIX}{uid}",))
 
-    def add(self, entry: str):
+    def add_assets(self, uid: int, post_id: str, entries: Iterable[Tuple[int, str, str]]):
         """
-        向归档中添加一个新条目。
-        :param entry: 要添加的条目字符串。
+        在一个事务中批量写入同一条动态的资源。
+        :param entries: [(idx, kind, filename), ...]
         """
+        rows = [(uid, str(post_id), idx, kind, filename) for idx, kind, filename in entries]
+        try:
+            self._insert_rows(rows)
+        except sqlite3.Error as e:
+            print(f"  - 警告：写入动态 {post_id} 的归档记录失败: {e}")
+
+    def _insert_rows(self, rows: list):
+        """在一个事务中写入多行记录。"""
+        if not self.conn or not rows:
+            return
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO assets (uid, post_id, idx, kind, filename) VALUES (?, ?, ?, ?, ?)", rows)
+            # 【新增】已归档的资源不再是失败资源
+            self.conn.executemany(
+                "DELETE FROM failures WHERE uid = ? AND post_id = ? AND idx = ? AND kind = ?",
+                [row[:4] for row in rows])
+
+    def add(self, uid: int, post_id: str, idx: int, kind: str, filename: str):
+        """向归档中添加单个资源。"""
+        self.add_assets(uid, post_id, [(idx, kind, filename)])
+
+    def import_user_folder(self, uid: int, user_folder: str) -> int:
+        """
+        扫描用户文件夹中已下载的文件并写入归档 (用于迁移旧数据)。
+        返回写入的记录数。
+        """
+        if not self.conn or not os.path.isdir(user_folder):
+            return 0
+        by_post: Dict[str, list] = {}
+        with os.scandir(user_folder) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                content_match = CONTENT_FILE_PATTERN.match(entry.name)
+                if content_match:
+                    by_post.setdefault(content_match.group(2), []).append((0, KIND_CONTENT, entry.name))
+                    continue
+                asset_match = ASSET_FILE_PATTERN.match(entry.name)
+                if asset_match:
+                    by_post.setdefault(asset_match.group(2), []).append(
+                        (int(asset_match.group(3)), kind_from_filename(entry.name), entry.name))
+
+        rows = [(uid, post_id, idx, kind, filename) for post_id, items in by_post.items() for idx, kind, filename in items]
+        try:
+            self._insert_rows(rows)
+            with self._lock, self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                  (f"{FOLDER_IMPORTED_META_PREFIX}{uid}", str(int(time.time()))))
+        except sqlite3.Error as e:
+            print(f"  - 警告：导入文件夹 {user_folder} 到归档失败: {e}")
+            return 0
+        return len(rows)
+
+    def get_user_folder(self, uid: int) -> Optional[Tuple[str, Optional[str]]]:
+        """【新增】返回索引中记录的 (文件夹名称, 用户名)，没有记录时返回 None。"""
+        if not self.conn:
+            return None
+        try:
+            with self._lock:
+                row = self.conn.execute(
+                    "SELECT folder_name, username FROM user_folders WHERE uid = ?", (uid,)).fetchone()
+            return (row[0], row[1]) if row else None
+        except sqlite3.Error as e:
+            print(f"  - 警告：无法查询归档数据库: {e}")
+            return None
+
+    def set_user_folder(self, uid: int, folder_name: str, username: Optional[str] = None):
+        """【新增】记录用户的文件夹名称；username 为 None 时保留已缓存的用户名。"""
         if not self.conn:
             return
         try:
-            with self.conn:
-                self.conn.execute("INSERT INTO archive (entry) VALUES (?)", (entry,))
-            print(f"  - 已添加到归档: {entry}")
+            with self._lock, self.conn:
+                self.conn.execute(
+                    "INSERT INTO user_folders (uid, folder_name, username) VALUES (?, ?, ?) "
+                    "ON CONFLICT(uid) DO UPDATE SET folder_name = excluded.folder_name, "
+                    "username = COALESCE(excluded.username, user_folders.username)",
+                    (uid, folder_name, username))
+        except sqlite3.Error as e:
+            print(f"  - 警告：写入用户 {uid} 的文件夹索引失败: {e}")
+
+    def replace_user_folders(self, rows: Iterable[Tuple[int, str, Optional[str]]], built_at: str):
+        """
+        【新增】在一个事务中用重新扫描的结果替换整个文件夹索引。
+        :param rows: [(uid, folder_name, username), ...]
+        :param built_at: 索引建立时间，写入 meta 表，用于判断索引是否已建立。
+        """
+        if not self.conn:
+            return
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM user_folders")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO user_folders (uid, folder_name, username) VALUES (?, ?, ?)", list(rows))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (FOLDER_INDEX_META_KEY, built_at))
+
+    def folder_index_built(self) -> bool:
+        """【新增】文件夹索引是否已经完整建立过一次。"""
+        return self._query_one("SELECT 1 FROM meta WHERE key = ?", (FOLDER_INDEX_META_KEY,))
+
+    def get_feed_cursor(self, uid: int) -> Optional[Tuple[str, str]]:
+        """【新增】返回用户记录的 (翻页游标, 最后处理完成的动态ID)，没有记录时返回 None。"""
+        if not self.conn:
+            return None
+        try:
+            with self._lock:
+                row = self.conn.execute(
+                    "SELECT page_offset, last_opus_id FROM feed_cursors WHERE uid = ?", (uid,)).fetchone()
+            return (row[0], row[1]) if row else None
+        except sqlite3.Error as e:
+            print(f"  - 警告：无法查询归档数据库: {e}")
+            return None
+
+    def save_feed_cursor(self, uid: int, page_offset: str, last_opus_id: str, updated_at: str):
+        """【新增】记录用户的翻页游标与最后处理完成的动态ID。"""
+        if not self.conn:
+            return
+        try:
+            with self._lock, self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO feed_cursors (uid, page_offset, last_opus_id, updated_at) VALUES (?, ?, ?, ?)",
+                    (uid, page_offset, last_opus_id, updated_at))
+        except sqlite3.Error as e:
+            print(f"  - 警告：写入用户 {uid} 的翻页游标失败: {e}")
+
+    def clear_feed_cursor(self, uid: int):
+        """【新增】用户的动态列表已处理完毕，删除翻页游标。"""
+        if not self.conn:
+            return
+        try:
+            with self._lock, self.conn:
+                self.conn.execute("DELETE FROM feed_cursors WHERE uid = ?", (uid,))
+        except sqlite3.Error as e:
+            print(f"  - 警告：删除用户 {uid} 的翻页游标失败: {e}")
+
+    def get_watermark(self, uid: int) -> Optional[Tuple[Optional[int], Optional[int]]]:
+        """【新增】返回用户的高水位线 (最大动态ID, 最大发布时间戳)，没有记录时返回 None。"""
+        if not self.conn:
+            return None
+        try:
+            with self._lock:
+                row = self.conn.execute(
+                    "SELECT max_opus_id, max_pub_ts FROM watermarks WHERE uid = ?", (uid,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"  - 警告：无法查询归档数据库: {e}")
+            return None
+        if not row:
+            return None
+        return (int(row[0]) if row[0] else None), row[1]
+
+    def save_watermark(self, uid: int, max_opus_id: Optional[int], max_pub_ts: Optional[int], updated_at: str):
+        """【新增】保存用户的高水位线。"""
+        if not self.conn:
+            return
+        try:
+            with self._lock, self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO watermarks (uid, max_opus_id, max_pub_ts, updated_at) VALUES (?, ?, ?, ?)",
+                    (uid, str(max_opus_id) if max_opus_id is not None else None, max_pub_ts, updated_at))
+        except sqlite3.Error as e:
+            print(f"  - 警告：写入用户 {uid} 的高水位线失败: {e}")
+
+    def record_failures(self, rows: Iterable[Tuple[int, str, int, str, str, Optional[int], Optional[str], str, Optional[str]]],
+                        increment: bool = True) -> int:
+        """
+        【新增】在一个事务中记录下载失败的资源，返回写入的行数。
+        :param rows: [(uid, post_id, idx, kind, url, pub_ts, user_name, folder_name, last_error), ...]
+        :param increment: 为 True 时失败次数加一，并按失败次数推迟下一次自动重试的时间；
+                          为 False 时 (导入旧的 undownloaded.json) 已有记录保持不变，新记录可以立即重试。
+        """
+        rows = list(rows)
+        if not self.conn or not rows:
+            return 0
+        now = time.time()
+        updated_at = datetime.datetime.now().isoformat(timespec='seconds')
+        written = 0
+        try:
+            with self._lock, self.conn:
+                for uid, post_id, idx, kind, url, pub_ts, user_name, folder_name, last_error in rows:
+                    existing = self.conn.execute(
+                        "SELECT attempts FROM failures WHERE uid = ? AND post_id = ? AND idx = ? AND kind = ?",
+                        (uid, str(post_id), idx, kind)).fetchone()
+                    if not increment and existing:
+                        continue
+                    attempts = (existing[0] if existing else 0) + (1 if increment else 0)
+                    next_attempt_at = now + failure_retry_delay(attempts) if increment else now
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO failures (uid, post_id, idx, kind, url, pub_ts, user_name, folder_name,"
+                        " attempts, last_error, next_attempt_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (uid, str(post_id), idx, kind, url, pub_ts, user_name, folder_name, attempts, last_error,
+                         next_attempt_at, updated_at))
+                    written += 1
+        except sqlite3.Error as e:
+            print(f"  - 警告：写入失败资源记录失败: {e}")
+            return 0
+        return written
+
+    def due_failures(self, uid: Optional[int] = None, include_pending: bool = False) -> List[Dict[str, Any]]:
+        """
+        【新增】返回已到重试时间的失败资源，按用户与动态排序。
+        :param uid: 只返回该用户的记录 (使用主键前缀查询)；为 None 时返回所有用户 (使用到期时间索引)。
+        :param include_pending: 为 True 时忽略重试时间，返回全部记录。
+        """
+        if not self.conn:
+            return []
+        conditions, params = [], []
+        if uid is not None:
+            conditions.append("uid = ?")
+            params.append(uid)
+        if not include_pending:
+            conditions.append("next_attempt_at <= ?")
+            params.append(time.time())
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        try:
+            with self._lock:
+                cursor = self.conn.execute(
+                    "SELECT uid, post_id, idx, kind, url, pub_ts, user_name, folder_name, attempts, last_error"
+                    f" FROM failures{where} ORDER BY uid, post_id, idx", tuple(params))
+                columns = [column[0] for column in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"  - 警告：无法查询归档数据库: {e}")
+            return []
+
+    def count_failures(self, uid: Optional[int] = None) -> int:
+        """【新增】失败资源的数量 (包括尚未到重试时间的)。"""
+        if not self.conn:
+            return 0
+        try:
+            with self._lock:
+                if uid is None:
+                    return self.conn.execute("SELECT COUNT(*) FROM failures").fetchone()[0]
+                return self.conn.execute("SELECT COUNT(*) FROM failures WHERE uid = ?", (uid,)).fetchone()[0]
         except sqlite3.Error as e:
-            print(f"  - 警告：添加 '{entry}' 到归档失败: {e}")
+            print(f"  - 警告：无法查询归档数据库: {e}")
+            return 0
+
+    def get_blob(self, cdn_path: str) -> Optional[Tuple[str, int]]:
+        """【新增】返回 CDN 路径对应的本地文件 (路径, 字节数)，没有记录时返回 None。"""
+        if not self.conn:
+            return None
+        try:
+            with self._lock:
+                row = self.conn.execute("SELECT filepath, size FROM blobs WHERE cdn_path = ?", (cdn_path,)).fetchone()
+            return (row[0], row[1]) if row else None
+        except sqlite3.Error as e:
+            print(f"  - 警告：无法查询归档数据库: {e}")
+            return None
+
+    def add_blob(self, cdn_path: str, filepath: str, size: int, replace: bool = False):
+        """【新增】记录 CDN 路径对应的本地文件；已有记录时保留原记录 (replace 为 True 时覆盖)。"""
+        if not self.conn:
+            return
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        try:
+            with self._lock, self.conn:
+                self.conn.execute(f"{verb} INTO blobs (cdn_path, filepath, size) VALUES (?, ?, ?)",
+                                  (cdn_path, filepath, size))
+        except sqlite3.Error as e:
+            print(f"  - 警告：写入资源索引失败: {e}")
 
     def close(self):
         """关闭数据库连接。"""
         if self.conn:
             self.conn.close()
-            print("\n正在关闭归档数据库连接。")
\ No newline at end of file
+            self.conn = None
+            print("\n正在关闭归档数据库连接。")
+
+def migrate_output_dir(archive: ArchiveDB, base_output_dir: str) -> Tuple[int, int]:
+    """
+    将输出目录中所有 'Name_UID' 格式的用户文件夹导入归档。
+    返回 (导入的用户数, 写入的记录数)。
+    """
+    users, records = 0, 0
+    if not os.path.isdir(base_output_dir):
+        return users, records
+    for folder_name in sorted(os.listdir(base_output_dir)):
+        user_folder = os.path.join(base_output_dir, folder_name)
+        uid = uid_from_folder_name(folder_name)
+        if uid is None or not os.path.isdir(user_folder):
+            continue
+        count = archive.import_user_folder(uid, user_folder)
+        print(f"  - [迁移] {folder_name}: {count} 条记录")
+        users += 1
+        records += count
+    return users, records
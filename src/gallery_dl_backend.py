@@ -0,0 +1,280 @@
+# src/gallery_dl_backend.py
+
+import io
+import json
+import time
+import queue
+import tempfile
+import subprocess
+import threading
+import contextvars
+import http.cookiejar
+from typing import List, Dict, Any, Optional, Iterator
+
+# 可选的后端名称 (对应 config.toml 中的 extraction_backend)
+BACKEND_SUBPROCESS = "subprocess"
+BACKEND_INPROCESS = "inprocess"
+SUPPORTED_BACKENDS = (BACKEND_SUBPROCESS, BACKEND_INPROCESS)
+
+class SubprocessBackend:
+    """
+    传统后端：每个 URL 启动一个 'gallery-dl -j' 子进程并解析其标准输出。
+    作为进程内后端不可用时的保底方案。
+    """
+
+    name = BACKEND_SUBPROCESS
+    # 【新增】支持一次调用提取多个 URL (见 run_many)
+    supports_batch = True
+    # 【新增】启动 gallery-dl 的命令，基准测试中替换为离线的模拟程序 (见 benchmarks/)
+    EXECUTABLE: List[str] = ['gallery-dl']
+
+    def __init__(self, cookie_file: Optional[str], timeout: int = 30):
+        self.cookie_file = cookie_file
+        self.timeout = timeout
+
+    def _build_command(self, urls: List[str], request_interval: Optional[float] = None, jsonl: bool = False) -> List[str]:
+        command = list(self.EXECUTABLE) + ['-j']
+        if jsonl:
+            # 每产生一条消息就输出一行 JSON，而不是结束时一次性输出整个数组
+            command.extend(['-o', 'output.jsonl=true'])
+        if request_interval:
+            command.extend(['--sleep-request', f"{request_interval:.2f}"])
+        command.extend(urls)
+        if self.cookie_file:
+            command.extend(['--cookies', self.cookie_file])
+        return command
+
+    @staticmethod
+    def _decode(stdout: bytes) -> str:
+        try:
+            return stdout.decode('utf-8')
+        except UnicodeDecodeError:
+            return stdout.decode('gbk', errors='ignore')
+
+    def run(self, url: str) -> List[Any]:
+        """执行一次提取，失败时抛出异常 (由调用方负责重试)。"""
+        result = subprocess.run(self._build_command([url]), check=True, capture_output=True, timeout=self.timeout)
+        return json.loads(self._decode(result.stdout))
+
+    def run_many(self, urls: List[str], request_interval: Optional[float] = None) -> List[List[Any]]:
+        """
+        【新增】用一个 'gallery-dl -j' 子进程提取多个 URL。
+        gallery-dl 为每个成功的 URL 依次输出一个 JSON 数组，不支持或出错的 URL 可能没有任何输出，
+        因此这里只返回解析出的数组列表，由调用方按动态 ID 匹配回各个 URL。
+        部分 URL 失败时退出码非零，但其余 URL 的输出仍然有效，不会因此丢弃。
+        :param request_interval: gallery-dl 内部两次请求之间的间隔秒数 (--sleep-request)。
+        """
+        timeout = self.timeout * len(urls) + (request_interval or 0) * len(urls)
+        result = subprocess.run(self._build_command(urls, request_interval), capture_output=True, timeout=timeout)
+        output_text = self._decode(result.stdout)
+
+        documents: List[List[Any]] = []
+        decoder = json.JSONDecoder()
+        position = 0
+        while True:
+            while position < len(output_text) and output_text[position].isspace():
+                position += 1
+            if position >= len(output_text):
+                break
+            try:
+                document, position = decoder.raw_decode(output_text, position)
+            except json.JSONDecodeError:
+                # 输出被截断 (例如进程异常退出)，保留已经解析出的部分
+                break
+            documents.append(document)
+        return documents
+
+    def stream(self, url: str) -> Iterator[List[Any]]:
+        """
+        【新增】流式提取：逐行读取 gallery-dl 的输出，每解析出一条消息就立即产出，不缓存整个输出。
+        超时只统计等待 gallery-dl 输出的时间，调用方处理消息 (例如下载) 期间不计入。
+        提前关闭生成器时终止子进程；进程以非零状态退出时，在产出全部消息后抛出 CalledProcessError。
+        """
+        command = self._build_command([url], jsonl=True)
+        # stderr 写入临时文件，避免管道写满导致子进程阻塞
+        with tempfile.TemporaryFile() as stderr_file:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file)
+            waiting_since = [time.monotonic()]
+            timed_out = threading.Event()
+            finished = threading.Event()
+
+            def watchdog():
+                while not finished.wait(1):
+                    started = waiting_since[0]
+                    if started is not None and time.monotonic() - started > self.timeout:
+                        timed_out.set()
+                        process.kill()
+                        return
+
+            threading.Thread(target=watchdog, name="gallery-dl-watchdog", daemon=True).start()
+            try:
+                for line in process.stdout:
+                    waiting_since[0] = None
+                    line = line.strip()
+                    if line:
+                        yield json.loads(self._decode(line))
+                    waiting_since[0] = time.monotonic()
+                process.wait()
+                if timed_out.is_set():
+                    raise subprocess.TimeoutExpired(command, self.timeout)
+                if process.returncode != 0:
+                    stderr_file.seek(0)
+                    raise subprocess.CalledProcessError(process.returncode, command,
+                                                        stderr=self._decode(stderr_file.read()))
+            finally:
+                finished.set()
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+                process.stdout.close()
+
+class _SinkList(list):
+    """【新增】把 append 转交给回调、自身不保存任何元素的列表，用于替换 DataJob 内部累积结果的列表。"""
+
+    def __init__(self, sink=None):
+        super().__init__()
+        self._sink = sink
+
+    def append(self, item):
+        if self._sink is not None:
+            self._sink(item)
+
+# 流式提取线程结束标记
+_END_OF_STREAM = object()
+
+class InProcessBackend:
+    """
+    进程内后端：直接在当前 Python 进程中驱动 gallery-dl 的 extractor / DataJob。
+    - gallery-dl 模块只导入一次，配置只加载一次；
+    - cookie 文件只读取一次；首个 extractor 初始化出的会话 (cookie jar + 连接池)
+      会被同类 extractor 复用，避免每条动态重新建立 TLS 连接；
+    - 返回结果与 'gallery-dl -j' 的输出完全一致 (列表套列表)。
+    """
+
+    name = BACKEND_INPROCESS
+
+    def __init__(self, cookie_file: Optional[str], timeout: int = 30):
+        self.cookie_file = cookie_file
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # extractor 类别 -> 已初始化的共享会话
+        self._sessions: Dict[str, Any] = {}
+
+        # 导入失败时直接抛出 ImportError，由 create_backend 回退到子进程模式
+        from gallery_dl import config as gdl_config, job as gdl_job, extractor as gdl_extractor
+        self._setup(gdl_config)
+        self._job_module = gdl_job
+        self._extractor_module = gdl_extractor
+
+    def _setup(self, gdl_config):
+        """加载 gallery-dl 默认配置文件，并注入 cookie 与超时设置 (整个运行期间只执行一次)。"""
+        with self._lock:
+            gdl_config.load()
+            gdl_config.set(("extractor",), "timeout", self.timeout)
+            cookies = self._load_cookie_dict()
+            if cookies:
+                gdl_config.set(("extractor",), "cookies", cookies)
+
+    def _load_cookie_dict(self) -> Dict[str, str]:
+        """将 Netscape 格式的 cookie 文件读取为 {name: value} 字典。"""
+        if not self.cookie_file:
+            return {}
+        try:
+            jar = http.cookiejar.MozillaCookieJar(self.cookie_file)
+            jar.load(ignore_discard=True, ignore_expires=True)
+            return {cookie.name: cookie.value for cookie in jar if "bilibili" in cookie.domain}
+        except Exception as e:
+            print(f"  - 警告：进程内后端加载 cookie 文件失败: {e}")
+            return {}
+
+    def _create_extractor(self, url: str):
+        """查找 URL 对应的 extractor，并挂载同类别的共享会话。"""
+        extr = self._extractor_module.find(url)
+        if extr is None:
+            raise ValueError(f"gallery-dl 不支持该 URL: {url}")
+
+        with self._lock:
+            session = self._sessions.get(extr.category)
+            if session is None:
+                # 第一个 extractor 负责创建会话并加载 cookie，之后的同类 extractor 直接复用
+                extr.initialize()
+                self._sessions[extr.category] = extr.session
+            else:
+                extr.session = session
+        return extr
+
+    def run(self, url: str) -> List[Any]:
+        """执行一次提取，失败时抛出异常 (由调用方负责重试)。"""
+        buffer = io.StringIO()
+        data_job = self._job_module.DataJob(self._create_extractor(url), file=buffer, ensure_ascii=False)
+        data_job.run()
+        # 通过 DataJob 自身的 JSON 序列化再解析一次，保证与 '-j' 的输出结构 (datetime 等类型的转换) 一致
+        return json.loads(buffer.getvalue())
+
+    def stream(self, url: str) -> Iterator[List[Any]]:
+        """
+        【新增】流式提取：在后台线程中运行 DataJob，把它内部累积结果的列表换成直接推入队列的列表，
+        每条消息产生后立即交给调用方，DataJob 不再在内存中保留全部结果。
+        队列有界，调用方处理不过来时提取线程自动暂停；提前关闭生成器时提取线程随之停止。
+        """
+        from gallery_dl import util as gdl_util, exception as gdl_exception
+
+        messages: "queue.Queue" = queue.Queue(maxsize=64)
+        cancelled = threading.Event()
+        errors: List[BaseException] = []
+
+        def push(message):
+            # 经过与 '-j' 相同的 JSON 序列化，保证产出的结构与子进程后端一致
+            item = json.loads(gdl_util.json_dumps(message))
+            while not cancelled.is_set():
+                try:
+                    messages.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+            raise gdl_exception.StopExtraction()
+
+        def worker():
+            try:
+                data_job = self._job_module.DataJob(self._create_extractor(url), file=None, ensure_ascii=False)
+                data_job.data = _SinkList(push)
+                data_job.data_urls = _SinkList()
+                data_job.data_post = _SinkList()
+                data_job.data_meta = _SinkList()
+                data_job.run()
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                messages.put(_END_OF_STREAM)
+
+        threading.Thread(target=contextvars.copy_context().run, args=(worker,), name="gallery-dl-stream", daemon=True).start()
+        try:
+            while True:
+                item = messages.get()
+                if item is _END_OF_STREAM:
+                    break
+                yield item
+            if errors and not cancelled.is_set():
+                raise errors[0]
+        finally:
+            cancelled.set()
+            # 释放可能阻塞在 put 上的提取线程
+            while True:
+                try:
+                    messages.get_nowait()
+                except queue.Empty:
+                    break
+
+def create_backend(name: str, cookie_file: Optional[str], timeout: int = 30):
+    """
+    根据名称创建提取后端。
+    进程内后端初始化失败 (例如未安装 gallery-dl Python 模块) 时，自动回退到子进程后端。
+    """
+    if name == BACKEND_INPROCESS:
+        try:
+            backend = InProcessBackend(cookie_file, timeout)
+            print("  - [后端] 使用进程内 gallery-dl 提取后端。")
+            return backend
+        except Exception as e:
+            print(f"  - 警告：无法初始化进程内 gallery-dl 后端 ({e})，回退到子进程模式。")
+    return SubprocessBackend(cookie_file, timeout)
@@ -5,6 +5,8 @@ from app import Application
 from config import Config
 from cli import parse_args, VERSION
 from dependency import check_dependencies
+from maintenance import (migrate_archive, rebuild_folder_index, convert_step2_metadata, rebuild_content,
+                         show_log_stats, retry_failed_downloads, dedup_output_dir)
 
 def main():
     """
@@ -22,6 +24,29 @@ def main():
         # 创建配置对象 (加载 config.toml)
         app_config = Config()
 
+        # 【新增】维护命令：不需要用户列表，执行完成后直接退出
+        if args.get('migrate_archive'):
+            migrate_archive(app_config)
+            return
+        if args.get('rebuild_folder_index'):
+            rebuild_folder_index(app_config)
+            return
+        if args.get('convert_step2'):
+            convert_step2_metadata(app_config)
+            return
+        if args.get('rebuild_content'):
+            rebuild_content(app_config, args.get('uid'), args.get('force'))
+            return
+        if args.get('log_stats'):
+            show_log_stats(app_config)
+            return
+        if args.get('dedup'):
+            dedup_output_dir(app_config, args.get('dry_run'))
+            return
+        if args.get('retry_only'):
+            retry_failed_downloads(app_config, args.get('uid'), args.get('force'))
+            return
+
         # ==================== 1. 处理 retry_failed ====================
         cli_retry_failed = args.get('retry_failed')
         
@@ -54,6 +79,11 @@ def main():
             count = len(app_config.USERS_ID) if app_config.USERS_ID else 0
             print(f"[CLI] 未检测到 UID 参数，将处理配置文件列表中的 {count} 个用户。")
 
+        # ==================== 【新增】处理 resume ====================
+        if args.get('resume'):
+            print("[CLI] 检测到参数 --resume，将从各用户上次中断的位置继续。")
+            app_config.RESUME = True
+
         # ==================== 3. 最终校验 (配合上一轮的 Config 修改) ====================
         # 如果 Config 类中实现了 check_final_config 方法，可以在这里调用
         if hasattr(app_config, 'check_final_config'):
@@ -0,0 +1,348 @@
+# src/maintenance.py
+
+import os
+import time
+import contextvars
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from tqdm import tqdm
+from config import Config
+from database import ArchiveDB, ASSET_FILE_PATTERN, CONTENT_FILE_PATTERN, migrate_output_dir, uid_from_folder_name
+from processor.processor import create_downloader
+from services.content_extractor import ContentExtractor
+from services.dedup import DEDUP_OFF, DEDUP_HARDLINK, file_digest, link_file
+from services.downloader import import_legacy_failures
+from services.folder_resolver import FolderNameResolver, scan_user_folder
+from services.metrics import Metrics, COUNTER_DOWNLOAD_BYTES
+from services.rate_limiter import AdaptiveRateLimiter, ENDPOINT_CDN
+from services.summary_log import SummaryLog
+from services.step2_store import (LEGACY_SUFFIX, COMPACT_SUFFIX, step2_dir, convert_legacy_file,
+                                  parse_step2_filename, load_step2_file)
+
+# rebuild_content 中单条动态的处理结果
+REBUILD_WRITTEN = "written"
+REBUILD_UNCHANGED = "unchanged"
+REBUILD_FAILED = "failed"
+
+def migrate_archive(config: Config):
+    """
+    【新增】将输出目录中已下载的文件导入 SQLite 下载归档 (--migrate-archive)。
+    重复执行是安全的：已存在的记录会被忽略。
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(config.ARCHIVE_DB_PATH)), exist_ok=True)
+    print(f"\n正在将 {config.OUTPUT_DIR_PATH} 中的已下载文件导入归档 {config.ARCHIVE_DB_PATH} ...")
+    start_time = time.monotonic()
+    archive = ArchiveDB(config.ARCHIVE_DB_PATH)
+    try:
+        users, records = migrate_output_dir(archive, config.OUTPUT_DIR_PATH)
+        # 【新增】同时把各用户文件夹中旧的 undownloaded.json 导入失败表
+        failures = _import_legacy_failure_files(archive, config.OUTPUT_DIR_PATH)
+    finally:
+        archive.close()
+    print(f"迁移完成: {users} 个用户，{records} 条记录，{failures} 个失败项目，用时 {time.monotonic() - start_time:.2f} 秒。")
+
+def _import_legacy_failure_files(archive: ArchiveDB, base_output_dir: str) -> int:
+    """【新增】把输出目录中所有用户文件夹的 undownloaded.json 导入失败表，返回导入的项目数。"""
+    return sum(import_legacy_failures(archive, os.path.join(base_output_dir, folder_name))
+               for folder_name in _user_folders(base_output_dir))
+
+def retry_failed_downloads(config: Config, uid: Optional[int] = None, force: bool = False):
+    """
+    【新增】只重试失败表中的资源 (--retry-only)：不翻页、不调用 gallery-dl，多个用户并行重试
+    (并行数为 max_parallel_users，每个用户内的并发下载数与正常运行相同)。
+    先导入各用户文件夹中旧的 undownloaded.json；仍然失败的资源失败次数加一，推迟下一次自动重试。
+    :param uid: 只重试该用户的失败资源 (-u/--uid)。
+    :param force: 忽略下一次重试时间，重试全部失败资源 (--force)。
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(config.ARCHIVE_DB_PATH)), exist_ok=True)
+    start_time = time.monotonic()
+    archive = ArchiveDB(config.ARCHIVE_DB_PATH)
+    metrics = Metrics()
+    # 只访问 CDN，限速设置与正常运行相同
+    rate_limiter = AdaptiveRateLimiter(rates={ENDPOINT_CDN: config.RATE_LIMIT_CDN},
+                                       recovery_successes=config.RATE_LIMIT_RECOVERY_SUCCESSES, metrics=metrics)
+    downloader = create_downloader(config, rate_limiter, archive, metrics)
+    try:
+        _import_legacy_failure_files(archive, config.OUTPUT_DIR_PATH)
+        users: Dict[int, Tuple[str, str]] = {}
+        for row in archive.due_failures(uid, include_pending=force):
+            users.setdefault(row['uid'], (row['folder_name'], row['user_name'] or row['folder_name']))
+        pending = archive.count_failures(uid)
+        if not users:
+            hint = f"，另有 {pending} 个项目尚未到重试时间 (使用 --force 立即重试)" if pending else ""
+            print(f"\n失败表中没有需要重试的项目{hint}。")
+            return
+
+        workers = min(config.MAX_PARALLEL_USERS, len(users))
+        print(f"\n正在重试 {len(users)} 个用户的失败项目 (同时处理 {workers} 个用户)...")
+
+        def retry_user(user_id: int, folder_name: str, user_name: str) -> Tuple[int, int]:
+            # 用户文件夹以索引中的记录为准 (文件夹可能已被重命名)
+            indexed = archive.get_user_folder(user_id)
+            user_folder = os.path.join(config.OUTPUT_DIR_PATH, indexed[0] if indexed else folder_name)
+            os.makedirs(user_folder, exist_ok=True)
+            images, videos, _, still_failed = downloader.retry_failed(user_id, user_folder, user_name, force)
+            downloader.record_failures(still_failed)
+            return images + videos, len(still_failed)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="retry-user") as executor:
+            futures = [executor.submit(contextvars.copy_context().run, retry_user, user_id, folder_name, user_name)
+                       for user_id, (folder_name, user_name) in users.items()]
+            results = [future.result() for future in futures]
+        succeeded = sum(result[0] for result in results)
+        failed = sum(result[1] for result in results)
+        downloaded_mb = metrics.snapshot()["counters"].get(COUNTER_DOWNLOAD_BYTES, 0) / 1024 / 1024
+        remaining = archive.count_failures(uid)
+    finally:
+        downloader.close()
+        archive.close()
+    print(f"重试完成: {succeeded} 个成功，{failed} 个仍然失败 (失败表中还有 {remaining} 个项目)，"
+          f"共下载 {downloaded_mb:.2f} MB，用时 {time.monotonic() - start_time:.2f} 秒。")
+
+def rebuild_folder_index(config: Config):
+    """
+    【新增】丢弃现有的 用户ID → 文件夹 索引，并行扫描输出目录重新建立 (--rebuild-folder-index)。
+    手动重命名、移动或删除了用户文件夹后使用。
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(config.ARCHIVE_DB_PATH)), exist_ok=True)
+    print(f"\n正在重建 {config.OUTPUT_DIR_PATH} 的用户文件夹索引...")
+    start_time = time.monotonic()
+    archive = ArchiveDB(config.ARCHIVE_DB_PATH)
+    try:
+        # 重建索引只需扫描本地文件夹，不需要 API
+        resolver = FolderNameResolver(config.OUTPUT_DIR_PATH, None, config, archive)
+        count = resolver.rebuild_index()
+    finally:
+        archive.close()
+    print(f"索引重建完成: {count} 个用户文件夹，用时 {time.monotonic() - start_time:.2f} 秒。")
+
+def convert_step2_metadata(config: Config):
+    """
+    【新增】将输出目录中旧格式 (缩进 JSON) 的 step2 元数据转换为紧凑格式 (--convert-step2)。
+    每个文件转换后都会重新读取校验，一致才删除旧文件；中断后重复执行会继续转换剩余的文件。
+    """
+    base_output_dir = config.OUTPUT_DIR_PATH
+    print(f"\n正在查找 {base_output_dir} 中旧格式的 step2 元数据...")
+    start_time = time.monotonic()
+    legacy_files = []
+    if os.path.isdir(base_output_dir):
+        for folder_name in sorted(os.listdir(base_output_dir)):
+            meta_dir = step2_dir(os.path.join(base_output_dir, folder_name))
+            if not os.path.isdir(meta_dir):
+                continue
+            legacy_files.extend(os.path.join(meta_dir, name) for name in sorted(os.listdir(meta_dir))
+                                if name.endswith(LEGACY_SUFFIX))
+
+    converted, failed, size_before, size_after = 0, 0, 0, 0
+    for path in tqdm(legacy_files, desc="转换 step2 元数据", unit=" 个"):
+        try:
+            before, after = convert_legacy_file(path)
+        except (ValueError, OSError) as e:
+            failed += 1
+            tqdm.write(f"  - 警告：转换 {path} 失败，保留原文件: {e}")
+            continue
+        converted += 1
+        size_before += before
+        size_after += after
+
+    print(f"转换完成: {converted} 个文件，失败 {failed} 个，"
+          f"{size_before / 1024 / 1024:.1f} MB → {size_after / 1024 / 1024:.1f} MB，"
+          f"用时 {time.monotonic() - start_time:.2f} 秒。")
+
+def _user_folders(base_output_dir: str, uid: Optional[int] = None) -> List[str]:
+    """列出输出目录中的用户文件夹；指定 uid 时只返回属于该用户的文件夹。"""
+    if not os.path.isdir(base_output_dir):
+        return []
+    folders = []
+    for folder_name in sorted(os.listdir(base_output_dir)):
+        if not os.path.isdir(os.path.join(base_output_dir, folder_name)):
+            continue
+        if uid is not None:
+            folder_uid = uid_from_folder_name(folder_name)
+            if folder_uid is None:
+                # 非 'Name_UID' 格式的旧文件夹，从 step2 元数据中识别作者
+                scanned = scan_user_folder(base_output_dir, folder_name)
+                folder_uid = scanned[0] if scanned else None
+            if folder_uid != uid:
+                continue
+        folders.append(folder_name)
+    return folders
+
+def _collect_rebuild_tasks(user_folder: str, force: bool) -> Tuple[List[Tuple[str, str, str, str]], int]:
+    """
+    收集一个用户文件夹中需要重新生成内容信息文件的动态，返回 (任务列表, 跳过数)。
+    任务为 (用户文件夹, 日期字符串, 动态ID, step2 文件路径)；同一动态两种格式都存在时使用紧凑格式。
+    内容信息文件比 step2 元数据新时跳过 (force 为真时不跳过)。
+    """
+    meta_dir = step2_dir(user_folder)
+    if not os.path.isdir(meta_dir):
+        return [], 0
+
+    content_mtimes = {}
+    with os.scandir(user_folder) as entries:
+        for entry in entries:
+            if CONTENT_FILE_PATTERN.match(entry.name) and entry.is_file():
+                content_mtimes[entry.name] = entry.stat().st_mtime
+
+    step2_files = {}
+    with os.scandir(meta_dir) as entries:
+        for entry in entries:
+            parsed = parse_step2_filename(entry.name)
+            if parsed is None:
+                continue
+            current = step2_files.get(parsed)
+            if current is None or entry.name.endswith(COMPACT_SUFFIX):
+                step2_files[parsed] = entry
+
+    tasks, skipped = [], 0
+    for (date_str, id_str), entry in sorted(step2_files.items()):
+        content_mtime = content_mtimes.get(f"{date_str}_{id_str}.json")
+        if not force and content_mtime is not None and content_mtime >= entry.stat().st_mtime:
+            skipped += 1
+            continue
+        tasks.append((user_folder, date_str, id_str, entry.path))
+    return tasks, skipped
+
+def _rebuild_content_file(task: Tuple[str, str, str, str]) -> Tuple[str, Optional[str]]:
+    """在工作进程中重新生成一条动态的内容信息文件，返回 (处理结果, 错误信息)。"""
+    user_folder, date_str, id_str, step2_path = task
+    extractor = ContentExtractor()
+    try:
+        content = extractor.extract_content(load_step2_file(step2_path), id_str)
+        written = extractor.write_content_json(user_folder, date_str, id_str, content)
+    except (ValueError, OSError, IndexError, KeyError, TypeError) as e:
+        return REBUILD_FAILED, f"{step2_path}: {e}"
+    return (REBUILD_WRITTEN if written else REBUILD_UNCHANGED), None
+
+def rebuild_content(config: Config, uid: Optional[int] = None, force: bool = False):
+    """
+    【新增】按当前的提取规则，用本地 step2 元数据重新生成内容信息文件 (--rebuild-content)。
+    不访问网络；提取在进程池中并行执行，速度只受 CPU 与磁盘限制。
+    :param uid: 只处理该用户的文件夹 (-u/--uid)。
+    :param force: 不跳过内容信息文件比 step2 元数据新的动态 (--force)。
+    """
+    base_output_dir = config.OUTPUT_DIR_PATH
+    target = f"用户 {uid}" if uid is not None else base_output_dir
+    print(f"\n正在查找 {target} 中需要重新生成的内容信息文件...")
+    start_time = time.monotonic()
+
+    tasks, skipped = [], 0
+    for folder_name in _user_folders(base_output_dir, uid):
+        folder_tasks, folder_skipped = _collect_rebuild_tasks(os.path.join(base_output_dir, folder_name), force)
+        tasks.extend(folder_tasks)
+        skipped += folder_skipped
+    if skipped:
+        print(f"  - 跳过 {skipped} 条内容信息文件比 step2 元数据新的动态 (使用 --force 可全部重新生成)。")
+
+    counts = {REBUILD_WRITTEN: 0, REBUILD_UNCHANGED: 0, REBUILD_FAILED: 0}
+    if tasks:
+        with ProcessPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            results = executor.map(_rebuild_content_file, tasks, chunksize=64)
+            for status, error in tqdm(results, total=len(tasks), desc="重建内容信息文件", unit=" 条"):
+                counts[status] += 1
+                if error:
+                    tqdm.write(f"  - 警告：重新生成失败 {error}")
+
+    print(f"重建完成: 写入 {counts[REBUILD_WRITTEN]} 个，内容未变化 {counts[REBUILD_UNCHANGED]} 个，"
+          f"跳过 {skipped} 个，失败 {counts[REBUILD_FAILED]} 个，用时 {time.monotonic() - start_time:.2f} 秒。")
+
+def _iter_media_files(base_output_dir: str) -> Iterator[Tuple[str, int]]:
+    """列出所有用户文件夹中下载的图片与实况视频 (路径, 字节数)。"""
+    for folder_name in _user_folders(base_output_dir):
+        with os.scandir(os.path.join(base_output_dir, folder_name)) as entries:
+            for entry in entries:
+                if ASSET_FILE_PATTERN.match(entry.name) and entry.is_file(follow_symlinks=False):
+                    yield entry.path, entry.stat(follow_symlinks=False).st_size
+
+def _safe_digest(path: str) -> Optional[str]:
+    try:
+        return file_digest(path)
+    except OSError as e:
+        tqdm.write(f"  - 警告：读取 {path} 失败，跳过: {e}")
+        return None
+
+def dedup_output_dir(config: Config, dry_run: bool = False):
+    """
+    【新增】离线去重 (--dedup)：按内容 (SHA-256) 查找所有用户文件夹中重复的图片与实况视频，
+    每组保留一份，其余替换为指向它的 reflink (dedup_mode = "reflink") 或硬链接，并报告节省的空间。
+    只对大小相同的文件计算哈希；已经互为硬链接的路径视为同一个文件，不重复计算。
+    :param dry_run: 只统计可以节省的空间，不修改文件 (--dry-run)。
+    """
+    base_output_dir = config.OUTPUT_DIR_PATH
+    mode = config.DEDUP_MODE if config.DEDUP_MODE != DEDUP_OFF else DEDUP_HARDLINK
+    print(f"\n正在查找 {base_output_dir} 中重复的图片与视频...")
+    start_time = time.monotonic()
+
+    scanned = 0
+    by_size: Dict[int, List[str]] = {}
+    for path, size in _iter_media_files(base_output_dir):
+        scanned += 1
+        by_size.setdefault(size, []).append(path)
+
+    # 大小相同的文件按 (设备, inode) 合并：指向同一文件的多个路径只算一个
+    candidates: Dict[Tuple[int, int], Tuple[int, List[str]]] = {}
+    for size, paths in by_size.items():
+        if len(paths) < 2:
+            continue
+        inodes: Dict[Tuple[int, int], List[str]] = {}
+        for path in paths:
+            stat = os.stat(path)
+            inodes.setdefault((stat.st_dev, stat.st_ino), []).append(path)
+        if len(inodes) > 1:
+            for inode, inode_paths in inodes.items():
+                candidates[inode] = (size, sorted(inode_paths))
+
+    # 计算哈希 (磁盘 IO 为主，使用线程池)
+    duplicates: Dict[Tuple[int, str], List[Tuple[int, int]]] = {}
+    inodes_to_hash = list(candidates)
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+        digests = executor.map(_safe_digest, [candidates[inode][1][0] for inode in inodes_to_hash])
+        for inode, digest in zip(inodes_to_hash, tqdm(digests, total=len(inodes_to_hash), desc="计算文件哈希", unit=" 个")):
+            if digest is not None:
+                duplicates.setdefault((candidates[inode][0], digest), []).append(inode)
+    groups = [inodes for inodes in duplicates.values() if len(inodes) > 1]
+
+    replaced, reclaimed, failed = 0, 0, 0
+    for inodes in groups:
+        # 保留路径最多的文件 (已有的硬链接不用再改)，其余文件的所有路径都改为指向它
+        inodes.sort(key=lambda inode: (-len(candidates[inode][1]), candidates[inode][1][0]))
+        keep = candidates[inodes[0]][1][0]
+        for inode in inodes[1:]:
+            size, paths = candidates[inode]
+            if not dry_run:
+                try:
+                    for path in paths:
+                        link_file(keep, path, mode, allow_copy=False)
+                except OSError as e:
+                    failed += 1
+                    print(f"  - 警告：无法将 {paths[0]} 链接到 {keep}，保留原文件: {e}")
+                    continue
+            replaced += len(paths)
+            reclaimed += size
+
+    action = "可替换" if dry_run else "已替换"
+    print(f"{'[试运行] ' if dry_run else ''}去重完成: 扫描 {scanned} 个文件，发现 {len(groups)} 组重复内容，"
+          f"{action} {replaced} 个文件，{'可节省' if dry_run else '节省'} {reclaimed / 1024 / 1024:.1f} MB，"
+          f"失败 {failed} 个，用时 {time.monotonic() - start_time:.2f} 秒。")
+
+def show_log_stats(config: Config):
+    """
+    【新增】读取按月轮转的摘要日志，按用户输出汇总统计 (--log-stats)：
+    处理次数、平均 / P95 耗时、每秒下载数 (图片 + 实况视频) 与失败率。
+    """
+    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    summary_log = SummaryLog(os.path.join(project_root, 'log'))
+    migrated = summary_log.migrate_legacy()
+    if migrated:
+        print(f"已将旧版摘要日志中的 {migrated} 条记录迁移为按月的 JSON Lines 格式。")
+
+    stats = summary_log.aggregate()
+    if not stats:
+        print("\n摘要日志中还没有任何记录。")
+        return
+    print(f"\n共 {len(stats)} 个用户的处理记录：")
+    for item in stats:
+        print(f"  - {item.user_name} ({item.user_id}): 处理 {item.runs} 次，"
+              f"平均耗时 {item.mean_duration:.1f} 秒，P95 {item.p95_duration:.1f} 秒，"
+              f"{item.images_per_second:.2f} 个/秒，失败率 {item.failure_rate:.1%}")
@@ -0,0 +1,214 @@
+# src/processor/pipeline.py
+
+import queue
+import threading
+import contextvars
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Any
+
+from api import FeedPost
+from config import Config
+from services.feed_journal import FeedCursorJournal
+from services.retry_queue import DeferredRetryQueue
+from services.incremental import IncrementalTracker, DECISION_SKIP, DECISION_STOP
+from .post_handler import PostHandler
+
+# 队列结束标记
+_SENTINEL = object()
+
+@dataclass
+class PipelineResult:
+    """流水线 (或顺序处理) 一个用户的统计结果。"""
+    processed_posts: int = 0
+    downloaded_images: int = 0
+    downloaded_videos: int = 0
+    skipped_known_posts: int = 0
+    stopped_by_incremental: bool = False
+    failures: List[Dict] = field(default_factory=list)
+
+class PostPipeline:
+    """
+    三阶段流式流水线：动态列表 → 元数据 → 下载。
+    - 阶段之间通过有界队列连接，下游处理不过来时上游自动阻塞 (背压)；
+    - 每个阶段有独立的并发数；各阶段的请求速度由集中限速器中对应端点
+      (feed / metadata / cdn) 的令牌桶控制；
+    - 增量模式下连续遇到足够多的已知动态时发出停止信号：动态列表停止翻页，
+      尚未获取元数据的动态被丢弃，已获取元数据的动态仍会下载完成，保证不留下半成品。
+    """
+
+    def __init__(self, handler: PostHandler, config: Config):
+        self.handler = handler
+        self.config = config
+        self.metadata_workers = config.PIPELINE_METADATA_WORKERS
+        self.download_workers = config.PIPELINE_DOWNLOAD_WORKERS
+        self.queue_size = config.PIPELINE_QUEUE_SIZE
+
+    def run(self, posts: Iterable[FeedPost], user_name: str, user_folder: str,
+            tracker: Optional[IncrementalTracker] = None,
+            prefetched: Optional[Dict[str, List[Any]]] = None,
+            progress=None, uid: Optional[int] = None,
+            journal: Optional[FeedCursorJournal] = None,
+            retry_queue: Optional[DeferredRetryQueue] = None) -> PipelineResult:
+        """
+        运行流水线直到动态列表耗尽或收到增量停止信号。
+        :param tracker: 【修改】增量判断 (本地索引 + 高水位线)，替代原来的 post_index 参数。
+        :param prefetched: 已获取的元数据 {url: images_data}，命中时不再调用 gallery-dl。
+                           【修改】也可以是任何提供 pop(url, default) 的对象 (例如批量元数据获取器)。
+        :param progress: 可选的 tqdm 进度条，每完成一条动态更新一次。
+        :param uid: 用户ID，用于查询与写入下载归档。
+        :param journal: 【新增】翻页游标日志，动态处理完成后推进游标。
+        :param retry_queue: 【新增】延迟重试队列，提供时下载失败的资源交给队列稍后重试。
+        """
+        result = PipelineResult()
+        lock = threading.Lock()
+        stop_event = threading.Event()
+        prefetched = prefetched if prefetched is not None else {}
+        metadata_queue: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        download_queue: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+
+        def request_stop(discard_queued: bool):
+            """
+            发出增量停止信号。
+            队列按动态列表顺序排列：由动态列表阶段发现时，队列中的都是更新的动态，需要继续处理；
+            由元数据阶段发现时，队列中剩下的都是更早的动态，可以直接丢弃。
+            """
+            with lock:
+                if not result.stopped_by_incremental:
+                    result.stopped_by_incremental = True
+                    print(f"\n  - 增量下载模式：检测到已下载的内容，将停止处理用户 '{user_name}' 的剩余动态。")
+            if discard_queued:
+                stop_event.set()
+
+        def mark_done(post: FeedPost):
+            if journal is not None:
+                journal.done(post)
+
+        def feed_stage():
+            """阶段 1：翻页获取动态列表，并过滤已下载 / 早于高水位线的动态。"""
+            try:
+                for post in posts:
+                    if stop_event.is_set():
+                        break
+                    decision = tracker.check(post) if tracker is not None else None
+                    if decision == DECISION_STOP:
+                        request_stop(discard_queued=False)
+                        break
+                    if decision == DECISION_SKIP:
+                        with lock:
+                            result.skipped_known_posts += 1
+                        if progress is not None:
+                            progress.update(1)
+                        if journal is not None:
+                            journal.track(post)
+                        mark_done(post)
+                        continue
+                    if journal is not None:
+                        journal.track(post)
+                    metadata_queue.put(post)
+            except Exception as e:
+                print(f"  - [流水线] 获取动态列表时出错: {e}")
+            finally:
+                # 生成器在停止后立即关闭，取消后续翻页
+                close = getattr(posts, 'close', None)
+                if close:
+                    close()
+                for _ in range(self.metadata_workers):
+                    metadata_queue.put(_SENTINEL)
+
+        def metadata_stage():
+            """阶段 2：调用 gallery-dl 获取元数据，保存并生成下载任务。"""
+            while True:
+                post = metadata_queue.get()
+                if post is _SENTINEL:
+                    break
+                if stop_event.is_set():
+                    # 停止后丢弃尚未获取元数据的动态
+                    continue
+                try:
+                    images_data = prefetched.pop(post.url, None)
+                    should_continue, prepared = self.handler.prepare(user_name, post.url, user_folder, images_data, uid)
+                except Exception as e:
+                    print(f"  - [流水线] 处理动态 {post.url} 的元数据时出错: {e}")
+                    # 与元数据获取失败相同：不推进高水位线与游标，下次运行时重新处理该动态
+                    if progress is not None:
+                        progress.update(1)
+                    if tracker is not None:
+                        tracker.record_unprepared(post)
+                    continue
+                if not should_continue:
+                    # 获取元数据后才发现已下载：计入连续已知动态
+                    if tracker is None or tracker.record_known(post):
+                        request_stop(discard_queued=True)
+                    else:
+                        with lock:
+                            result.skipped_known_posts += 1
+                        if progress is not None:
+                            progress.update(1)
+                        mark_done(post)
+                    continue
+                if prepared is None:
+                    # 元数据获取失败：不推进高水位线与游标，下次运行时重新处理该动态
+                    with lock:
+                        result.processed_posts += 1
+                    if progress is not None:
+                        progress.update(1)
+                    if tracker is not None:
+                        tracker.record_unprepared(post)
+                    continue
+                download_queue.put((post, prepared))
+
+        def download_stage():
+            """阶段 3：下载资源并生成内容信息文件。"""
+            while True:
+                item = download_queue.get()
+                if item is _SENTINEL:
+                    break
+                post, prepared = item
+                try:
+                    s_imgs, s_vids, failures = self.handler.download_prepared(prepared)
+                except Exception as e:
+                    print(f"  - [流水线] 下载动态 {prepared.id_str} 时出错: {e}")
+                    if progress is not None:
+                        progress.update(1)
+                    if tracker is not None:
+                        tracker.record_unprepared(post)
+                    continue
+                if retry_queue is not None:
+                    retry_queue.submit(failures)
+                    failures = []
+                with lock:
+                    result.processed_posts += 1
+                    result.downloaded_images += s_imgs
+                    result.downloaded_videos += s_vids
+                    result.failures.extend(failures)
+                if progress is not None:
+                    progress.update(1)
+                if tracker is not None:
+                    tracker.record_processed(post)
+                mark_done(post)
+
+        def make_thread(target, name: str) -> threading.Thread:
+            # 工作线程继承调用方的上下文 (例如并行处理用户时的输出前缀)
+            return threading.Thread(target=contextvars.copy_context().run, args=(target,), name=name, daemon=True)
+
+        feed_thread = make_thread(feed_stage, "pipeline-feed")
+        metadata_threads = [make_thread(metadata_stage, f"pipeline-meta-{i}") for i in range(self.metadata_workers)]
+        download_threads = [make_thread(download_stage, f"pipeline-dl-{i}") for i in range(self.download_workers)]
+
+        for thread in [feed_thread] + metadata_threads + download_threads:
+            thread.start()
+
+        try:
+            feed_thread.join()
+            for thread in metadata_threads:
+                thread.join()
+            # 元数据阶段全部结束后，通知下载阶段收尾
+            for _ in range(self.download_workers):
+                download_queue.put(_SENTINEL)
+            for thread in download_threads:
+                thread.join()
+        except KeyboardInterrupt:
+            stop_event.set()
+            raise
+
+        return result
@@ -2,28 +2,50 @@
 
 import os
 import datetime
-from typing import Tuple, List, Dict
+from dataclasses import dataclass, field
+from typing import Tuple, List, Dict, Any, Optional
 from api import BilibiliAPI
 from config import Config
+from database import ArchiveDB, KIND_CONTENT, kind_from_filename
 
 from services.content_extractor import ContentExtractor
 from services.downloader import Downloader
 from services.metadata_saver import MetadataSaver
 
+@dataclass
+class PreparedPost:
+    """【新增】已获取元数据、等待下载的动态 (prepare 阶段的产物)。"""
+    user_name: str
+    user_folder: str
+    date_str: str
+    id_str: str
+    image_tasks: List[Dict] = field(default_factory=list)
+    video_tasks: List[Dict] = field(default_factory=list)
+    uid: Optional[int] = None
+    # 【新增】从内存中的元数据提取的内容信息，下载完成后直接写入内容信息文件
+    content: Optional[Dict[str, Any]] = None
+
 class PostHandler:
     """处理单个动态的完整流程。"""
 
-    def __init__(self, api: BilibiliAPI, config: Config, extractor: ContentExtractor, downloader: Downloader, saver: MetadataSaver):
+    def __init__(self, api: BilibiliAPI, config: Config, extractor: ContentExtractor, downloader: Downloader, saver: MetadataSaver,
+                 archive: Optional[ArchiveDB] = None):
         self.api = api
         self.config = config
         self.extractor = extractor
         self.downloader = downloader
         self.saver = saver
+        # 【新增】下载归档：增量检查查询归档，每条动态下载完成后批量写入
+        self.archive = archive
 
-    def process(self, user_name: str, post_url: str, user_folder: str) -> Tuple[bool, int, int, List[Dict]]:
+    def process(self, user_name: str, post_url: str, user_folder: str, images_data: Optional[List[Any]] = None,
+                uid: Optional[int] = None) -> Tuple[bool, Optional[PreparedPost], int, int, List[Dict]]:
         """
         处理单个动态，协调提取、保存和下载任务。
-        【修改】返回元组扩展为: (是否继续, 成功图片数, 成功视频数, 失败列表)
+        【修改】返回元组扩展为: (是否继续, 待下载动态, 成功图片数, 成功视频数, 失败列表)
+        待下载动态为 None 表示元数据获取失败或无需下载，调用方不应把该动态视为已处理 (不推进高水位线与游标)。
+        【新增】images_data: 调用方已获取的元数据，传入时不再重复调用 gallery-dl。
+        【新增】uid: 用户ID，用于查询与写入下载归档。
         技术实现说明:
         B站实况视频(Live Photo)的数据结构如下：
         - 'url': 对应静态图片 (JPG)
@@ -33,11 +55,26 @@ class PostHandler:
         1. 总是下载 'url' 对应的图片。
         2. 如果检测到 'live_url'，则额外下载对应的 MP4 文件，文件名与图片保持一致（扩展名不同）。
         """
-        images_data = self.api.get_post_metadata(post_url)
-        # 注意：这里返回4个值
+        should_continue, prepared = self.prepare(user_name, post_url, user_folder, images_data, uid)
+        if prepared is None:
+            return should_continue, None, 0, 0, []
+
+        successful_images, successful_videos, failed_downloads_info = self.download_prepared(prepared)
+        # 返回图片和视频的独立计数
+        return True, prepared, successful_images, successful_videos, failed_downloads_info
+
+    def prepare(self, user_name: str, post_url: str, user_folder: str, images_data: Optional[List[Any]] = None,
+                uid: Optional[int] = None) -> Tuple[bool, Optional[PreparedPost]]:
+        """
+        【新增】第一阶段：获取并保存元数据，生成下载任务。
+        返回 (是否继续, 待下载动态)。待下载动态为 None 表示该动态无需下载；
+        是否继续为 False 表示增量模式下遇到了已下载的动态。
+        """
+        if images_data is None:
+            images_data = self.api.get_post_metadata(post_url)
         if not images_data or not isinstance(images_data[0][-1], dict):
             print(f"  - 警告：未找到动态 {post_url} 的有效数据，跳过。")
-            return True, 0, 0, []
+            return True, None
 
         if images_data and len(images_data) > 0 and isinstance(images_data[0], list):
              if isinstance(images_data[0][-1], dict):
@@ -49,7 +86,7 @@ class PostHandler:
 
         if not (id_str and pub_ts):
             print(f"  - 警告：无法从元数据中获取动态 ID 或发布时间戳，跳过。")
-            return True, 0, 0, []
+            return True, None
 
         try:
             date_str = datetime.datetime.fromtimestamp(pub_ts).strftime('%Y-%m-%d')
@@ -60,91 +97,133 @@ class PostHandler:
         content_json_filepath = os.path.join(user_folder, content_json_filename)
         
         # 增量下载检查逻辑
-        if self.config.INCREMENTAL_DOWNLOAD and os.path.exists(content_json_filepath):
+        if self.config.INCREMENTAL_DOWNLOAD and self._post_exists(uid, id_str, content_json_filepath):
             has_missing_live_photo = False
             for idx, img_info in enumerate(images_data[1:]):
                 if isinstance(img_info, list) and len(img_info) > 0 and isinstance(img_info[-1], dict):
                     meta = img_info[-1]
                     if meta.get('live_url'):
-                        video_filename = f"{date_str}_{id_str}_{idx+1}.mp4"
-                        video_path = os.path.join(user_folder, video_filename)
-                        if not os.path.exists(video_path):
+                        if not self._video_exists(uid, id_str, idx + 1, date_str, user_folder):
                             has_missing_live_photo = True
                             print(f"  - [增量检查] 动态 {id_str} 发现缺失的实况视频，将进行补充下载。")
                             break
             
             if not has_missing_live_photo:
-                # 均已存在，返回 0, 0
-                return False, 0, 0, []
+                # 均已存在，停止处理
+                return False, None
 
         self.saver.save_step2_metadata(images_data, user_folder, date_str, pub_ts, id_str)
 
-        successful_images = 0
-        successful_videos = 0
-        failed_downloads_info: List[Dict] = []
-        total_items_to_process = 0
-        skipped_count = 0
+        # 【修改】先收集本动态的全部下载任务 (图片 + 实况视频)，再交给下载器并发下载
+        image_tasks, video_tasks = self._build_download_tasks(images_data, user_name, user_folder, pub_ts, id_str, date_str, uid)
+        # 【新增】在元数据仍在内存中时提取内容信息，之后无需重新读取并解析 step2 文件
+        try:
+            content = self.extractor.extract_content(images_data, id_str)
+        except (IndexError, KeyError, TypeError, ValueError) as e:
+            print(f"  - 从元数据提取信息时发生错误: {e}")
+            content = None
+        return True, PreparedPost(user_name, user_folder, date_str, id_str, image_tasks, video_tasks, uid, content)
+
+    def _post_exists(self, uid: Optional[int], id_str: str, content_json_filepath: str) -> bool:
+        """【新增】动态是否已下载：有归档时查询归档，否则检查内容信息文件。"""
+        if self.archive is not None and uid is not None:
+            return self.archive.post_exists(uid, id_str)
+        return os.path.exists(content_json_filepath)
+
+    def _video_exists(self, uid: Optional[int], id_str: str, index: int, date_str: str, user_folder: str) -> bool:
+        """【新增】实况视频是否已下载：有归档时查询归档，否则检查本地文件。"""
+        return self.downloader.is_downloaded(uid, id_str, index, f"{date_str}_{id_str}_{index}.mp4", user_folder)
+
+    def download_prepared(self, prepared: PreparedPost) -> Tuple[int, int, List[Dict]]:
+        """
+        【新增】第二阶段：下载动态的全部资源并生成内容信息文件。
+        返回 (成功图片数, 成功视频数, 失败列表)。
+        """
+        image_tasks, video_tasks = prepared.image_tasks, prepared.video_tasks
+        total_items_to_process = len(image_tasks)
+
+        results = self.downloader.download_batch(image_tasks + video_tasks)
+        image_results = results[:len(image_tasks)]
+        video_results = results[len(image_tasks):]
+
+        successful_images = image_results.count("SUCCESS")
+        skipped_count = image_results.count("SKIPPED")
+        successful_videos = video_results.count("SUCCESS")
+        failed_downloads_info: List[Dict] = [
+            task for task, result in zip(image_tasks + video_tasks, results) if result == "FAILED"
+        ]
+
+        if skipped_count > 0 and skipped_count >= total_items_to_process:
+             # 注意：这里只打印了图片的跳过信息，视频通常伴随图片存在
+            print(f"  - 所有 {skipped_count} 张图片均已存在，全部跳过。")
+        elif skipped_count > 0:
+            print(f"  - 跳过 {skipped_count} 张已存在的图片。")
+
+        # 【修改】直接使用 prepare 阶段提取的内容信息，不再从磁盘读取刚写入的 step2 元数据
+        if prepared.content is not None:
+            self.extractor.save_content_json(prepared.user_folder, prepared.date_str, prepared.id_str, prepared.content)
+        self._record_post(prepared, image_tasks + video_tasks, results)
+
+        return successful_images, successful_videos, failed_downloads_info
+
+    def _record_post(self, prepared: PreparedPost, tasks: List[Dict], results: List[str]):
+        """
+        【新增】在一个事务中把本条动态已完成的资源 (下载成功或已存在) 与内容信息文件写入归档。
+        失败的资源不写入，下次运行时会重新尝试。
+        """
+        if self.archive is None or prepared.uid is None:
+            return
+        content_filename = f"{prepared.date_str}_{prepared.id_str}.json"
+        if not os.path.exists(os.path.join(prepared.user_folder, content_filename)):
+            return
+        entries = [(0, KIND_CONTENT, content_filename)]
+        for task, result in zip(tasks, results):
+            if result != "FAILED":
+                filename = Downloader.build_filename(task['url'], task['pub_ts'], task['id_str'], task['index'])
+                entries.append((task['index'], kind_from_filename(filename), filename))
+        self.archive.add_assets(prepared.uid, prepared.id_str, entries)
+
+    def _build_download_tasks(self, images_data: List[Any], user_name: str, user_folder: str, pub_ts: int, id_str: str, date_str: str,
+                              uid: Optional[int] = None) -> Tuple[List[Dict], List[Dict]]:
+        """
+        【新增】遍历元数据，生成图片与实况视频的下载参数列表。
+        - 'url': 静态图片，总是下载；
+        - 'live_url': 实况视频，仅在本地不存在对应 MP4 时下载。
+        """
+        image_tasks: List[Dict] = []
+        video_tasks: List[Dict] = []
 
-        # 遍历每一个图片项进行下载处理
         for index, image_info in enumerate(images_data[1:]):
             if not isinstance(image_info, list) or not isinstance(image_info[-1], dict):
                 continue
-                
             meta_dict = image_info[-1]
-            total_items_to_process += 1
 
-            # ----------------- 1. 下载图片 -----------------
+            # ----------------- 1. 图片 -----------------
             if meta_dict.get('url'):
-                image_url = meta_dict['url']
-                download_args = {
-                    "url": image_url,
+                image_tasks.append({
+                    "url": meta_dict['url'],
                     "folder": user_folder,
                     "pub_ts": pub_ts,
                     "id_str": id_str,
                     "index": index + 1,
-                    "user_name": user_name
-                }
-                
-                result = self.downloader.download_image(**download_args)
-                if result == "SUCCESS":
-                    successful_images += 1
-                elif result == "FAILED":
-                    failed_downloads_info.append(download_args)
-                elif result == "SKIPPED":
-                    skipped_count += 1
-            
-            # ----------------- 2. 下载实况视频 (Live Photo) -----------------
+                    "user_name": user_name,
+                    "uid": uid
+                })
+
+            # ----------------- 2. 实况视频 (Live Photo) -----------------
             live_photo_url = meta_dict.get('live_url')
             if live_photo_url:
-                # 实况视频作为一个额外项目，不算在基础skipped_count的total里，除非我们想更精细
-                video_filename = f"{date_str}_{id_str}_{index + 1}.mp4"
-                video_filepath = os.path.join(user_folder, video_filename)
-
-                if not os.path.exists(video_filepath):
+                # 实况视频作为一个额外项目，不算在基础skipped_count的total里
+                if not self._video_exists(uid, id_str, index + 1, date_str, user_folder):
                     print(f"  - [Live Photo] 发现实况视频 (P{index + 1})，正在下载...")
-                    
-                    video_args = {
+                    video_tasks.append({
                         "url": live_photo_url,
                         "folder": user_folder,
                         "pub_ts": pub_ts,
                         "id_str": id_str,
                         "index": index + 1,
-                        "user_name": user_name
-                    }
-                    
-                    v_result = self.downloader.download_image(**video_args)
-                    if v_result == "SUCCESS":
-                        successful_videos += 1
-                    elif v_result == "FAILED":
-                        failed_downloads_info.append(video_args)
-        
-        if skipped_count > 0 and skipped_count >= total_items_to_process:
-             # 注意：这里只打印了图片的跳过信息，视频通常伴随图片存在
-            print(f"  - 所有 {skipped_count} 张图片均已存在，全部跳过。")
-        elif skipped_count > 0:
-            print(f"  - 跳过 {skipped_count} 张已存在的图片。")
+                        "user_name": user_name,
+                        "uid": uid
+                    })
 
-        self.extractor.create_content_json_from_local_meta(user_folder, date_str, id_str)
-
-        # 返回图片和视频的独立计数
-        return True, successful_images, successful_videos, failed_downloads_info
\ No newline at end of file
+        return image_tasks, video_tasks
@@ -1,14 +1,48 @@
 # src/processor/processor.py
 
+from typing import Optional
 from api import BilibiliAPI
 from config import Config
+from database import ArchiveDB
 from services.content_extractor import ContentExtractor
-from services.downloader import Downloader
+from services.dedup import DedupStore, DEDUP_OFF
+from services.async_downloader import AsyncDownloader
+from services.downloader import Downloader, DOWNLOAD_BACKEND_ASYNCIO
 from services.folder_resolver import FolderNameResolver
+from services.http_session import PooledSession
+from services.metrics import Metrics
+from services.rate_limiter import AdaptiveRateLimiter
 from services.metadata_saver import MetadataSaver
 from .post_handler import PostHandler
 from .user_processor import UserProcessor
 
+def create_downloader(config: Config, rate_limiter: AdaptiveRateLimiter, archive: ArchiveDB, metrics: Metrics) -> Downloader:
+    """
+    【新增】根据 download_backend 创建下载器，下载器与 API 共享同一个自适应限速器与 metrics。
+    asyncio 后端初始化失败 (例如未安装 httpx) 时，自动回退到线程池下载器。
+    【新增】dedup_mode 不为 "off" 时为下载器启用跨用户去重。
+    """
+    downloader = _create_download_backend(config, rate_limiter, archive, metrics)
+    if config.DEDUP_MODE != DEDUP_OFF:
+        downloader.dedup = DedupStore(archive, config.DEDUP_MODE, metrics)
+        print(f"  - [去重] 已启用跨用户去重 ({config.DEDUP_MODE})，已下载过的相同资源不再重复下载。")
+    return downloader
+
+def _create_download_backend(config: Config, rate_limiter: AdaptiveRateLimiter, archive: ArchiveDB,
+                             metrics: Metrics) -> Downloader:
+    if config.DOWNLOAD_BACKEND == DOWNLOAD_BACKEND_ASYNCIO:
+        try:
+            downloader = AsyncDownloader(config.ASYNC_MAX_CONNECTIONS, rate_limiter, archive, metrics)
+            protocol = "HTTP/2" if downloader.http2 else "HTTP/1.1 (安装 h2 后可使用 HTTP/2)"
+            print(f"  - [后端] 使用 asyncio 下载后端，最多 {downloader.max_workers} 个并发下载，{protocol}。")
+            return downloader
+        except Exception as e:
+            print(f"  - 警告：无法初始化 asyncio 下载后端 ({e})，回退到线程池下载。")
+    # 【新增】下载器使用共享的长连接会话 (连接池大小可在 config.toml 中配置)
+    # 连接池不小于并发下载数，避免并发线程之间争抢连接
+    pool_size = max(config.HTTP_POOL_SIZE, config.MAX_CONCURRENT_DOWNLOADS)
+    return Downloader(PooledSession(pool_size), config.MAX_CONCURRENT_DOWNLOADS, rate_limiter, archive, metrics)
+
 class PostProcessorFacade:
     """
     外观模式 (Facade Pattern)
@@ -18,21 +52,27 @@ class PostProcessorFacade:
 
     def __init__(self, base_output_dir: str, api: BilibiliAPI, config: Config):
         # 1. 初始化基础服务
-        self.resolver = FolderNameResolver(base_output_dir, api, config)
-        self.saver = MetadataSaver()
-        self.downloader = Downloader()
+        # 【新增】下载归档数据库，由下载器、PostHandler 与文件夹名称解析器共享 (Application 在结束时关闭)
+        self.archive = ArchiveDB(config.ARCHIVE_DB_PATH)
+        self.resolver = FolderNameResolver(base_output_dir, api, config, self.archive)
+        # 【修改】元数据写入与下载的耗时记入 API 使用的同一个 metrics
+        self.saver = MetadataSaver(config.STEP2_FORMAT, api.metrics)
+        self.downloader = create_downloader(config, api.rate_limiter, self.archive, api.metrics)
+        # 【新增】启用延迟重试队列时，下载器只尝试一次，失败的资源由 UserProcessor 的重试队列稍后重试
+        self.downloader.defer_failures = config.RETRY_QUEUE_ENABLED
         self.extractor = ContentExtractor()
 
         # 2. 初始化核心处理器
         # PostHandler 负责处理单个动态
-        self.post_handler = PostHandler(api, config, self.extractor, self.downloader, self.saver)
+        self.post_handler = PostHandler(api, config, self.extractor, self.downloader, self.saver, self.archive)
         
         # UserProcessor 负责处理用户级逻辑 (遍历动态列表)
         self.user_processor = UserProcessor(api, config, self.resolver, self.saver, self.post_handler)
 
-    def process_user(self, user_id: int, user_url: str) -> dict:
+    def process_user(self, user_id: int, user_url: str, progress_position: Optional[int] = None) -> dict:
         """
         处理单个用户的所有流程。
         直接委托给 UserProcessor 执行。
+        :param progress_position: 【新增】并行处理多个用户时，该用户进度条所在的行。
         """
-        return self.user_processor.process(user_id, user_url)
\ No newline at end of file
+        return self.user_processor.process(user_id, user_url, progress_position)
\ No newline at end of file
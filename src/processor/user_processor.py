@@ -1,16 +1,22 @@
 # src/processor/user_processor.py
 
 import os
-import time
-import random 
+import datetime
+import itertools
 
-from typing import Dict, List, Iterable
+from typing import Callable, Dict, List, Iterable, Iterator, Optional, Tuple, Any
 from tqdm import tqdm
-from api import BilibiliAPI
+from api import BilibiliAPI, FeedPost
 from config import Config
 from services.folder_resolver import FolderNameResolver
-from services.metadata_saver import MetadataSaver
+from services.metadata_saver import MetadataSaver, Step1Writer
+from services.feed_journal import FeedCursorJournal
+from services.metadata_batch import BatchMetadataPrefetcher
+from services.incremental import IncrementalTracker, Watermark, DECISION_SKIP, DECISION_STOP
+from services.post_index import LocalPostIndex
+from services.retry_queue import DeferredRetryQueue
 from .post_handler import PostHandler
+from .pipeline import PostPipeline, PipelineResult
 
 class UserProcessor:
     """处理单个用户的完整流程。"""
@@ -22,96 +28,143 @@ class UserProcessor:
         self.saver = saver
         self.handler = handler
 
-    def process(self, user_id: int, user_url: str) -> Dict:
+    def process(self, user_id: int, user_url: str, progress_position: Optional[int] = None) -> Dict:
         """
         处理单个用户的主逻辑。
+        :param progress_position: 【新增】并行处理多个用户时，本用户进度条所在的行 (None 表示单用户模式)。
         """
         print(f"\n>>>>>>>>> 开始处理用户ID: {user_id} ({user_url}) <<<<<<<<<")
 
-        post_urls_iterable: Iterable[str]
+        post_urls_iterable: Iterable[FeedPost]
         total_posts = 0
+        journal: Optional[FeedCursorJournal] = None
 
         if self.config.DOWNLOAD_MODE == 'ITERATIVE':
             print("\n[步骤1] 使用 'ITERATIVE' 模式，正在准备迭代获取动态 URL...")
-            post_urls_iterable = self.api.get_post_urls_iterative(user_id)
+            # 【新增】记录翻页游标；--resume 时从上次中断的位置继续
+            journal = FeedCursorJournal(self.handler.archive, user_id)
+            start_offset, resume_after = "", None
+            if self.config.RESUME:
+                resume_point = journal.resume_point()
+                if resume_point:
+                    start_offset, resume_after = resume_point
+                    print(f"  - [续传] 从上次中断的位置继续：动态 {resume_after} 之后 (翻页游标 '{start_offset or '第一页'}')。")
+                else:
+                    print("  - [续传] 没有该用户的中断记录，从第一页开始。")
+            post_urls_iterable = self.api.get_post_urls_iterative(user_id, start_offset)
+            if resume_after:
+                post_urls_iterable = _skip_processed(post_urls_iterable, start_offset, resume_after)
         else:
-            print("\n[步骤1] 使用 'GET_ALL' 模式，正在一次性获取所有动态 URL...")
-            user_page_data = self.api.get_initial_metadata(user_url)
+            if self.config.RESUME:
+                print("  - [续传] 'GET_ALL' 模式不支持断点续传，将处理全部动态。")
+            # 【修改】流式读取 gallery-dl 的输出：不再把整个用户主页的元数据读入内存，
+            # 读到第一条即可确定文件夹并开始处理，其余动态边读取边处理，同时写入步骤1元数据
+            print("\n[步骤1] 使用 'GET_ALL' 模式，正在流式获取所有动态 URL...")
+            entries = self.api.iter_initial_metadata(user_url)
+            first_entry = next(entries, None)
 
-            if not user_page_data:
+            if first_entry is None:
                 print("  - 未收到任何数据，跳过此用户。")
                 return {"processed_posts": 0, "downloaded_images": 0, "downloaded_videos": 0, "failed_images": 0, "folder_name": str(user_id)}
 
-            post_urls = [item[1] for item in user_page_data if len(item) > 1]
-            total_posts = len(post_urls)
-            print(f"找到了 {total_posts} 条动态。")
-            post_urls_iterable = post_urls
-            
-            folder_name = self.resolver.determine_folder_name(user_id, user_page_data, post_urls)
+            first_urls = [first_entry[1]] if len(first_entry) > 1 else []
+            folder_name = self.resolver.determine_folder_name(user_id, [first_entry], first_urls)
             user_folder = os.path.join(self.resolver.base_output_dir, folder_name)
             os.makedirs(user_folder, exist_ok=True)
             
             print(f"用户识别为: '{folder_name}'")
             print(f"文件将保存至: {user_folder}")
 
-            self.saver.save_step1_metadata(user_url, user_folder, user_page_data)
+            post_urls_iterable = _stream_listing(first_entry, entries, self.saver.open_step1_writer(user_url, user_folder),
+                                                 lambda: self.api.initial_metadata_complete(user_url))
 
         folder_name = ""
         user_folder = ""
-        is_first_post = True
+        # 【新增】延迟重试队列：下载失败的资源在后台按退避时间重试，不阻塞后续动态的处理
+        retry_queue = self._create_retry_queue()
 
         # 重试失败项目
         temp_folder_name = self.resolver.determine_folder_name_pre_scan(user_id)
         if temp_folder_name:
             user_folder = os.path.join(self.resolver.base_output_dir, temp_folder_name)
             # 【修改】接收新的返回值: (img_count, vid_count, failed, still_failed_list)
-            successful_retry_imgs, successful_retry_vids, _, persistent_failures = self.handler.downloader.retry_undownloaded(user_folder, temp_folder_name)
+            # 【修改】失败资源保存在归档数据库的失败表中，只重试已到重试时间的资源
+            successful_retry_imgs, successful_retry_vids, _, persistent_failures = self.handler.downloader.retry_failed(user_id, user_folder, temp_folder_name)
+            if retry_queue is not None:
+                retry_queue.submit(persistent_failures)
+                persistent_failures = []
         else:
             successful_retry_imgs, successful_retry_vids, persistent_failures = 0, 0, []
 
         print(f"\n[步骤2] 开始处理用户 {user_id} 的动态...")
-        
-        processed_posts_count = 0
-        total_successful_images = successful_retry_imgs
-        total_successful_videos = successful_retry_vids # 【新增】
-        session_failures: List[Dict] = []
-        
-        for url in tqdm(post_urls_iterable, desc="处理动态", unit=" 条", total=total_posts if total_posts > 0 else None):
-            time.sleep(random.uniform(1.5, 3.5))
-            if is_first_post:
-                if not temp_folder_name:
-                    first_post_meta = self.api.get_post_metadata(url)
-                    folder_name = self.resolver.determine_folder_name(user_id, None, [url], first_post_meta)
-                else:
-                    folder_name = temp_folder_name
-
-                user_folder = os.path.join(self.resolver.base_output_dir, folder_name)
-                os.makedirs(user_folder, exist_ok=True)
-                if is_first_post and not temp_folder_name: # 只打印一次
-                    print(f"\n用户识别为: '{folder_name}'")
-                    print(f"文件将保存至: {user_folder}")
-                is_first_post = False
-            
-            # 【修改】接收拆分后的统计数据
-            should_continue, s_imgs, s_vids, new_failures = self.handler.process(folder_name, url, user_folder)
-            
-            if not should_continue:
-                green_user_name_plain = f"'{folder_name}'"
-                print(f"\n  - 增量下载模式：检测到已下载的内容，将停止处理用户 {green_user_name_plain} 的剩余动态。")
-                break
-            
-            processed_posts_count += 1
-            total_successful_images += s_imgs
-            total_successful_videos += s_vids # 【新增】
-            if new_failures:
-                session_failures.extend(new_failures)
-        
+
+        result = PipelineResult()
+        tracker: Optional[IncrementalTracker] = None
+        posts_iterator = iter(post_urls_iterable)
+        first_post = next(posts_iterator, None)
+
+        if first_post is not None:
+            # 【修改】先用第一条动态确定用户文件夹，再决定使用顺序处理还是流水线处理
+            folder_name, user_folder, first_post_meta = self._resolve_user_folder(user_id, first_post, temp_folder_name)
+            # 【新增】本地已下载动态索引
+            # 【修改】索引由归档数据库提供 (首次处理该用户时自动导入已有文件)
+            post_index = LocalPostIndex(user_folder, self.handler.archive, user_id)
+            # 【新增】按高水位线做增量判断
+            tracker = self._create_tracker(user_id, post_index)
+            all_posts = _prepend(first_post, posts_iterator)
+            prefetched = {first_post.url: first_post_meta} if first_post_meta else {}
+            if self.config.DOWNLOAD_MODE != 'ITERATIVE' and self.config.METADATA_BATCH_SIZE > 1:
+                # 【新增】GET_ALL 模式按批次一次获取多条动态的元数据 (边读取动态列表边组成批次)
+                batcher = BatchMetadataPrefetcher(self.api, self.config.METADATA_BATCH_SIZE, tracker.is_known)
+                for url, images_data in prefetched.items():
+                    batcher.seed(url, images_data)
+                all_posts = batcher.track(all_posts)
+                prefetched = batcher
+            progress_kwargs = self._progress_kwargs(user_id, total_posts, progress_position)
+
+            if self.config.PIPELINE_ENABLED:
+                print(f"  - [流水线] 元数据线程 {self.config.PIPELINE_METADATA_WORKERS} 个，下载线程 {self.config.PIPELINE_DOWNLOAD_WORKERS} 个。")
+                with tqdm(**progress_kwargs) as progress:
+                    result = PostPipeline(self.handler, self.config).run(
+                        all_posts, folder_name, user_folder, tracker, prefetched, progress, user_id, journal, retry_queue)
+            else:
+                result = self._process_sequential(all_posts, folder_name, user_folder, tracker, prefetched, progress_kwargs,
+                                                  user_id, journal, retry_queue)
+
+        # 动态列表是否已正常处理完毕 (而不是因中断或网络错误提前结束)
+        if journal is not None:
+            listing_complete = self.api.feed_exhausted(user_id)
+        else:
+            listing_complete = self.api.initial_metadata_complete(user_url)
+        completed = result.stopped_by_incremental or listing_complete
+        # 【新增】正常处理完毕时删除游标；提前结束时保留，供 --resume 使用
+        if journal is not None and completed:
+            journal.clear()
+        # 【新增】正常处理完毕时才推高水位线，避免跳过中断前尚未处理的动态
+        if tracker is not None and completed:
+            self._save_watermark(user_id, tracker.new_watermark)
+
+        if result.skipped_known_posts > 0:
+            print(f"\n  - 根据本地索引 / 高水位线跳过了 {result.skipped_known_posts} 条已下载的动态。")
+
+        # 【新增】等待延迟重试队列清空，只有最终失败的资源写入失败表
+        if retry_queue is not None:
+            deferred_imgs, deferred_vids, deferred_failures = retry_queue.flush()
+            successful_retry_imgs += deferred_imgs
+            successful_retry_vids += deferred_vids
+            result.failures.extend(deferred_failures)
+
+        processed_posts_count = result.processed_posts
+        total_successful_images = successful_retry_imgs + result.downloaded_images
+        total_successful_videos = successful_retry_vids + result.downloaded_videos # 【新增】
+        session_failures: List[Dict] = result.failures
+
         if not user_folder and temp_folder_name:
              user_folder = os.path.join(self.resolver.base_output_dir, temp_folder_name)
 
         if user_folder:
             all_failures = persistent_failures + session_failures
-            self.handler.downloader.save_undownloaded_list(user_folder, all_failures)
+            self.handler.downloader.record_failures(all_failures)
             total_failed_downloads = len(all_failures)
         else:
             total_failed_downloads = 0
@@ -123,4 +176,184 @@ class UserProcessor:
             "downloaded_videos": total_successful_videos,
             "failed_images": total_failed_downloads,
             "folder_name": folder_name if folder_name else str(user_id)
-        }
\ No newline at end of file
+        }
+
+    @staticmethod
+    def _progress_kwargs(user_id: int, total_posts: int, progress_position: Optional[int]) -> Dict[str, Any]:
+        """生成 tqdm 参数；并行处理多个用户时，每个用户占用固定的一行进度条。"""
+        kwargs: Dict[str, Any] = {"desc": "处理动态", "unit": " 条", "total": total_posts if total_posts > 0 else None}
+        if progress_position is not None:
+            kwargs.update(desc=f"[{user_id}] 处理动态", position=progress_position, leave=False)
+        return kwargs
+
+    def _resolve_user_folder(self, user_id: int, first_post: FeedPost, temp_folder_name: Optional[str]) -> Tuple[str, str, Optional[List[Any]]]:
+        """
+        【新增】根据预扫描结果或第一条动态的元数据确定用户文件夹。
+        返回 (文件夹名称, 文件夹路径, 第一条动态的元数据)；元数据仅在为命名而获取时非空，供后续复用。
+        """
+        first_post_meta = None
+        if not temp_folder_name:
+            # 【修改】索引中缓存了用户名时，无需为命名额外获取第一条动态的元数据
+            if not self.resolver.cached_username(user_id):
+                first_post_meta = self.api.get_post_metadata(first_post.url)
+            folder_name = self.resolver.determine_folder_name(user_id, None, [first_post.url], first_post_meta)
+        else:
+            folder_name = temp_folder_name
+
+        user_folder = os.path.join(self.resolver.base_output_dir, folder_name)
+        os.makedirs(user_folder, exist_ok=True)
+        if not temp_folder_name: # 只打印一次
+            print(f"\n用户识别为: '{folder_name}'")
+            print(f"文件将保存至: {user_folder}")
+        return folder_name, user_folder, first_post_meta
+
+    def _create_retry_queue(self) -> Optional[DeferredRetryQueue]:
+        """【新增】启用延迟重试时，为当前用户创建重试队列。"""
+        if not self.config.RETRY_QUEUE_ENABLED:
+            return None
+        return DeferredRetryQueue(self.handler.downloader, self.config.RETRY_QUEUE_MAX_ATTEMPTS,
+                                  self.config.RETRY_QUEUE_BASE_DELAY, self.config.RETRY_QUEUE_MAX_DELAY)
+
+    def _create_tracker(self, user_id: int, post_index: LocalPostIndex) -> IncrementalTracker:
+        """【新增】读取用户的高水位线并创建增量判断器。"""
+        watermark = None
+        stored = self.handler.archive.get_watermark(user_id) if self.handler.archive else None
+        if stored:
+            watermark = Watermark(*stored)
+            if self.config.INCREMENTAL_DOWNLOAD:
+                print(f"  - [增量] 高水位线: 动态 {watermark.opus_id} / 发布时间 {watermark.pub_ts}，"
+                      f"连续 {self.config.INCREMENTAL_STOP_AFTER} 条已知动态后停止。")
+        return IncrementalTracker(post_index, self.config.INCREMENTAL_DOWNLOAD, self.config.INCREMENTAL_STOP_AFTER, watermark)
+
+    def _save_watermark(self, user_id: int, watermark: Watermark):
+        """【新增】保存本次同步后的高水位线。"""
+        if self.handler.archive is None or (watermark.opus_id is None and watermark.pub_ts is None):
+            return
+        self.handler.archive.save_watermark(user_id, watermark.opus_id, watermark.pub_ts,
+                                            datetime.datetime.now().isoformat(timespec='seconds'))
+
+    def _process_sequential(self, posts: Iterable[FeedPost], folder_name: str, user_folder: str,
+                            tracker: IncrementalTracker, prefetched: Dict[str, List[Any]], progress_kwargs: Dict[str, Any],
+                            user_id: Optional[int] = None, journal: Optional[FeedCursorJournal] = None,
+                            retry_queue: Optional[DeferredRetryQueue] = None) -> PipelineResult:
+        """
+        逐条处理动态 (非流水线模式)。
+        :param retry_queue: 【新增】提供时，下载失败的资源交给延迟重试队列，而不是直接计入失败列表。
+        """
+        result = PipelineResult()
+
+        for post in tqdm(posts, **progress_kwargs):
+            # 【新增】先用动态列表中的 ID 查询本地索引，已完整下载的动态无需调用 gallery-dl
+            # 【修改】增量模式下早于高水位线的动态同样跳过，连续遇到足够多的已知动态后才停止
+            decision = tracker.check(post)
+            if decision == DECISION_STOP:
+                print(f"\n  - 增量下载模式：检测到已下载的内容，将停止处理用户 '{folder_name}' 的剩余动态。")
+                result.stopped_by_incremental = True
+                break
+            if decision == DECISION_SKIP:
+                result.skipped_known_posts += 1
+                if journal is not None:
+                    journal.track(post)
+                    journal.done(post)
+                continue
+
+            if journal is not None:
+                journal.track(post)
+
+            try:
+                # 【修改】请求频率由 BilibiliAPI 内的集中限速器控制，不再固定随机休眠
+                images_data = prefetched.pop(post.url, None)
+
+                # 【修改】接收拆分后的统计数据
+                should_continue, prepared, s_imgs, s_vids, new_failures = self.handler.process(folder_name, post.url, user_folder, images_data, user_id)
+            except Exception as e:
+                # 单条动态出错不中断整个用户：与元数据获取失败相同，不推进高水位线与游标
+                print(f"  - 处理动态 {post.url} 时出错: {e}")
+                tracker.record_unprepared(post)
+                continue
+
+            if not should_continue:
+                if tracker.record_known(post):
+                    green_user_name_plain = f"'{folder_name}'"
+                    print(f"\n  - 增量下载模式：检测到已下载的内容，将停止处理用户 {green_user_name_plain} 的剩余动态。")
+                    result.stopped_by_incremental = True
+                    break
+                result.skipped_known_posts += 1
+                if journal is not None:
+                    journal.done(post)
+                continue
+
+            result.processed_posts += 1
+            if prepared is None:
+                # 元数据获取失败 (或无效)：不推进高水位线与游标，下次运行时重新处理该动态
+                tracker.record_unprepared(post)
+                continue
+            result.downloaded_images += s_imgs
+            result.downloaded_videos += s_vids # 【新增】
+            if retry_queue is not None:
+                retry_queue.submit(new_failures)
+            elif new_failures:
+                result.failures.extend(new_failures)
+            tracker.record_processed(post)
+            if journal is not None:
+                journal.done(post)
+
+        # 【新增】提前停止时立即关闭动态列表 (取消翻页预取 / 终止 gallery-dl 子进程)
+        close = getattr(posts, 'close', None)
+        if close:
+            close()
+        return result
+
+def _prepend(first: FeedPost, rest: Iterator[FeedPost]) -> Iterator[FeedPost]:
+    """把已取出的第一条动态放回迭代序列；关闭该生成器时会一并关闭底层的翻页生成器。"""
+    try:
+        yield first
+        yield from rest
+    finally:
+        close = getattr(rest, 'close', None)
+        if close:
+            close()
+
+def _stream_listing(first_entry: List[Any], entries: Iterator[List[Any]], writer: Step1Writer,
+                    is_complete: Callable[[], bool]) -> Iterator[FeedPost]:
+    """
+    【新增】GET_ALL 模式：边读取 gallery-dl 的输出边产出动态，同时写入步骤1元数据。
+    列表完整读取 (is_complete 为真) 后才保存步骤1元数据；读取失败或提前关闭 (例如增量模式停止) 时
+    放弃写入并终止 gallery-dl，保留上一次完整的步骤1元数据。
+    """
+    total_posts = 0
+    finished = False
+    try:
+        for entry in itertools.chain((first_entry,), entries):
+            writer.write(entry)
+            if len(entry) > 1:
+                total_posts += 1
+                yield FeedPost.from_url(entry[1])
+        finished = is_complete()
+        if finished:
+            print(f"\n  - 动态列表读取完毕，共找到 {total_posts} 条动态。")
+    finally:
+        entries.close()
+        if finished:
+            writer.commit()
+        else:
+            writer.discard()
+
+def _skip_processed(posts: Iterator[FeedPost], page_offset: str, last_opus_id: str) -> Iterator[FeedPost]:
+    """
+    【新增】断点续传：跳过游标所在页面中 last_opus_id 及其之前 (已处理完成) 的动态。
+    关闭该生成器时会一并关闭底层的翻页生成器。
+    """
+    skipping = True
+    try:
+        for post in posts:
+            if skipping and post.page_offset == page_offset:
+                if post.opus_id == last_opus_id:
+                    skipping = False
+                continue
+            skipping = False
+            yield post
+    finally:
+        close = getattr(posts, 'close', None)
+        if close:
+            close()
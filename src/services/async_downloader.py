@@ -0,0 +1,242 @@
+# src/services/async_downloader.py
+
+import os
+import re
+import time
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Coroutine, Dict, List, Optional
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+from database import ArchiveDB
+from services.downloader import Downloader, DownloadResult, IncompleteDownloadError, PART_SUFFIX
+from services.http_session import ConnectionStats, DEFAULT_HEADERS
+from services.metrics import (Metrics, STAGE_CDN_DOWNLOAD, COUNTER_DOWNLOAD_BYTES, COUNTER_DOWNLOAD_RETRIES,
+                              COUNTER_DOWNLOAD_FAILURES)
+from services.rate_limiter import AdaptiveRateLimiter, ENDPOINT_CDN, is_throttle_response
+
+class AsyncDownloader(Downloader):
+    """
+    【新增】基于 asyncio + httpx 的下载后端 (config.toml 中 download_backend = "asyncio")。
+    - 一个后台线程运行事件循环，所有下载在同一个循环中并发进行，不再为每个并发下载占用一个线程；
+    - 一个 httpx.AsyncClient 复用到 CDN 的连接，安装了 h2 时使用 HTTP/2 (同一连接上多路复用)；
+    - 文件写入交给一个小的线程池，不阻塞事件循环；
+    - 对外接口与 Downloader 相同 (download_image / download_batch 等同步方法)，
+      顺序处理、流水线下载线程以及多个并行用户都可以直接调用，请求共享同一个事件循环与连接池。
+    需要安装 httpx (pip install "httpx[http2]")，未安装时构造函数抛出 ImportError。
+    """
+
+    def __init__(self, max_connections: int = 64, rate_limiter: Optional[AdaptiveRateLimiter] = None,
+                 archive: Optional[ArchiveDB] = None, metrics: Optional[Metrics] = None):
+        """
+        :param max_connections: 同时进行的最大下载数 (同时也是连接池大小)。
+        其余参数与 Downloader 相同。共用状态由 Downloader._init_state 初始化，同步后端的会话与线程池在这里用不到。
+        """
+        if httpx is None:
+            raise ImportError("asyncio 下载后端需要 httpx，请运行: pip install \"httpx[http2]\"")
+        self._init_state(max_connections, rate_limiter, archive, metrics)
+        self.http2 = HTTP2_AVAILABLE
+        self.stats = ConnectionStats()
+        # 文件写入线程池 (磁盘 IO 不阻塞事件循环)
+        self._io_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="download-io")
+
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="download-loop", daemon=True)
+        self._loop_thread.start()
+        self._client = self._call(self._create_client())
+        self._semaphore = self._call(self._create_semaphore())
+
+    async def _create_client(self) -> "httpx.AsyncClient":
+        limits = httpx.Limits(max_connections=self.max_workers, max_keepalive_connections=self.max_workers)
+        return httpx.AsyncClient(http2=self.http2, limits=limits, headers=DEFAULT_HEADERS,
+                                 timeout=httpx.Timeout(30.0), follow_redirects=True)
+
+    async def _create_semaphore(self) -> asyncio.Semaphore:
+        return asyncio.Semaphore(self.max_workers)
+
+    def _call(self, coroutine: Coroutine) -> Any:
+        """
+        在事件循环中运行协程并等待结果 (可以从任意线程调用)。
+        协程在调用方上下文的副本中运行，输出前缀与 metrics 用户作用域随之生效。
+        """
+        result: Future = Future()
+
+        def start():
+            task = self._loop.create_task(coroutine)
+
+            def done(finished: asyncio.Task):
+                if finished.cancelled():
+                    result.cancel()
+                elif finished.exception() is not None:
+                    result.set_exception(finished.exception())
+                else:
+                    result.set_result(finished.result())
+            task.add_done_callback(done)
+
+        self._loop.call_soon_threadsafe(start, context=contextvars.copy_context())
+        return result.result()
+
+    def connection_stats(self) -> Dict[str, int]:
+        return self.stats.snapshot()
+
+    def close(self):
+        """关闭 HTTP 客户端并停止事件循环。"""
+        if not self._loop.is_running():
+            return
+        self._call(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop.close()
+        self._io_executor.shutdown()
+
+    def download_batch(self, tasks: List[Dict]) -> List[DownloadResult]:
+        """
+        并发下载多个资源，结果按输入顺序返回。
+        是否已下载 (查询归档数据库) 与跨用户去重在调用方线程中判断，事件循环中只进行网络传输与文件写入。
+        """
+        results: List[Optional[DownloadResult]] = [None] * len(tasks)
+        pending = []
+        for position, task in enumerate(tasks):
+            filename = self.build_filename(task['url'], task['pub_ts'], task['id_str'], task['index'])
+            if self.is_downloaded(task.get('uid'), task['id_str'], task['index'], filename, task['folder']):
+                results[position] = "SKIPPED"
+            elif self.dedup is not None and self.dedup.link_existing(task['url'], os.path.join(task['folder'], filename)):
+                results[position] = "SUCCESS"
+            else:
+                pending.append((position, task, filename))
+        if pending:
+            async def run_all():
+                return await asyncio.gather(*(self._download(task, filename) for _, task, filename in pending))
+            for (position, _, _), result in zip(pending, self._call(run_all())):
+                results[position] = result
+        self._attach_errors(tasks, results)
+        return results
+
+    def download_image(self, url: str, folder: str, pub_ts: int, id_str: str, index: int, user_name: str,
+                       uid: Optional[int] = None) -> DownloadResult:
+        """与 Downloader.download_image 相同的接口与返回值。"""
+        task = {'url': url, 'folder': folder, 'pub_ts': pub_ts, 'id_str': id_str, 'index': index,
+                'user_name': user_name, 'uid': uid}
+        return self.download_batch([task])[0]
+
+    async def _download(self, task: Dict, filename: str) -> DownloadResult:
+        """下载一个资源：限速、有限次数的尝试、断点续传，逻辑与 Downloader.download_image 相同。"""
+        filepath = os.path.join(task['folder'], filename)
+        green_user_name = f"\033[92m{task['user_name']}\033[0m"
+        print(f"  -  正在下载用户 {green_user_name} 资源: {filename}")
+
+        async with self._semaphore:
+            attempts = 1 if self.defer_failures else self.MAX_ATTEMPTS
+            transfer_seconds = 0.0
+            for attempt in range(attempts):
+                if attempt > 0:
+                    self.metrics.count(COUNTER_DOWNLOAD_RETRIES)
+                await self.rate_limiter.acquire_async(ENDPOINT_CDN)
+                start = time.perf_counter()
+                try:
+                    await self._fetch_to_file_async(task['url'], filepath)
+                    transfer_seconds += time.perf_counter() - start
+                    self._last_errors.pop(filepath, None)
+                    if self.dedup is not None:
+                        self.dedup.remember(task['url'], filepath)
+                    self.metrics.observe(STAGE_CDN_DOWNLOAD, transfer_seconds)
+                    self.rate_limiter.report_success(ENDPOINT_CDN)
+                    return "SUCCESS"
+                except (httpx.HTTPError, IncompleteDownloadError) as e:
+                    transfer_seconds += time.perf_counter() - start
+                    # 连接错误 / 超时没有响应 (httpx 的异常只有 HTTPStatusError 带 response)
+                    response = getattr(e, 'response', None)
+                    status_code = response.status_code if response is not None else "Unknown"
+                    print(f"  - 下载失败 (状态码 {status_code}): {e}")
+                    self._last_errors[filepath] = f"状态码 {status_code}: {e}"
+                    throttled = is_throttle_response(status_code=status_code)
+                    if throttled:
+                        self.rate_limiter.report_throttled(ENDPOINT_CDN)
+                    if attempt < attempts - 1:
+                        print(f"  - 稍后重试... (尝试 {attempt + 2}/{attempts})")
+                        if not throttled:
+                            await self.rate_limiter.backoff_async(ENDPOINT_CDN, attempt)
+                    elif not self.defer_failures:
+                        print("  - 所有重试均失败，跳过此文件。")
+
+            self.metrics.observe(STAGE_CDN_DOWNLOAD, transfer_seconds)
+            if not self.defer_failures:
+                self.metrics.count(COUNTER_DOWNLOAD_FAILURES)
+            return "FAILED"
+
+    async def _trace(self, event_name: str, info: Dict[str, Any]):
+        """httpcore 的 trace 回调：连接池每建立一个新连接时计数，其余请求即为复用已有连接。"""
+        if event_name in ("connection.connect_tcp.complete", "connection.connect_unix_socket.complete"):
+            self.stats.record_new_connection()
+
+    async def _get(self, url: str, headers: Optional[Dict[str, str]] = None) -> "httpx.Response":
+        """发起流式 GET 请求 (响应体尚未读取，由调用方关闭)。"""
+        request = self._client.build_request("GET", url, headers=headers, extensions={"trace": self._trace})
+        self.stats.record_request()
+        return await self._client.send(request, stream=True)
+
+    async def _fetch_to_file_async(self, url: str, filepath: str) -> int:
+        """
+        Downloader._fetch_to_file 的异步版本：写入 '.part' 临时文件，支持 Range 续传，
+        校验长度后重命名为正式文件，返回本次传输的字节数。
+        """
+        loop = asyncio.get_running_loop()
+        part_path = filepath + PART_SUFFIX
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else None
+
+        response = await self._get(url, headers)
+        if offset and response.status_code == 416:
+            # 断点超出文件范围 (临时文件已损坏)，丢弃后从头下载
+            await response.aclose()
+            os.remove(part_path)
+            offset = 0
+            response = await self._get(url)
+        try:
+            response.raise_for_status()
+
+            if offset and response.status_code == 206:
+                range_match = re.match(r'bytes (\d+)-', response.headers.get('Content-Range', ''))
+                if not range_match or int(range_match.group(1)) != offset:
+                    os.remove(part_path)
+                    raise IncompleteDownloadError(f"服务器返回的断点位置与本地不一致: {response.headers.get('Content-Range')}", response=response)
+                mode = 'ab'
+                print(f"  - 从断点 {offset} 字节处继续下载: {os.path.basename(filepath)}")
+            else:
+                mode, offset = 'wb', 0
+
+            expected_size = self._expected_size(response, offset)
+            received = 0
+            f = await loop.run_in_executor(self._io_executor, open, part_path, mode)
+            try:
+                async for chunk in response.aiter_bytes(65536):
+                    await loop.run_in_executor(self._io_executor, f.write, chunk)
+                    received += len(chunk)
+            finally:
+                await loop.run_in_executor(self._io_executor, f.close)
+                # 中断的传输同样计入流量
+                self.metrics.count(COUNTER_DOWNLOAD_BYTES, received)
+        finally:
+            await response.aclose()
+
+        actual_size = os.path.getsize(part_path)
+        if expected_size is not None and actual_size != expected_size:
+            if actual_size > expected_size:
+                # 比声明的还长，说明临时文件不可信，下次从头下载
+                os.remove(part_path)
+            raise IncompleteDownloadError(f"文件不完整: 已下载 {actual_size} / {expected_size} 字节", response=response)
+
+        os.replace(part_path, filepath)
+        return received
@@ -2,7 +2,9 @@
 
 import os
 import json
-from typing import List, Dict
+from typing import Any, List, Dict
+
+from services.step2_store import find_step2_file, load_step2_file
 
 class ContentExtractor:
     """负责从本地保存的原始元数据中提取信息并生成最终内容JSON文件。"""
@@ -15,25 +17,23 @@ class ContentExtractor:
         然后创建或更新最终的内容JSON文件。
 
         此方法确保了所有数据提取操作都基于本地文件，方便调试。
+        【修改】下载流程中改用 create_content_json 直接处理内存中的元数据，
+        本方法只用于离线重建 (例如修改了提取逻辑后重新生成内容信息文件)。
         """
-        step2_metadata_filename = f"{date_str}_{id_str}.json"
-        # 构造相对路径用于显示
-        step2_relative_path = os.path.join('metadata', 'step2', step2_metadata_filename)
-        step2_metadata_path = os.path.join(user_folder, 'metadata', 'step2', step2_metadata_filename)
-        
-        final_content_filename = f"{date_str}_{id_str}.json"
-        final_content_filepath = os.path.join(user_folder, final_content_filename)
-
         # 步骤1: 检查本地的 step2 元数据文件是否存在
-        if not os.path.exists(step2_metadata_path):
+        # 【修改】紧凑格式 (.json.gz) 与旧格式 (.json) 均可
+        step2_metadata_path = find_step2_file(user_folder, date_str, id_str)
+        if step2_metadata_path is None:
             # 只有出错时才打印完整文件名，避免刷屏
             # print(f"  - 错误：无法找到用于提取内容的源元数据文件: {step2_metadata_filename}")
             return
+        step2_metadata_filename = os.path.basename(step2_metadata_path)
+        # 构造相对路径用于显示
+        step2_relative_path = os.path.join('metadata', 'step2', step2_metadata_filename)
 
         # 步骤2: 读取并解析 step2 元数据文件
         try:
-            with open(step2_metadata_path, 'r', encoding='utf-8') as f:
-                images_data = json.load(f)
+            images_data = load_step2_file(step2_metadata_path)
         except (json.JSONDecodeError, Exception) as e:
             print(f"  - 错误：读取或解析源元数据文件 {step2_metadata_filename} 失败: {e}")
             return
@@ -41,85 +41,124 @@ class ContentExtractor:
         # 【修改日志 1】明确这是原始元数据，且加上相对路径前缀
         # print(f"  - 正在从本地元数据 '{step2_metadata_filename}' 中提取内容...") 
         print(f"  - [提取] 读取原始元数据: {step2_relative_path}")
+        self.create_content_json(user_folder, date_str, id_str, images_data)
 
-        # 步骤3: 从加载的数据中提取所有字段
+    def create_content_json(self, user_folder: str, date_str: str, id_str: str, images_data: List[Any]):
+        """【新增】直接从内存中的元数据 (gallery-dl 原始输出) 生成内容信息文件，无需重新读取 step2 文件。"""
         try:
-            # 初始化所有变量
-            post_url = "null"
-            username = "null"
-            pub_ts = 0
-            pub_time = "null"
-            title = "null"
-            content = "null"
-            content_found = False
-            like_count, comment_count, forward_count, favorite_count = 0, 0, 0, 0
-            
-            # 安全地访问嵌套数据
-            first_image_meta = images_data[0][-1] if images_data and images_data[0] else {}
-            detail = first_image_meta.get('detail', {})
-            modules = detail.get('modules', {})
-            module_author = modules.get('module_author', {})
-            
-            # 提取基础信息
-            post_url = first_image_meta.get('url', post_url)
-            id_str_from_meta = detail.get('id_str', id_str) # 优先使用元数据中的id_str
-            username = module_author.get('name', username)
-            pub_ts = module_author.get('pub_ts', pub_ts)
-            pub_time = module_author.get('pub_time', pub_time)
-            
-            # 提取标题
-            title_text = modules.get('module_title', {}).get('text')
-            if title_text:
-                title = title_text
+            data_to_save = self.extract_content(images_data, id_str)
+        except (IndexError, KeyError, TypeError, ValueError) as e:
+            print(f"  - 从本地元数据提取信息时发生错误: {e}")
+            return
+        self.save_content_json(user_folder, date_str, id_str, data_to_save)
+
+    def extract_content(self, images_data: List[Any], id_str: str) -> Dict[str, Any]:
+        """
+        【新增】从元数据中提取内容信息文件的全部字段。
+        数据结构异常时抛出 IndexError / KeyError / TypeError / ValueError。
+        """
+        # 初始化所有变量
+        post_url = "null"
+        username = "null"
+        pub_ts = 0
+        pub_time = "null"
+        title = "null"
+        content = "null"
+        content_found = False
+        like_count, comment_count, forward_count, favorite_count = 0, 0, 0, 0
+        
+        # 安全地访问嵌套数据
+        first_image_meta = images_data[0][-1] if images_data and images_data[0] else {}
+        detail = first_image_meta.get('detail', {})
+        modules = detail.get('modules', {})
+        module_author = modules.get('module_author', {})
+        
+        # 提取基础信息
+        post_url = first_image_meta.get('url', post_url)
+        id_str_from_meta = detail.get('id_str', id_str) # 优先使用元数据中的id_str
+        username = module_author.get('name', username)
+        pub_ts = module_author.get('pub_ts', pub_ts)
+        pub_time = module_author.get('pub_time', pub_time)
+        
+        # 提取标题
+        title_text = modules.get('module_title', {}).get('text')
+        if title_text:
+            title = title_text
 
-            # 提取正文内容（与之前逻辑相同）
-            content_parts = []
-            module_dynamic = modules.get('module_dynamic', {})
-            if module_dynamic and module_dynamic.get('desc') and module_dynamic['desc'].get('rich_text_nodes'):
-                for node in module_dynamic['desc']['rich_text_nodes']:
-                    if node.get('type') == 'RICH_TEXT_NODE_TYPE_TEXT' and node.get('text'):
-                        content_parts.append(node['text'])
-                if content_parts:
-                    content_found = True
-            
-            if not content_found:
-                module_content = modules.get('module_content', {})
-                if module_content and module_content.get('paragraphs'):
-                    for paragraph in module_content['paragraphs']:
-                        text_block = paragraph.get('text', {})
-                        if text_block and text_block.get('nodes'):
-                            for node in text_block['nodes']:
-                                if node.get('type') == 'TEXT_NODE_TYPE_WORD' and node.get('word', {}).get('words'):
-                                    content_parts.append(node['word']['words'])
+        # 提取正文内容（与之前逻辑相同）
+        content_parts = []
+        module_dynamic = modules.get('module_dynamic', {})
+        if module_dynamic and module_dynamic.get('desc') and module_dynamic['desc'].get('rich_text_nodes'):
+            for node in module_dynamic['desc']['rich_text_nodes']:
+                if node.get('type') == 'RICH_TEXT_NODE_TYPE_TEXT' and node.get('text'):
+                    content_parts.append(node['text'])
             if content_parts:
-                content = "".join(content_parts)
-            
-            # 提取统计数据
-            module_stat = modules.get('module_stat', {})
-            if module_stat:
-                like_count = module_stat.get('like', {}).get('count', 0)
-                comment_count = module_stat.get('comment', {}).get('count', 0)
-                forward_count = module_stat.get('forward', {}).get('count', 0)
-                favorite_count = module_stat.get('favorite', {}).get('count', 0)
+                content_found = True
+        
+        if not content_found:
+            module_content = modules.get('module_content', {})
+            if module_content and module_content.get('paragraphs'):
+                for paragraph in module_content['paragraphs']:
+                    text_block = paragraph.get('text', {})
+                    if text_block and text_block.get('nodes'):
+                        for node in text_block['nodes']:
+                            if node.get('type') == 'TEXT_NODE_TYPE_WORD' and node.get('word', {}).get('words'):
+                                content_parts.append(node['word']['words'])
+        if content_parts:
+            content = "".join(content_parts)
+        
+        # 提取统计数据
+        module_stat = modules.get('module_stat', {})
+        if module_stat:
+            like_count = module_stat.get('like', {}).get('count', 0)
+            comment_count = module_stat.get('comment', {}).get('count', 0)
+            forward_count = module_stat.get('forward', {}).get('count', 0)
+            favorite_count = module_stat.get('favorite', {}).get('count', 0)
 
-            # 步骤4: 准备要保存的最终数据结构
-            data_to_save = {
-                "url": post_url,
-                "id_str": id_str_from_meta,
-                "username": username,
-                "pub_ts": pub_ts,
-                "pub_time": pub_time,
-                "title": title,
-                "content": content,
-                "stats": { "likes": like_count, "comments": comment_count, "forwards": forward_count, "favorites": favorite_count }
-            }
+        # 准备要保存的最终数据结构
+        return {
+            "url": post_url,
+            "id_str": id_str_from_meta,
+            "username": username,
+            "pub_ts": pub_ts,
+            "pub_time": pub_time,
+            "title": title,
+            "content": content,
+            "stats": { "likes": like_count, "comments": comment_count, "forwards": forward_count, "favorites": favorite_count }
+        }
 
-            # 步骤5: 写入最终的内容JSON文件
+    def save_content_json(self, user_folder: str, date_str: str, id_str: str, data_to_save: Dict[str, Any]) -> bool:
+        """
+        【新增】写入最终的内容JSON文件，返回是否实际写入。
+        文件已存在且内容完全相同时跳过写入 (例如补充下载实况视频、重试失败资源时)。
+        """
+        final_content_filename = f"{date_str}_{id_str}.json"
+        try:
+            written = self.write_content_json(user_folder, date_str, id_str, data_to_save)
+        except OSError as e:
+            print(f"  - 警告：写入内容信息文件 {final_content_filename} 失败: {e}")
+            return False
+        if written:
             # 【修改日志 2】明确这是生成的最终文件
             print(f"  - [生成] 写入内容信息文件: {final_content_filename}")
-            
-            with open(final_content_filepath, 'w', encoding='utf-8') as f:
-                json.dump(data_to_save, f, ensure_ascii=False, indent=4)
+        else:
+            print(f"  - [生成] 内容信息文件未变化，跳过写入: {final_content_filename}")
+        return written
 
-        except (IndexError, KeyError, TypeError, ValueError) as e:
-            print(f"  - 从本地元数据提取信息时发生错误: {e}")
\ No newline at end of file
+    @staticmethod
+    def write_content_json(user_folder: str, date_str: str, id_str: str, data_to_save: Dict[str, Any]) -> bool:
+        """
+        【新增】不输出日志的写入：内容与已有文件相同时返回 False，否则写入并返回 True。写入失败时抛出 OSError。
+        """
+        final_content_filepath = os.path.join(user_folder, f"{date_str}_{id_str}.json")
+        content = json.dumps(data_to_save, ensure_ascii=False, indent=4)
+        try:
+            # 以文本模式比较与写入，与原来 json.dump 写出的文件 (包括换行符) 保持一致
+            with open(final_content_filepath, 'r', encoding='utf-8') as f:
+                if f.read() == content:
+                    return False
+        except (OSError, UnicodeDecodeError):
+            pass
+        with open(final_content_filepath, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return True
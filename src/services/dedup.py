@@ -0,0 +1,147 @@
+# src/services/dedup.py
+
+import os
+import errno
+import shutil
+import hashlib
+from typing import Optional, Tuple
+from urllib.parse import urlsplit
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，不支持 reflink
+    fcntl = None
+
+from database import ArchiveDB
+from services.metrics import Metrics, COUNTER_DEDUP_HITS, COUNTER_DEDUP_BYTES
+
+# 去重方式 (对应 config.toml 中的 dedup_mode)
+DEDUP_OFF = "off"
+DEDUP_HARDLINK = "hardlink"
+DEDUP_REFLINK = "reflink"
+SUPPORTED_DEDUP_MODES = (DEDUP_OFF, DEDUP_HARDLINK, DEDUP_REFLINK)
+
+# 实际放置文件的方式
+LINK_REFLINK = "reflink"
+LINK_HARDLINK = "hardlink"
+LINK_COPY = "copy"
+# 每种去重方式依次尝试的放置方式 (前一种不可用时回退到下一种)
+_LINK_CHAIN = {
+    DEDUP_REFLINK: (LINK_REFLINK, LINK_HARDLINK, LINK_COPY),
+    DEDUP_HARDLINK: (LINK_HARDLINK, LINK_COPY),
+}
+_LINK_LABELS = {LINK_REFLINK: "reflink 共享", LINK_HARDLINK: "硬链接", LINK_COPY: "复制"}
+
+# Linux 的 FICLONE ioctl (btrfs / XFS 等支持写时复制的文件系统)
+_FICLONE = 0x40049409
+# 临时文件后缀，放置完成后原子地重命名为目标文件
+_TEMP_SUFFIX = ".dedup"
+
+def cdn_key(url: str) -> str:
+    """
+    资源在 CDN 上的路径，作为去重的键。
+    同一资源可能由不同的 CDN 主机 (i0 / i1 / i2.hdslb.com) 或协议提供，也可能带 '@' 图片处理参数，均视为同一资源。
+    """
+    return urlsplit(url).path.split('@', 1)[0]
+
+def file_digest(path: str) -> str:
+    """计算文件内容的 SHA-256 (离线去重时按内容判断文件是否相同)。"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _reflink(source: str, target: str):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "当前平台不支持 reflink")
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+def link_file(source: str, target: str, mode: str, allow_copy: bool = True) -> str:
+    """
+    按 mode 把 source 放到 target (覆盖已存在的 target)，返回实际使用的方式。
+    reflink 不可用 (文件系统不支持) 时回退到硬链接，硬链接不可用 (跨文件系统等) 时回退到复制；
+    allow_copy 为 False 时不复制 (离线去重复制没有意义)，全部失败时抛出最后一个 OSError。
+    先写入临时文件再原子替换，中途失败不会破坏已有的 target。
+    """
+    temp_path = target + _TEMP_SUFFIX
+    last_error: Optional[OSError] = None
+    for method in _LINK_CHAIN.get(mode, (LINK_HARDLINK, LINK_COPY)):
+        if method == LINK_COPY and not allow_copy:
+            continue
+        try:
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+            if method == LINK_REFLINK:
+                _reflink(source, temp_path)
+            elif method == LINK_HARDLINK:
+                os.link(source, temp_path)
+            else:
+                shutil.copyfile(source, temp_path)
+            os.replace(temp_path, target)
+            return method
+        except OSError as e:
+            last_error = e
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+    raise last_error if last_error is not None else OSError(errno.EINVAL, f"未知的去重方式: {mode}")
+
+def link_label(method: str) -> str:
+    return _LINK_LABELS.get(method, method)
+
+class DedupStore:
+    """
+    【新增】跨用户的内容寻址资源索引。
+    转发与共享的作品在多个账号中指向同一个 CDN 资源；每个资源第一次下载完成后记录 CDN 路径 → 本地文件，
+    之后其他用户 (或同一用户的其他动态) 需要同一资源时，下载器在发起任何网络请求前先查询索引，
+    直接以 reflink / 硬链接 (不可用时复制) 的方式放置文件，同时节省带宽与磁盘空间。
+    索引保存在归档数据库的 blobs 表中。
+    """
+
+    def __init__(self, archive: ArchiveDB, mode: str = DEDUP_HARDLINK, metrics: Optional[Metrics] = None):
+        self.archive = archive
+        self.mode = mode
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    def _lookup(self, key: str, filepath: str) -> Optional[Tuple[str, int]]:
+        """返回仍然有效的已下载文件 (路径, 字节数)；文件已被删除或修改时返回 None。"""
+        entry = self.archive.get_blob(key)
+        if entry is None:
+            return None
+        source, size = entry
+        if os.path.abspath(source) == os.path.abspath(filepath):
+            return None
+        try:
+            if os.path.getsize(source) != size:
+                return None
+        except OSError:
+            return None
+        return source, size
+
+    def link_existing(self, url: str, filepath: str) -> bool:
+        """资源已在本地存在时把它放到 filepath 并返回 True；否则返回 False，由调用方下载。"""
+        found = self._lookup(cdn_key(url), filepath)
+        if found is None:
+            return False
+        source, size = found
+        try:
+            method = link_file(source, filepath, self.mode)
+        except OSError as e:
+            print(f"  - 警告：无法从已下载的 {source} 放置 {os.path.basename(filepath)}，改为下载: {e}")
+            return False
+        print(f"  - [去重] {os.path.basename(filepath)} 已在 {os.path.basename(os.path.dirname(source))} 中下载过，"
+              f"使用{link_label(method)}，跳过下载。")
+        self.metrics.count(COUNTER_DEDUP_HITS)
+        self.metrics.count(COUNTER_DEDUP_BYTES, size)
+        return True
+
+    def remember(self, url: str, filepath: str):
+        """记录一个刚下载完成的资源；索引中的文件已失效时用新文件替换。"""
+        key = cdn_key(url)
+        try:
+            size = os.path.getsize(filepath)
+        except OSError:
+            return
+        self.archive.add_blob(key, os.path.abspath(filepath), size, replace=self._lookup(key, filepath) is None)
@@ -4,46 +4,112 @@ import os
 import re
 import datetime
 import requests
-import time
 import json
-from typing import List, Dict, Tuple, Literal
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Literal, Optional
+
+from database import ArchiveDB, kind_from_filename, uid_from_folder_name
+from services.dedup import DedupStore
+from services.http_session import PooledSession
+from services.rate_limiter import AdaptiveRateLimiter, ENDPOINT_CDN, is_throttle_response
+from services.metrics import (Metrics, STAGE_CDN_DOWNLOAD, COUNTER_DOWNLOAD_BYTES, COUNTER_DOWNLOAD_RETRIES,
+                              COUNTER_DOWNLOAD_FAILURES)
 
 DownloadResult = Literal["SUCCESS", "SKIPPED", "FAILED"]
 
+# 【新增】下载后端 (对应 config.toml 中的 download_backend)
+DOWNLOAD_BACKEND_THREADS = "threads"
+DOWNLOAD_BACKEND_ASYNCIO = "asyncio"
+SUPPORTED_DOWNLOAD_BACKENDS = (DOWNLOAD_BACKEND_THREADS, DOWNLOAD_BACKEND_ASYNCIO)
+
+# 未下载完成的文件后缀，下载完成并校验长度后才重命名为正式文件名
+PART_SUFFIX = ".part"
+
+# 【新增】旧版本保存在各用户文件夹中的失败列表，现在导入 SQLite 失败表后删除
+LEGACY_FAILURE_FILE = "undownloaded.json"
+
+class IncompleteDownloadError(requests.exceptions.RequestException):
+    """【新增】下载结束时文件长度与服务器声明的长度不一致。"""
+
 class Downloader:
     """负责下载图片文件，并管理失败的下载。"""
 
-    def _get_undownloaded_filepath(self, folder: str) -> str:
-        return os.path.join(folder, 'undownloaded.json')
+    # 单个资源在 download_image 中的最大尝试次数
+    MAX_ATTEMPTS = 3
+    # 【新增】为 True 时 download_image 只尝试一次，失败的资源交给延迟重试队列 (DeferredRetryQueue) 稍后重试，
+    # 不在原地退避等待；最终失败的计数与提示也由队列负责
+    defer_failures = False
+    # 【新增】跨用户去重索引 (config.toml 中 dedup_mode 不为 "off" 时由 create_downloader 设置)，
+    # 下载前先查询，资源已在本地存在时直接链接 / 复制，下载完成后登记
+    dedup: Optional[DedupStore] = None
+
+    def __init__(self, session: Optional[PooledSession] = None, max_workers: int = 1,
+                 rate_limiter: Optional[AdaptiveRateLimiter] = None, archive: Optional[ArchiveDB] = None,
+                 metrics: Optional[Metrics] = None):
+        """
+        :param session: 【新增】长连接下载会话，由 PostProcessorFacade 注入；
+                        未提供时自行创建一个默认大小的连接池会话。
+        :param max_workers: 【新增】同时进行的最大下载数，1 表示逐个下载。
+        :param rate_limiter: 【新增】共享的自适应限速器，控制 CDN 请求速度与重试退避。
+        :param archive: 【新增】下载归档数据库，判断资源是否已下载时优先查询归档。
+        :param metrics: 【新增】计时与计数层 (下载耗时、字节数、重试次数)，默认与限速器共用同一个。
+        """
+        self._init_state(max_workers, rate_limiter, archive, metrics)
+        self.session = session if session is not None else PooledSession()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="download") if self.max_workers > 1 else None
+
+    def _init_state(self, max_workers: int, rate_limiter: Optional[AdaptiveRateLimiter], archive: Optional[ArchiveDB],
+                    metrics: Optional[Metrics]):
+        """
+        【新增】与传输方式无关的状态 (限速、归档、计时与失败记录)，所有下载后端共用。
+        只属于同步后端的会话与线程池在 __init__ 中创建；新增的共用属性应放在这里。
+        """
+        self.rate_limiter = rate_limiter if rate_limiter is not None else AdaptiveRateLimiter()
+        self.metrics = metrics if metrics is not None else self.rate_limiter.metrics
+        self.archive = archive
+        self.max_workers = max(1, max_workers)
+        # 【新增】下载失败的文件路径 → 最后一次的错误信息；每批下载结束时由 _attach_errors 取出并写到失败的任务上，
+        # 不会在多次下载之间累积
+        self._last_errors: Dict[str, str] = {}
+
+    def connection_stats(self) -> Dict[str, int]:
+        """返回本次运行中下载会话的连接复用统计。"""
+        return self.session.stats.snapshot()
+
+    def close(self):
+        """【新增】运行结束时释放下载线程池与连接。"""
+        if self._executor is not None:
+            self._executor.shutdown()
+        self.session.close()
 
-    def retry_undownloaded(self, folder: str, user_name: str) -> Tuple[int, int, int, List[Dict]]:
+    def retry_failed(self, uid: Optional[int], folder: str, user_name: str,
+                     include_pending: bool = False) -> Tuple[int, int, int, List[Dict]]:
         """
         尝试重新下载之前失败的图片。
         【修改】返回值增加一项，区分图片和视频: (成功图片数, 成功视频数, 失败数, 仍然未下载的列表)
+        【修改】失败资源改为保存在归档数据库的失败表中 (替代 undownloaded.json)：先导入文件夹中旧的
+        undownloaded.json，再取出该用户已到重试时间的资源重新下载。
+        :param include_pending: 为 True 时忽略重试时间，重试该用户的全部失败资源 (--retry-only --force)。
         """
-        undownloaded_path = self._get_undownloaded_filepath(folder)
-        if not os.path.exists(undownloaded_path):
+        if self.archive is None or uid is None:
             return 0, 0, 0, []
-
-        print(f"\n  - 检测到 'undownloaded.json'，正在尝试重新下载 {user_name} 的失败项目...")
-        
-        try:
-            with open(undownloaded_path, 'r', encoding='utf-8') as f:
-                failed_items = json.load(f)
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"  - 警告：读取 'undownloaded.json' 文件失败或格式错误，跳过重试: {e}")
+        import_legacy_failures(self.archive, folder, uid)
+        failed_items = [failure_to_task(row, folder) for row in self.archive.due_failures(uid, include_pending)]
+        if not failed_items:
             return 0, 0, 0, []
 
+        print(f"\n  - 失败表中有 {len(failed_items)} 个项目待重试，正在尝试重新下载 {user_name} 的失败项目...")
+
         still_failed = []
         successful_retries_img = 0
         successful_retries_vid = 0
         failed_retries = 0
 
-        for item in failed_items:
-            item['folder'] = folder
-            
-            result = self.download_image(**item)
+        for item, result in zip(failed_items, self.download_batch(failed_items)):
             if result == "SUCCESS":
+                self.record_success(item)
                 # 【新增】通过URL后缀判断是图片还是视频
                 url = item.get('url', '')
                 if url.endswith('.mp4') or url.endswith('.mov'):
@@ -57,80 +123,265 @@ class Downloader:
         print(f"  - 重试完成: {successful_retries_img + successful_retries_vid} 个成功 (图片:{successful_retries_img}/实况图片:{successful_retries_vid}), {failed_retries} 个失败。")
         return successful_retries_img, successful_retries_vid, failed_retries, still_failed
 
-    def save_undownloaded_list(self, folder: str, undownloaded_items: List[Dict]):
-        """将未下载的图片信息列表保存到 undownloaded.json 文件中。"""
-        undownloaded_path = self._get_undownloaded_filepath(folder)
-        
-        unique_items = []
-        seen_identifiers = set()
-        
-        for item in undownloaded_items:
-            identifier = (item['url'], item['index'])
-            if identifier not in seen_identifiers:
-                seen_identifiers.add(identifier)
-                item_to_save = item.copy()
-                if 'folder' in item_to_save:
-                    del item_to_save['folder']
-                unique_items.append(item_to_save)
-
-        if not unique_items:
-            if os.path.exists(undownloaded_path):
-                try:
-                    os.remove(undownloaded_path)
-                    print("\n  - 所有图片均已成功下载，已删除 'undownloaded.json'。")
-                except OSError as e:
-                    print(f"  - 警告：删除 'undownloaded.json' 文件失败: {e}")
+    def record_failures(self, failed_items: List[Dict]) -> int:
+        """
+        【修改】替代 save_undownloaded_list：把最终下载失败的资源写入归档数据库的失败表，
+        失败次数加一并记录最后一次的错误信息；失败次数越多，下一次自动重试的间隔越长。
+        下载成功的资源写入归档时会自动从失败表中删除。返回写入的项目数。
+        """
+        if not failed_items:
+            return 0
+        if self.archive is None:
+            print(f"  - 警告：没有归档数据库，无法记录 {len(failed_items)} 个未下载的项目。")
+            return 0
+
+        rows = {}
+        for item in failed_items:
+            folder_name = os.path.basename(os.path.normpath(item['folder']))
+            uid = item.get('uid') if item.get('uid') is not None else uid_from_folder_name(folder_name)
+            if uid is None:
+                continue
+            filename = self.build_filename(item['url'], item['pub_ts'], item['id_str'], item['index'])
+            kind = kind_from_filename(filename)
+            last_error = item.get('last_error')
+            rows[(uid, item['id_str'], item['index'], kind)] = (
+                uid, item['id_str'], item['index'], kind, item['url'], item.get('pub_ts'), item.get('user_name'),
+                folder_name, last_error)
+
+        written = self.archive.record_failures(rows.values())
+        if written:
+            print(f"\n  - 将 {written} 个未下载的项目记录到失败表，之后的运行会自动重试 (也可以使用 --retry-only)。")
+        return written
+
+
+    def download_batch(self, tasks: List[Dict]) -> List[DownloadResult]:
+        """
+        【新增】使用有界线程池并发下载多个资源。
+        每个任务是 download_image 的参数字典，结果按输入顺序返回。
+        失败的任务会带上 'last_error' (最后一次的错误信息)，记录到失败表时使用。
+        """
+        if self._executor is None or len(tasks) <= 1:
+            results = [self._download_task(task) for task in tasks]
+        else:
+            # 复制调用方的上下文，使下载线程中的输出沿用调用方的设置 (例如并行用户的行前缀)
+            futures = [self._executor.submit(contextvars.copy_context().run, self._download_task, task) for task in tasks]
+            results = [future.result() for future in futures]
+        self._attach_errors(tasks, results)
+        return results
+
+    def _download_task(self, task: Dict) -> DownloadResult:
+        """按任务字典调用 download_image (任务中的 'last_error' 等附加字段不作为参数传入)。"""
+        return self.download_image(task['url'], task['folder'], task['pub_ts'], task['id_str'], task['index'],
+                                   task['user_name'], task.get('uid'))
+
+    def _attach_errors(self, tasks: List[Dict], results: List[DownloadResult]):
+        """【新增】取出本批任务的错误信息：失败的任务记在 'last_error' 上，其余的直接丢弃。"""
+        for task, result in zip(tasks, results):
+            filename = self.build_filename(task['url'], task['pub_ts'], task['id_str'], task['index'])
+            last_error = self._last_errors.pop(os.path.join(task['folder'], filename), None)
+            if result == "FAILED":
+                task['last_error'] = last_error
+            else:
+                task.pop('last_error', None)
+
+    @staticmethod
+    def build_filename(url: str, pub_ts: int, id_str: str, index: int) -> str:
+        """【新增】根据资源URL与动态信息生成本地文件名: {日期}_{动态ID}_{序号}{扩展名}。"""
+        try:
+            date_str = datetime.datetime.fromtimestamp(pub_ts).strftime('%Y-%m-%d')
+        except (ValueError, OSError):
+            date_str = 'unknown_date'
+
+        file_ext_match = re.search(r'\.(jpg|jpeg|png|gif|webp|mp4|mov)', url, re.IGNORECASE)
+        file_ext = file_ext_match.group(0) if file_ext_match else '.jpg'
+        return f"{date_str}_{id_str}_{index}{file_ext}"
+
+    def record_success(self, task: Dict):
+        """将一个下载成功的任务写入归档 (延迟重试队列中重试成功的任务同样通过它写入)。"""
+        if self.archive is None or task.get('uid') is None:
             return
+        filename = self.build_filename(task['url'], task['pub_ts'], task['id_str'], task['index'])
+        self.archive.add(task['uid'], task['id_str'], task['index'], kind_from_filename(filename), filename)
+
+    def is_downloaded(self, uid: Optional[int], id_str: str, index: int, filename: str, folder: str) -> bool:
+        """
+        【新增】判断资源是否已下载：先查归档 (索引查询)，未记录时再检查本地文件。
+        本地文件存在但归档中没有记录时 (例如手动放入的文件)，顺便补写归档。
+        """
+        kind = kind_from_filename(filename)
+        if self.archive is not None and uid is not None:
+            if self.archive.asset_exists(uid, id_str, index, kind):
+                return True
+            if os.path.exists(os.path.join(folder, filename)):
+                self.archive.add(uid, id_str, index, kind, filename)
+                return True
+            return False
+        return os.path.exists(os.path.join(folder, filename))
+
+    @staticmethod
+    def _expected_size(response: requests.Response, offset: int) -> Optional[int]:
+        """根据 Content-Range / Content-Length 计算完整文件的字节数；无法确定时返回 None。"""
+        if response.headers.get('Content-Encoding', 'identity') != 'identity':
+            # 压缩传输时解压后的长度与 Content-Length 不同，无法校验
+            return None
+        content_range = response.headers.get('Content-Range', '')
+        match = re.match(r'bytes (\d+)-\d+/(\d+)', content_range)
+        if response.status_code == 206 and match:
+            return int(match.group(2))
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit():
+            return offset + int(content_length)
+        return None
 
-        print(f"\n  - 将 {len(unique_items)} 个未下载的项目信息保存到 'undownloaded.json'...")
+    def _fetch_to_file(self, url: str, filepath: str) -> int:
+        """
+        【新增】把资源下载到 '.part' 临时文件，校验长度后原子地重命名为正式文件，返回本次传输的字节数。
+        - 临时文件已存在时使用 HTTP Range 请求从断点继续下载；
+        - 服务器不支持 Range (返回 200) 或断点无效 (416) 时从头下载；
+        - 长度不足时保留临时文件并抛出异常，下次重试从断点继续。
+        """
+        part_path = filepath + PART_SUFFIX
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else None
+
+        response = self.session.get(url, stream=True, timeout=30, headers=headers)
+        if offset and response.status_code == 416:
+            # 断点超出文件范围 (临时文件已损坏)，丢弃后从头下载
+            response.close()
+            os.remove(part_path)
+            offset = 0
+            response = self.session.get(url, stream=True, timeout=30)
+        response.raise_for_status()
+
+        if offset and response.status_code == 206:
+            range_match = re.match(r'bytes (\d+)-', response.headers.get('Content-Range', ''))
+            if not range_match or int(range_match.group(1)) != offset:
+                response.close()
+                os.remove(part_path)
+                raise IncompleteDownloadError(f"服务器返回的断点位置与本地不一致: {response.headers.get('Content-Range')}", response=response)
+            mode = 'ab'
+            print(f"  - 从断点 {offset} 字节处继续下载: {os.path.basename(filepath)}")
+        else:
+            mode, offset = 'wb', 0
+
+        expected_size = self._expected_size(response, offset)
+        received = 0
         try:
-            with open(undownloaded_path, 'w', encoding='utf-8') as f:
-                json.dump(unique_items, f, indent=4, ensure_ascii=False)
-        except IOError as e:
-            print(f"  - 错误：写入 'undownloaded.json' 文件失败: {e}")
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=65536):
+                    f.write(chunk)
+                    received += len(chunk)
+        finally:
+            # 中断的传输同样计入流量
+            self.metrics.count(COUNTER_DOWNLOAD_BYTES, received)
+
+        actual_size = os.path.getsize(part_path)
+        if expected_size is not None and actual_size != expected_size:
+            if actual_size > expected_size:
+                # 比声明的还长，说明临时文件不可信，下次从头下载
+                os.remove(part_path)
+            raise IncompleteDownloadError(f"文件不完整: 已下载 {actual_size} / {expected_size} 字节", response=response)
 
+        os.replace(part_path, filepath)
+        return received
 
-    def download_image(self, url: str, folder: str, pub_ts: int, id_str: str, index: int, user_name: str) -> DownloadResult:
+    def download_image(self, url: str, folder: str, pub_ts: int, id_str: str, index: int, user_name: str,
+                       uid: Optional[int] = None) -> DownloadResult:
             """
             下载单个图片文件，增加了重试机制和用户名显示。
+            【修改】uid: 所属用户ID，提供时通过归档数据库判断是否已下载。
+            成功下载的资源由调用方按动态批量写入归档。
+            【修改】先写入 '.part' 临时文件，完整后才重命名，中断的下载不会被误判为已下载，
+            重试时从断点继续。
+            【新增】各次尝试的传输耗时 (不含限速与退避等待) 合计记为一次 cdn_download，并统计重试与失败次数。
             """
-            try:
-                date_str = datetime.datetime.fromtimestamp(pub_ts).strftime('%Y-%m-%d')
-            except (ValueError, OSError):
-                date_str = 'unknown_date'
-
-            file_ext_match = re.search(r'\.(jpg|jpeg|png|gif|webp|mp4|mov)', url, re.IGNORECASE)
-            file_ext = file_ext_match.group(0) if file_ext_match else '.jpg'
-
-            image_filename = f"{date_str}_{id_str}_{index}{file_ext}"
+            image_filename = self.build_filename(url, pub_ts, id_str, index)
             filepath = os.path.join(folder, image_filename)
 
-            if os.path.exists(filepath):
+            if self.is_downloaded(uid, id_str, index, image_filename, folder):
                 return "SKIPPED"
+            if self.dedup is not None and self.dedup.link_existing(url, filepath):
+                return "SUCCESS"
 
             green_user_name = f"\033[92m{user_name}\033[0m"
             print(f"  -  正在下载用户 {green_user_name} 资源: {image_filename}")
             
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Referer": "https://www.bilibili.com/"
-            }
-
-            for attempt in range(3):
+            attempts = 1 if self.defer_failures else self.MAX_ATTEMPTS
+            transfer_seconds = 0.0
+            for attempt in range(attempts):
+                if attempt > 0:
+                    self.metrics.count(COUNTER_DOWNLOAD_RETRIES)
+                self.rate_limiter.acquire(ENDPOINT_CDN)
+                start = time.perf_counter()
                 try:
-                    response = requests.get(url, stream=True, timeout=30, headers=headers)
-                    response.raise_for_status()
-                    with open(filepath, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            f.write(chunk)
+                    self._fetch_to_file(url, filepath)
+                    transfer_seconds += time.perf_counter() - start
+                    self._last_errors.pop(filepath, None)
+                    if self.dedup is not None:
+                        self.dedup.remember(url, filepath)
+                    self.metrics.observe(STAGE_CDN_DOWNLOAD, transfer_seconds)
+                    self.rate_limiter.report_success(ENDPOINT_CDN)
                     return "SUCCESS" 
                 except requests.exceptions.RequestException as e:
-                    status_code = e.response.status_code if e.response else "Unknown"
+                    transfer_seconds += time.perf_counter() - start
+                    status_code = e.response.status_code if e.response is not None else "Unknown"
                     print(f"  - 下载失败 (状态码 {status_code}): {e}")
-                    if attempt < 2:
-                        print(f"  - 5秒后重试... (尝试 {attempt + 2}/3)")
-                        time.sleep(6)
-                    else:
+                    self._last_errors[filepath] = f"状态码 {status_code}: {e}"
+                    # 【修改】被限流时由限速器降速，其他错误按指数退避重试，替代固定的 6 秒休眠
+                    throttled = is_throttle_response(status_code=status_code)
+                    if throttled:
+                        self.rate_limiter.report_throttled(ENDPOINT_CDN)
+                    if attempt < attempts - 1:
+                        print(f"  - 稍后重试... (尝试 {attempt + 2}/{attempts})")
+                        if not throttled:
+                            self.rate_limiter.backoff(ENDPOINT_CDN, attempt)
+                    elif not self.defer_failures:
                         print("  - 所有重试均失败，跳过此文件。")
             
-            return "FAILED"
\ No newline at end of file
+            self.metrics.observe(STAGE_CDN_DOWNLOAD, transfer_seconds)
+            if not self.defer_failures:
+                self.metrics.count(COUNTER_DOWNLOAD_FAILURES)
+            return "FAILED"
+
+def failure_to_task(row: Dict, folder: str) -> Dict:
+    """【新增】把失败表中的一行转换为 download_image 的参数字典。"""
+    return {'url': row['url'], 'folder': folder, 'pub_ts': row['pub_ts'] or 0, 'id_str': row['post_id'],
+            'index': row['idx'], 'user_name': row['user_name'] or row['folder_name'], 'uid': row['uid']}
+
+def import_legacy_failures(archive: ArchiveDB, user_folder: str, uid: Optional[int] = None) -> int:
+    """
+    【新增】把用户文件夹中旧的 undownloaded.json 导入失败表 (可以立即重试)，全部导入后删除该文件。
+    失败表中已有的记录保持不变。返回导入的项目数。
+    """
+    legacy_path = os.path.join(user_folder, LEGACY_FAILURE_FILE)
+    if not os.path.exists(legacy_path):
+        return 0
+    try:
+        with open(legacy_path, 'r', encoding='utf-8') as f:
+            items = json.load(f)
+    except (json.JSONDecodeError, IOError) as e:
+        print(f"  - 警告：读取 '{LEGACY_FAILURE_FILE}' 文件失败或格式错误，跳过导入: {e}")
+        return 0
+
+    folder_name = os.path.basename(os.path.normpath(user_folder))
+    folder_uid = uid if uid is not None else uid_from_folder_name(folder_name)
+    rows, skipped = [], 0
+    for item in items:
+        item_uid = item.get('uid') if item.get('uid') is not None else folder_uid
+        if item_uid is None or not item.get('url'):
+            skipped += 1
+            continue
+        filename = Downloader.build_filename(item['url'], item.get('pub_ts', 0), item['id_str'], item['index'])
+        rows.append((item_uid, item['id_str'], item['index'], kind_from_filename(filename), item['url'],
+                     item.get('pub_ts'), item.get('user_name'), folder_name, f"从 {LEGACY_FAILURE_FILE} 导入"))
+
+    archive.record_failures(rows, increment=False)
+    if skipped:
+        print(f"  - 警告：'{legacy_path}' 中有 {skipped} 个项目无法确定所属用户，保留该文件。")
+    else:
+        try:
+            os.remove(legacy_path)
+        except OSError as e:
+            print(f"  - 警告：删除 '{LEGACY_FAILURE_FILE}' 文件失败: {e}")
+    print(f"  - 已将 '{legacy_path}' 中的 {len(rows)} 个项目导入失败表。")
+    return len(rows)
@@ -0,0 +1,55 @@
+# src/services/feed_journal.py
+
+import datetime
+import threading
+from typing import List, Optional, Tuple
+
+from api import FeedPost
+from database import ArchiveDB
+
+class FeedCursorJournal:
+    """
+    【新增】单个用户的动态列表运行日志 (断点续传)。
+    按动态列表顺序登记每条动态，处理完成后标记；只有"之前的动态全部处理完成"的部分才会推进游标，
+    因此流水线模式中动态乱序完成时，记录下来的游标也不会越过尚未完成的动态。
+    游标为 (该动态所在页面的翻页 offset, 动态ID)，保存在归档数据库中。
+    """
+
+    def __init__(self, archive: Optional[ArchiveDB], uid: int):
+        self.archive = archive
+        self.uid = uid
+        self._lock = threading.Lock()
+        # 按动态列表顺序排列的 [动态, 是否已完成]
+        self._pending: List[list] = []
+
+    def resume_point(self) -> Optional[Tuple[str, str]]:
+        """返回上次记录的 (翻页游标, 最后处理完成的动态ID)。"""
+        return self.archive.get_feed_cursor(self.uid) if self.archive else None
+
+    def track(self, post: FeedPost):
+        """按动态列表顺序登记一条即将处理的动态。"""
+        if self.archive is None or post.page_offset is None:
+            return
+        with self._lock:
+            self._pending.append([post, False])
+
+    def done(self, post: FeedPost):
+        """标记一条动态处理完成，并尽可能向前推进游标。"""
+        if self.archive is None:
+            return
+        last_done = None
+        with self._lock:
+            for entry in self._pending:
+                if entry[0] is post:
+                    entry[1] = True
+                    break
+            while self._pending and self._pending[0][1]:
+                last_done = self._pending.pop(0)[0]
+        if last_done is not None and last_done.opus_id:
+            self.archive.save_feed_cursor(self.uid, last_done.page_offset, last_done.opus_id,
+                                          datetime.datetime.now().isoformat(timespec='seconds'))
+
+    def clear(self):
+        """动态列表已正常处理完毕 (翻到最后一页或增量停止)，删除游标。"""
+        if self.archive is not None:
+            self.archive.clear_feed_cursor(self.uid)
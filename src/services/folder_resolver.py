@@ -2,18 +2,133 @@
 
 import os
 import re
-import json
-from typing import List, Dict, Any, Optional
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 from api import BilibiliAPI
 from config import Config
+from database import ArchiveDB, uid_from_folder_name
+from services.step2_store import is_step2_file, load_step2_file
+
+def _author_from_step2(data: Any) -> Tuple[Optional[int], Optional[str]]:
+    """从 step2 元数据中读取作者的 (用户ID, 用户名)。"""
+    try:
+        author = data[0][-1].get('detail', {}).get('modules', {}).get('module_author', {})
+        return author.get('mid'), author.get('name')
+    except (IndexError, KeyError, TypeError, AttributeError):
+        return None, None
+
+def scan_user_folder(base_output_dir: str, folder_name: str) -> Optional[Tuple[int, str, Optional[str]]]:
+    """
+    【新增】识别单个用户文件夹，返回 (用户ID, 文件夹名称, 用户名)；无法识别时返回 None。
+    用户ID 优先取自 'Name_UID' 格式的文件夹名称，其次取自 step2 元数据；
+    step2 元数据从最新的文件开始读取，找到作者信息即停止，不会解析整个文件夹。
+    """
+    user_folder = os.path.join(base_output_dir, folder_name)
+    if not os.path.isdir(user_folder):
+        return None
+    uid = uid_from_folder_name(folder_name)
+    username = None
+
+    meta_dir = os.path.join(user_folder, 'metadata', 'step2')
+    if os.path.isdir(meta_dir):
+        for meta_file in sorted(os.listdir(meta_dir), reverse=True):
+            if not is_step2_file(meta_file):
+                continue
+            try:
+                mid, name = _author_from_step2(load_step2_file(os.path.join(meta_dir, meta_file)))
+            except (ValueError, OSError):
+                continue
+            if mid is None or (uid is not None and mid != uid):
+                continue
+            uid, username = mid, name
+            break
+
+    return (uid, folder_name, username) if uid is not None else None
 
 class FolderNameResolver:
-    """负责确定用户文件夹名称的类。"""
+    """
+    负责确定用户文件夹名称的类。
+    【修改】提供归档数据库时使用持久化的 用户ID → 文件夹名称 索引：
+    索引在第一次使用时建立 (并行扫描输出目录)，之后每次确定文件夹名称都会同步更新，
+    不再为每个用户遍历输出目录或逐个解析 step2 元数据；索引中还缓存了用户名，
+    新建文件夹时无需为获取用户名额外请求第一条动态的元数据。
+    """
 
-    def __init__(self, base_output_dir: str, api: BilibiliAPI, config: Config):
+    def __init__(self, base_output_dir: str, api: BilibiliAPI, config: Config, archive: Optional[ArchiveDB] = None):
         self.base_output_dir = base_output_dir
         self.api = api
         self.config = config
+        self.archive = archive
+        self._index_lock = threading.Lock()
+        self._index_ready = False
+
+    def _ensure_index(self) -> bool:
+        """确保文件夹索引已建立；没有归档数据库时返回 False (退回逐个扫描)。"""
+        if self.archive is None:
+            return False
+        with self._index_lock:
+            if not self._index_ready:
+                if not self.archive.folder_index_built():
+                    print("  - [命名] 首次使用文件夹索引，正在扫描输出目录建立索引...")
+                    count = self.rebuild_index()
+                    print(f"  - [命名] 索引建立完成，共 {count} 个用户文件夹。")
+                self._index_ready = True
+        return True
+
+    def rebuild_index(self, max_workers: Optional[int] = None) -> int:
+        """
+        【新增】并行扫描输出目录中的所有文件夹，重建 用户ID → 文件夹 索引。
+        同一用户对应多个文件夹时，保留 'Name_UID' 格式的文件夹。返回索引中的用户数。
+        """
+        if not os.path.isdir(self.base_output_dir):
+            folder_names = []
+        else:
+            folder_names = sorted(os.listdir(self.base_output_dir))
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="folder-index") as executor:
+            scanned = [r for r in executor.map(lambda name: scan_user_folder(self.base_output_dir, name), folder_names) if r]
+
+        entries: Dict[int, Tuple[int, str, Optional[str]]] = {}
+        for uid, folder_name, username in scanned:
+            current = entries.get(uid)
+            if current is None or (not current[1].endswith(f"_{uid}") and folder_name.endswith(f"_{uid}")):
+                entries[uid] = (uid, folder_name, username or (current[2] if current else None))
+
+        self.archive.replace_user_folders(entries.values(), datetime.datetime.now().isoformat(timespec='seconds'))
+        return len(entries)
+
+    def _lookup_index(self, user_id: int) -> Optional[str]:
+        """查询索引；记录的文件夹已不存在时视为未命中。"""
+        entry = self.archive.get_user_folder(user_id)
+        if entry and os.path.isdir(os.path.join(self.base_output_dir, entry[0])):
+            return entry[0]
+        return None
+
+    def _find_indexed_folder(self, user_id: int) -> Optional[str]:
+        """
+        【新增】查询索引，未命中时再按 Name_UID 后缀扫描一次输出目录并写入索引，
+        建立索引之后手动创建 / 恢复的文件夹同样可以找到，不会再新建重复的文件夹。
+        """
+        folder_name = self._lookup_index(user_id)
+        if folder_name is None:
+            folder_name = self._scan_for_folder_by_uid_pattern(user_id)
+            if folder_name:
+                self._remember(user_id, folder_name)
+        return folder_name
+
+    def cached_username(self, user_id: int) -> Optional[str]:
+        """【新增】返回索引中缓存的用户名。"""
+        if not self._ensure_index():
+            return None
+        entry = self.archive.get_user_folder(user_id)
+        return entry[1] if entry else None
+
+    def _remember(self, user_id: int, folder_name: str, username: Optional[str] = None):
+        """把确定的文件夹名称 (以及从 API 获取的用户名) 写入索引。"""
+        if self.archive is not None:
+            self.archive.set_user_folder(user_id, folder_name, username)
 
     def _sanitize_filename(self, filename: str) -> str:
         """清理字符串，使其可以安全地用作文件名。"""
@@ -62,17 +177,16 @@ class FolderNameResolver:
                 if not os.path.isdir(meta_dir):
                     continue
                 for meta_file in os.listdir(meta_dir):
-                    if not meta_file.endswith('.json'):
+                    if not is_step2_file(meta_file):
                         continue
                     try:
-                        with open(os.path.join(meta_dir, meta_file), 'r', encoding='utf-8') as f:
-                            data = json.load(f)
+                        data = load_step2_file(os.path.join(meta_dir, meta_file))
                         if data and isinstance(data, list) and len(data[0]) > 1 and isinstance(data[0][-1], dict):
                            uid_from_meta = data[0][-1].get('detail', {}).get('modules', {}).get('module_author', {}).get('mid')
                            if uid_from_meta and uid_from_meta == user_id:
                                print(f"  - 匹配成功！在文件夹 '{folder_name}' 中找到了用户ID {user_id}。")
                                return folder_name
-                    except (json.JSONDecodeError, IndexError, KeyError, TypeError):
+                    except (ValueError, OSError, IndexError, KeyError, TypeError):
                         continue
         except Exception as e:
             print(f"  - 扫描文件夹时出错: {e}")
@@ -88,12 +202,16 @@ class FolderNameResolver:
             # 【修改】使用统一格式化方法
             return self._format_folder_name(mapped_name, user_id)
 
-        # 2. 检查本地是否存在符合 Name_UID 格式的文件夹
+        # 2. 【新增】查询文件夹索引 (已包含按文件夹名称与元数据识别的结果)
+        if self._ensure_index():
+            return self._find_indexed_folder(user_id)
+
+        # 3. 检查本地是否存在符合 Name_UID 格式的文件夹
         existing_by_pattern = self._scan_for_folder_by_uid_pattern(user_id)
         if existing_by_pattern:
             return existing_by_pattern
 
-        # 3. 深度扫描
+        # 4. 深度扫描
         return self._scan_for_existing_folder(user_id)
 
     def determine_folder_name(self, user_id: int, user_page_data: Optional[List[Dict]], post_urls: List[str], first_post_meta: Optional[List[Dict]] = None) -> str:
@@ -101,9 +219,10 @@ class FolderNameResolver:
         确定文件夹名称的主逻辑。
         优先级:
         1. Config 映射 (包含 CLI 传入的名称)
-        2. 本地已存在的符合 UID 后缀的文件夹
-        3. API 获取的用户名
+        2. 本地已存在的符合 UID 后缀的文件夹 (【修改】有索引时查询索引)
+        3. 索引中缓存的用户名 / API 获取的用户名
         4. Fallback (unknown_UID)
+        确定的文件夹名称会写入索引。
         """
         user_id_str = str(user_id)
         base_name = None
@@ -112,16 +231,29 @@ class FolderNameResolver:
         if user_id_str in self.config.USER_ID_TO_NAME_MAP:
             base_name = self.config.USER_ID_TO_NAME_MAP[user_id_str]
             print(f"  - [命名] 在配置/命令行中找到强制映射: {user_id_str} -> {base_name}")
-            return self._format_folder_name(base_name, user_id)
+            folder_name = self._format_folder_name(base_name, user_id)
+            self._remember(user_id, folder_name)
+            return folder_name
 
         # --- 2. 【核心修改】检查本地是否存在符合 Name_UID 格式的文件夹 ---
         # 这一步提到了 API 获取之前。如果本地已经下载过该用户，直接沿用旧文件夹名。
-        existing_folder = self._scan_for_folder_by_uid_pattern(user_id)
+        if self._ensure_index():
+            existing_folder = self._find_indexed_folder(user_id)
+        else:
+            existing_folder = self._scan_for_folder_by_uid_pattern(user_id)
         if existing_folder:
             print(f"  - [命名] 发现本地已存在匹配 UID 的文件夹，直接使用: {existing_folder}")
             return existing_folder
 
-        # --- 3. 尝试从 API 数据中获取用户名 ---
+        # --- 3. 【新增】索引中缓存了用户名时直接使用，无需请求 API ---
+        cached_name = self.cached_username(user_id)
+        if cached_name:
+            print(f"  - [命名] 使用索引中缓存的用户名: {cached_name}")
+            folder_name = self._format_folder_name(cached_name, user_id)
+            self._remember(user_id, folder_name)
+            return folder_name
+
+        # --- 4. 尝试从 API 数据中获取用户名 ---
         print("  - [命名] 本地无记录且无强制映射，尝试从 API 获取用户名...")
         
         # 优先从 user_page_data (GET_ALL模式)
@@ -148,11 +280,14 @@ class FolderNameResolver:
         
         if base_name:
             print(f"  - [命名] 已通过 API 获取用户名: {base_name}")
-            return self._format_folder_name(base_name, user_id)
+            folder_name = self._format_folder_name(base_name, user_id)
+            self._remember(user_id, folder_name, base_name)
+            return folder_name
         
         else:
-            # --- 4. 获取失败的处理 (unknown 逻辑) ---
+            # --- 5. 获取失败的处理 (unknown 逻辑) ---
             print("  - [命名] 未能获取用户名。")
             # 最后的保底
             print(f"  - [命名] 将使用 'unknown_{user_id}' 作为文件夹名。")
+            self._remember(user_id, f"unknown_{user_id}")
             return f"unknown_{user_id}"
\ No newline at end of file
@@ -0,0 +1,115 @@
+# src/services/incremental.py
+
+import threading
+from dataclasses import dataclass
+from typing import List, Optional
+
+from api import FeedPost
+from services.post_index import LocalPostIndex
+
+# IncrementalTracker.check 的返回值
+DECISION_PROCESS = "process"  # 需要获取元数据并下载
+DECISION_SKIP = "skip"        # 已下载或早于高水位线，跳过
+DECISION_STOP = "stop"        # 连续遇到足够多的已知动态，停止处理该用户
+
+def _opus_id_int(post: FeedPost) -> Optional[int]:
+    return int(post.opus_id) if post.opus_id and post.opus_id.isdigit() else None
+
+def _same_post(mark: "Watermark", post: FeedPost) -> bool:
+    opus_id = _opus_id_int(post)
+    return opus_id is not None and opus_id == mark.opus_id
+
+@dataclass
+class Watermark:
+    """【新增】用户的高水位线：已完整同步过的最新动态 (动态ID 与发布时间戳)。"""
+    opus_id: Optional[int] = None
+    pub_ts: Optional[int] = None
+
+    def covers(self, post: FeedPost) -> bool:
+        """动态是否不晚于高水位线 (即上次同步时已经处理过)。优先比较发布时间，缺失时比较动态ID。"""
+        if post.pub_ts is not None and self.pub_ts is not None:
+            return post.pub_ts <= self.pub_ts
+        opus_id = _opus_id_int(post)
+        if opus_id is not None and self.opus_id is not None:
+            return opus_id <= self.opus_id
+        return False
+
+    def advance(self, post: FeedPost):
+        """用一条已处理的动态推高水位线。"""
+        opus_id = _opus_id_int(post)
+        if opus_id is not None and (self.opus_id is None or opus_id > self.opus_id):
+            self.opus_id = opus_id
+        if post.pub_ts is not None and (self.pub_ts is None or post.pub_ts > self.pub_ts):
+            self.pub_ts = post.pub_ts
+
+class IncrementalTracker:
+    """
+    【新增】按高水位线决定每条动态的处理方式，替代原来"遇到第一条已下载动态就停止"的增量逻辑。
+    - 本地索引中已完整下载的动态总是跳过；
+    - 增量模式下，不晚于高水位线的动态直接跳过，无需调用 gallery-dl；
+    - 置顶动态不受高水位线影响，也不计入"连续已知动态"计数，置顶的旧动态不会再让同步提前结束；
+    - 增量模式下连续遇到 stop_after 条已知动态后停止。
+    同时记录本次处理过的最新动态，用于在同步完成后更新高水位线；
+    元数据获取失败的动态会限制新的高水位线，使其不越过该动态，下次运行时重新处理。
+    """
+
+    def __init__(self, post_index: LocalPostIndex, incremental: bool, stop_after: int = 1,
+                 watermark: Optional[Watermark] = None):
+        self.post_index = post_index
+        self.incremental = incremental
+        self.stop_after = max(1, stop_after)
+        self.watermark = watermark
+        self._synced: List[FeedPost] = []
+        self._unprepared: List[FeedPost] = []
+        self._known_streak = 0
+        self._lock = threading.Lock()
+
+    def _below_watermark(self, post: FeedPost) -> bool:
+        return (self.incremental and not post.pinned
+                and self.watermark is not None and self.watermark.covers(post))
+
+    def is_known(self, post: FeedPost) -> bool:
+        """【新增】不改变任何状态地判断动态是否大概率会被跳过 (用于批量获取元数据时排除)。"""
+        return self._below_watermark(post) or self.post_index.contains(post.opus_id)
+
+    def check(self, post: FeedPost) -> str:
+        """按动态列表顺序调用，返回 DECISION_PROCESS / DECISION_SKIP / DECISION_STOP。"""
+        if self._below_watermark(post) or self.post_index.is_complete(post.opus_id):
+            return DECISION_STOP if self.record_known(post) else DECISION_SKIP
+        if not post.pinned:
+            with self._lock:
+                self._known_streak = 0
+        return DECISION_PROCESS
+
+    def record_known(self, post: FeedPost) -> bool:
+        """记录一条已知 (已下载) 的动态，返回是否应当停止。"""
+        with self._lock:
+            self._synced.append(post)
+            if post.pinned:
+                return False
+            self._known_streak += 1
+            return self.incremental and self._known_streak >= self.stop_after
+
+    def record_processed(self, post: FeedPost):
+        """记录一条本次处理完成的动态。"""
+        with self._lock:
+            self._synced.append(post)
+
+    def record_unprepared(self, post: FeedPost):
+        """【新增】记录一条元数据获取失败 (未能处理) 的动态，新的高水位线不会越过它。"""
+        if post.pinned:
+            # 置顶动态不受高水位线影响，下次运行时总会重新检查
+            return
+        with self._lock:
+            self._unprepared.append(post)
+
+    @property
+    def new_watermark(self) -> Watermark:
+        """本次同步后的高水位线：只由早于所有未能处理的动态的已同步动态推高。"""
+        mark = Watermark(self.watermark.opus_id, self.watermark.pub_ts) if self.watermark else Watermark()
+        with self._lock:
+            holes = [Watermark(_opus_id_int(post), post.pub_ts) for post in self._unprepared]
+            for post in self._synced:
+                if all(hole.covers(post) and not _same_post(hole, post) for hole in holes):
+                    mark.advance(post)
+        return mark
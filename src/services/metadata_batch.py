@@ -0,0 +1,111 @@
+# src/services/metadata_batch.py
+
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from api import BilibiliAPI, FeedPost
+
+class BatchMetadataPrefetcher:
+    """
+    【新增】GET_ALL 模式的批量元数据获取器。
+    提供与字典相同的 pop(url, default) 接口，可以直接作为 prefetched 传给顺序处理 / 流水线：
+    请求某条动态的元数据时，如果尚未获取，就把它和其后的若干条动态一起交给一次 gallery-dl 调用，
+    子进程的启动次数大约减少为原来的 1/batch_size。
+    已下载的动态 (由 is_known 判断) 不会被加入批次。
+    【修改】动态列表改为流式读取：通过 track 登记动态，只保留尚未取出的动态，内存占用与列表长度无关。
+    """
+
+    def __init__(self, api: BilibiliAPI, batch_size: int,
+                 is_known: Optional[Callable[[FeedPost], bool]] = None):
+        self.api = api
+        self.batch_size = max(1, batch_size)
+        self.is_known = is_known
+        # 已登记但尚未取出元数据的动态 (按列表顺序)
+        self._pending: "OrderedDict[str, FeedPost]" = OrderedDict()
+        self._cache: Dict[str, Any] = {}
+        # 正在获取中的动态 → 所在批次完成时触发的事件
+        self._in_flight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def track(self, posts: Iterable[FeedPost]) -> Iterator[FeedPost]:
+        """
+        登记并原样产出动态列表。
+        每条动态会在被产出之前预读 batch_size 条，保证组成批次时已经知道后续的动态。
+        关闭该生成器时会一并关闭底层的动态列表生成器。
+        """
+        window: "deque[FeedPost]" = deque()
+        try:
+            for post in posts:
+                # 已下载的动态会被直接跳过，无需登记
+                if not (self.is_known and self.is_known(post)):
+                    with self._lock:
+                        self._pending[post.url] = post
+                window.append(post)
+                if len(window) > self.batch_size:
+                    yield window.popleft()
+            while window:
+                yield window.popleft()
+        finally:
+            close = getattr(posts, 'close', None)
+            if close:
+                close()
+
+    def seed(self, url: str, images_data: Any):
+        """放入已经获取的元数据 (例如为确定文件夹名称而获取的第一条动态)。"""
+        with self._lock:
+            self._cache[url] = images_data
+
+    def _next_batch(self, url: str) -> list:
+        """从 url 开始，按列表顺序收集最多 batch_size 条已登记、尚未获取的动态。"""
+        batch = [url]
+        found = False
+        for pending_url in self._pending:
+            if len(batch) >= self.batch_size:
+                break
+            if not found:
+                found = pending_url == url
+                continue
+            if pending_url in self._cache or pending_url in self._in_flight:
+                continue
+            batch.append(pending_url)
+        return batch
+
+    def pop(self, url: str, default: Any = None) -> Any:
+        """
+        取出一条动态的元数据 (取出后即从缓存中删除)。
+        未登记或已经取出过的 URL 返回 default，由调用方自行获取。
+        获取失败的动态返回空列表，调用方会按"无有效数据"跳过，不会重复请求。
+        gallery-dl 调用期间不持有锁：多个批次可以同时进行，
+        需要的动态已在其他批次中获取时，只等待该批次完成。
+        """
+        while True:
+            with self._lock:
+                if url in self._cache:
+                    self._pending.pop(url, None)
+                    return self._cache.pop(url)
+                event = self._in_flight.get(url)
+                if event is None:
+                    if url not in self._pending:
+                        return default
+                    batch = self._next_batch(url)
+                    event = threading.Event()
+                    for batch_url in batch:
+                        self._in_flight[batch_url] = event
+                    break
+            event.wait()
+
+        results: Dict[str, Any] = {}
+        try:
+            results = self.api.get_posts_metadata_batch(batch)
+        finally:
+            # 出错时批次中的动态不写入缓存，等待的线程会重新发起获取
+            with self._lock:
+                for batch_url, images_data in results.items():
+                    self._cache[batch_url] = images_data if images_data is not None else []
+                for batch_url in batch:
+                    self._in_flight.pop(batch_url, None)
+                event.set()
+        with self._lock:
+            self._pending.pop(url, None)
+            return self._cache.pop(url, default)
@@ -3,19 +3,90 @@
 import os
 import re
 import json
-from typing import List, Dict
+import textwrap
+from typing import Any, List, Dict, Optional
+
+from services.step2_store import STEP2_FORMAT_COMPACT, write_step2_file
+from services.metrics import Metrics, STAGE_METADATA_WRITE
+
+class Step1Writer:
+    """
+    【新增】边读取边写入步骤1元数据，文件内容与 save_step1_metadata 一次性写入的结果相同。
+    先写入临时文件，commit 时才替换正式文件；读取中断时 discard，保留上一次完整的元数据。
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.temp_path = filepath + ".part"
+        self.count = 0
+        self._file = None
+        try:
+            self._file = open(self.temp_path, 'w', encoding='utf-8')
+            self._file.write("[")
+        except OSError as e:
+            print(f"  - 警告：保存步骤1的元数据失败: {e}")
+
+    def write(self, entry: Any):
+        """追加一项 gallery-dl 输出。"""
+        if self._file is None:
+            return
+        try:
+            self._file.write(",\n" if self.count else "\n")
+            self._file.write(textwrap.indent(json.dumps(entry, indent=4, ensure_ascii=False), "    "))
+            self.count += 1
+        except OSError as e:
+            print(f"  - 警告：保存步骤1的元数据失败: {e}")
+            self.discard()
+
+    def commit(self):
+        """写入完毕，替换正式文件。"""
+        if self._file is None:
+            return
+        try:
+            self._file.write("\n]" if self.count else "]")
+            self._file.close()
+            self._file = None
+            os.replace(self.temp_path, self.filepath)
+        except OSError as e:
+            print(f"  - 警告：保存步骤1的元数据失败: {e}")
+            self.discard()
+
+    def discard(self):
+        """放弃写入，删除临时文件。"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
 
 class MetadataSaver:
     """负责保存原始元数据文件。"""
 
-    def save_step1_metadata(self, user_url: str, user_folder: str, user_page_data: List[Dict]):
-        """保存步骤1获取的用户主页元数据。"""
+    def __init__(self, step2_format: str = STEP2_FORMAT_COMPACT, metrics: Optional[Metrics] = None):
+        """
+        :param step2_format: 【新增】step2 元数据的存储格式，'compact' (默认) 或 'json'。
+        :param metrics: 【新增】计时与计数层，记录每次写入 step2 元数据的耗时。
+        """
+        self.step2_format = step2_format
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    @staticmethod
+    def _step1_path(user_url: str, user_folder: str) -> str:
         metadata_dir = os.path.join(user_folder, 'metadata', 'step1')
         os.makedirs(metadata_dir, exist_ok=True)
         safe_filename = re.sub(r'[^a-zA-Z0-9_-]', '_', user_url.replace("https://", "").replace("http://", "")) + ".json"
-        metadata_filepath = os.path.join(metadata_dir, safe_filename)
-        
         print(f"  - 正在保存步骤1的元数据到: {os.path.join(os.path.basename(user_folder), 'metadata', 'step1', safe_filename)}")
+        return os.path.join(metadata_dir, safe_filename)
+
+    def open_step1_writer(self, user_url: str, user_folder: str) -> Step1Writer:
+        """【新增】流式保存步骤1获取的用户主页元数据 (GET_ALL 模式边读取边写入)。"""
+        return Step1Writer(self._step1_path(user_url, user_folder))
+
+    def save_step1_metadata(self, user_url: str, user_folder: str, user_page_data: List[Dict]):
+        """保存步骤1获取的用户主页元数据。"""
+        metadata_filepath = self._step1_path(user_url, user_folder)
         try:
             with open(metadata_filepath, 'w', encoding='utf-8') as f:
                 json.dump(user_page_data, f, indent=4, ensure_ascii=False)
@@ -23,16 +94,13 @@ class MetadataSaver:
             print(f"  - 警告：保存步骤1的元数据失败: {e}")
 
     def save_step2_metadata(self, images_data: List[Dict], user_folder: str, date_str: str, pub_ts: int, id_str: str):
-        """保存步骤2获取的单个动态元数据。"""
-        # 元数据的命名格式
-        metadata_filename = f"{date_str}_{id_str}.json"
-        metadata_dir = os.path.join(user_folder, 'metadata', 'step2')
-        os.makedirs(metadata_dir, exist_ok=True)
-        filepath = os.path.join(metadata_dir, metadata_filename)
-        
+        """
+        保存步骤2获取的单个动态元数据。
+        【修改】默认使用紧凑格式 (动态级字段只保存一次，gzip 压缩)，见 services/step2_store.py。
+        """
         print(f"  - 正在保存动态 {id_str} 的步骤2元数据...")
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(images_data, f, indent=4, ensure_ascii=False)
+            with self.metrics.timer(STAGE_METADATA_WRITE):
+                write_step2_file(user_folder, date_str, id_str, images_data, self.step2_format)
         except Exception as e:
             print(f"  - 警告：保存元数据失败: {e}")
\ No newline at end of file
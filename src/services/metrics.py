@@ -0,0 +1,199 @@
+# src/services/metrics.py
+
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+# 阶段名称
+STAGE_GALLERY_DL = "gallery_dl"          # BilibiliAPI._run_command 中的一次 gallery-dl 调用
+STAGE_GALLERY_DL_BATCH = "gallery_dl_batch"  # 一次批量获取多条动态元数据的 gallery-dl 调用
+STAGE_FEED_PAGE = "feed_page"            # 动态列表接口的一次翻页请求
+STAGE_CDN_DOWNLOAD = "cdn_download"      # 一个资源从 CDN 下载完成 (含重试，不含限速等待)
+STAGE_METADATA_WRITE = "metadata_write"  # 保存一条动态的 step2 元数据
+STAGE_RATE_LIMIT_WAIT = "rate_limit_wait"  # 限速器令牌桶等待 (按端点区分，见 rate_limit_stage)
+STAGE_BACKOFF_WAIT = "backoff_wait"      # 非限流错误重试前的退避等待 (按端点区分)
+
+# 计数器名称
+COUNTER_DOWNLOAD_BYTES = "download_bytes"
+COUNTER_DOWNLOAD_RETRIES = "download_retries"
+COUNTER_DOWNLOAD_FAILURES = "download_failures"
+COUNTER_GALLERY_DL_FAILURES = "gallery_dl_failures"
+COUNTER_DEDUP_HITS = "dedup_hits"        # 【新增】从已下载的相同资源链接 / 复制、省去下载的次数
+COUNTER_DEDUP_BYTES = "dedup_bytes"      # 【新增】因此省去的下载字节数
+
+# 直方图的桶上界 (秒)
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Prometheus 指标名前缀
+PROMETHEUS_PREFIX = "bilibili_downloader"
+
+def rate_limit_stage(endpoint: str) -> str:
+    """限速等待按端点分别统计，例如 rate_limit_wait.cdn。"""
+    return f"{STAGE_RATE_LIMIT_WAIT}.{endpoint}"
+
+def backoff_stage(endpoint: str) -> str:
+    return f"{STAGE_BACKOFF_WAIT}.{endpoint}"
+
+def format_counter(value: float) -> str:
+    """计数器的精确文本：整数值按整数输出 (字节数等不能用 :g 截断为 6 位有效数字)，其余输出完整的 repr。"""
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(value)
+
+class Histogram:
+    """一个阶段的耗时直方图：次数、总耗时、最大值与各桶的计数 (非累积)。"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)  # 最后一个桶为 +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, upper in enumerate(self.buckets):
+            if seconds <= upper:
+                self.bucket_counts[i] += 1
+                return
+        self.bucket_counts[-1] += 1
+
+    def cumulative_counts(self) -> List[int]:
+        """Prometheus 格式的累积计数，与 buckets 一一对应，最后一项为 +Inf。"""
+        counts, running = [], 0
+        for value in self.bucket_counts:
+            running += value
+            counts.append(running)
+        return counts
+
+class MetricsScope:
+    """一组阶段直方图与计数器 (整次运行，或单个用户)。"""
+
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+
+    def observe(self, stage: str, seconds: float):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def count(self, name: str, value: float):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def stage_totals(self) -> Dict[str, Dict[str, float]]:
+        """各阶段的次数、总耗时、平均耗时与最大耗时 (秒)。"""
+        return {
+            stage: {
+                "count": h.count,
+                "seconds": round(h.total, 3),
+                "mean": round(h.total / h.count, 4) if h.count else 0.0,
+                "max": round(h.max, 3),
+            }
+            for stage, h in sorted(self.histograms.items())
+        }
+
+class Metrics:
+    """
+    【新增】轻量的计时与计数层，线程安全。
+    - 整次运行的统计始终记录；
+    - 在 user_scope() 中运行的代码 (以及用 contextvars 复制上下文启动的工作线程) 的统计
+      同时记入该用户自己的作用域，用于写入每个用户的摘要日志；
+    - 运行结束时可写出 Prometheus textfile (node_exporter 的 textfile collector 格式)。
+    """
+
+    _user_scope: contextvars.ContextVar = contextvars.ContextVar("metrics_user_scope", default=None)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.run_scope = MetricsScope()
+
+    def _scopes(self) -> List[MetricsScope]:
+        user_scope = self._user_scope.get()
+        return [self.run_scope] if user_scope is None else [self.run_scope, user_scope]
+
+    def observe(self, stage: str, seconds: float):
+        """记录一次阶段耗时。"""
+        with self._lock:
+            for scope in self._scopes():
+                scope.observe(stage, seconds)
+
+    def count(self, name: str, value: float = 1):
+        """累加计数器。"""
+        if not value:
+            return
+        with self._lock:
+            for scope in self._scopes():
+                scope.count(name, value)
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """计时一段代码 (出现异常时同样记录)。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    @contextmanager
+    def user_scope(self) -> Iterator[MetricsScope]:
+        """在当前上下文中开启一个用户作用域，退出后返回的作用域包含该用户的全部统计。"""
+        scope = MetricsScope()
+        token = self._user_scope.set(scope)
+        try:
+            yield scope
+        finally:
+            self._user_scope.reset(token)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """整次运行的阶段统计与计数器。"""
+        with self._lock:
+            return {"stages": self.run_scope.stage_totals(), "counters": dict(self.run_scope.counters)}
+
+    def render_prometheus(self) -> str:
+        """按 Prometheus 文本格式输出整次运行的直方图与计数器。"""
+        histogram_name = f"{PROMETHEUS_PREFIX}_stage_seconds"
+        lines = [
+            f"# HELP {histogram_name} Time spent per stage of the last run.",
+            f"# TYPE {histogram_name} histogram",
+        ]
+        with self._lock:
+            for stage, h in sorted(self.run_scope.histograms.items()):
+                label = f'stage="{stage}"'
+                for upper, cumulative in zip(list(h.buckets) + ["+Inf"], h.cumulative_counts()):
+                    lines.append(f'{histogram_name}_bucket{{{label},le="{upper}"}} {cumulative}')
+                lines.append(f"{histogram_name}_sum{{{label}}} {h.total:.6f}")
+                lines.append(f"{histogram_name}_count{{{label}}} {h.count}")
+            for name, value in sorted(self.run_scope.counters.items()):
+                metric = f"{PROMETHEUS_PREFIX}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {format_counter(value)}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_last_run_timestamp_seconds gauge")
+        lines.append(f"{PROMETHEUS_PREFIX}_last_run_timestamp_seconds {time.time():.0f}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """
+        写出 Prometheus textfile。先写临时文件再替换，
+        避免 node_exporter 读到写了一半的文件。
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render_prometheus())
+        os.replace(temp_path, path)
+
+def format_stage_totals(stages: Dict[str, Dict[str, float]]) -> List[str]:
+    """把 stage_totals() 的结果格式化为控制台输出的行。"""
+    return [
+        f"  - {stage}: {info['count']} 次，共 {info['seconds']:.2f} 秒，"
+        f"平均 {info['mean']:.3f} 秒，最长 {info['max']:.2f} 秒"
+        for stage, info in stages.items()
+    ]
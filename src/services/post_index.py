@@ -0,0 +1,89 @@
+# src/services/post_index.py
+
+import os
+from typing import Dict, Optional
+
+from database import ArchiveDB, CONTENT_FILE_PATTERN, KIND_VIDEO
+from services.step2_store import find_step2_file, load_step2_file
+
+class LocalPostIndex:
+    """
+    本地已下载动态的索引 (动态ID -> 日期字符串)。
+    在处理用户前建立一次，之后判断某条动态是否已下载时
+    无需再调用 gallery-dl 获取元数据。
+    【修改】提供归档数据库时以归档为准 (按 uid 做一次索引范围查询)；
+    用户文件夹尚未导入过归档时 (以 meta 表中的标记为准)，先把其中已有的文件导入归档。
+    """
+
+    def __init__(self, user_folder: str, archive: Optional[ArchiveDB] = None, uid: Optional[int] = None):
+        self.user_folder = user_folder
+        self.archive = archive if uid is not None else None
+        self.uid = uid
+        self._posts: Dict[str, str] = self._load_from_archive() if self.archive else self._scan()
+
+    def _load_from_archive(self) -> Dict[str, str]:
+        """从归档数据库读取用户已下载的动态。"""
+        if not self.archive.user_folder_imported(self.uid):
+            imported = self.archive.import_user_folder(self.uid, self.user_folder)
+            if imported:
+                print(f"  - [归档] 已将用户文件夹中的 {imported} 条已有记录导入归档数据库。")
+        posts: Dict[str, str] = {}
+        for post_id, filename in self.archive.user_posts(self.uid).items():
+            match = CONTENT_FILE_PATTERN.match(filename or "")
+            posts[post_id] = match.group(1) if match else 'unknown_date'
+        return posts
+
+    def _scan(self) -> Dict[str, str]:
+        """扫描用户文件夹中的内容信息文件，建立索引。"""
+        posts: Dict[str, str] = {}
+        if not os.path.isdir(self.user_folder):
+            return posts
+        with os.scandir(self.user_folder) as entries:
+            for entry in entries:
+                match = CONTENT_FILE_PATTERN.match(entry.name)
+                if match and entry.is_file():
+                    posts[match.group(2)] = match.group(1)
+        return posts
+
+    def __len__(self) -> int:
+        return len(self._posts)
+
+    def contains(self, post_id: str) -> bool:
+        """动态的内容信息文件是否已存在。"""
+        return str(post_id) in self._posts
+
+    def add(self, post_id: str, date_str: str):
+        """记录一条新下载完成的动态。"""
+        self._posts[str(post_id)] = date_str
+
+    def is_complete(self, post_id: Optional[str]) -> bool:
+        """
+        判断一条动态是否已完整下载，可以直接跳过。
+        除了内容信息文件存在之外，还会根据本地保存的 step2 元数据检查实况视频 (live photo)
+        是否都已下载；缺失时返回 False，交给后续流程补充下载。
+        """
+        if not post_id or not self.contains(post_id):
+            return False
+        return not self._has_missing_live_photo(str(post_id), self._posts[str(post_id)])
+
+    def _video_exists(self, post_id: str, date_str: str, index: int) -> bool:
+        if self.archive:
+            return self.archive.asset_exists(self.uid, post_id, index, KIND_VIDEO)
+        return os.path.exists(os.path.join(self.user_folder, f"{date_str}_{post_id}_{index}.mp4"))
+
+    def _has_missing_live_photo(self, post_id: str, date_str: str) -> bool:
+        """读取本地 step2 元数据，检查是否存在尚未下载的实况视频。"""
+        step2_path = find_step2_file(self.user_folder, date_str, post_id)
+        if step2_path is None:
+            return False
+        try:
+            images_data = load_step2_file(step2_path)
+        except (ValueError, OSError):
+            return False
+
+        for idx, img_info in enumerate(images_data[1:]):
+            if isinstance(img_info, list) and len(img_info) > 0 and isinstance(img_info[-1], dict):
+                if img_info[-1].get('live_url') and not self._video_exists(post_id, date_str, idx + 1):
+                    print(f"  - [增量检查] 动态 {post_id} 发现缺失的实况视频，将进行补充下载。")
+                    return True
+        return False
@@ -0,0 +1,170 @@
+# src/services/rate_limiter.py
+
+import time
+import random
+import asyncio
+import threading
+from typing import Dict, Optional, Any
+
+from services.metrics import Metrics, rate_limit_stage, backoff_stage
+
+# 端点类别
+ENDPOINT_FEED = "feed"          # 动态列表 API (opus/feed/space)
+ENDPOINT_METADATA = "metadata"  # gallery-dl 获取动态元数据
+ENDPOINT_CDN = "cdn"            # 图片 / 实况视频 CDN
+
+DEFAULT_RATES = {ENDPOINT_FEED: 1.0, ENDPOINT_METADATA: 1.0, ENDPOINT_CDN: 20.0}
+DEFAULT_BURSTS = {ENDPOINT_FEED: 1, ENDPOINT_METADATA: 2, ENDPOINT_CDN: 10}
+
+# 被限流时 B站返回的 HTTP 状态码与业务错误码
+THROTTLE_HTTP_STATUS = (412, 429)
+THROTTLE_API_CODES = (-412, -799)
+
+def is_throttle_response(status_code: Optional[int] = None, api_code: Optional[int] = None) -> bool:
+    """根据 HTTP 状态码或 B站业务错误码判断是否被限流。"""
+    return status_code in THROTTLE_HTTP_STATUS or api_code in THROTTLE_API_CODES
+
+def is_throttle_message(message: Any) -> bool:
+    """根据错误信息文本 (例如 gallery-dl 的 HttpError) 判断是否被限流。"""
+    text = str(message)
+    return any(f"{code} " in text or f"'{code}" in text for code in THROTTLE_HTTP_STATUS) \
+        or any(str(code) in text for code in THROTTLE_API_CODES)
+
+class TokenBucket:
+    """线程安全的令牌桶：以 rate 个/秒的速度补充令牌，最多积累 burst 个。"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self) -> float:
+        """预订一个令牌，返回需要等待的秒数 (调用方负责在锁外等待)。"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def set_rate(self, rate: float, drain: bool = False):
+        """调整补充速度；drain 为 True 时清空已积累的令牌。"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            if drain:
+                self._tokens = min(self._tokens, 0.0)
+
+class AdaptiveRateLimiter:
+    """
+    集中的自适应限速器，替代原来分散在各处的固定随机休眠。
+    - 每类端点 (动态列表 / 元数据 / CDN) 一个令牌桶；
+    - 遇到 HTTP 412/429 或 B站错误码 -412/-799 时速度减半 (最低降到配置速度的 min_rate_factor 倍)；
+    - 连续成功 recovery_successes 次后逐步恢复到配置速度；
+    - 统计每类端点累计的等待时间。
+    【修改】每次等待 (包括无需等待的请求) 同时记入 metrics，用于按阶段统计耗时分布。
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None, bursts: Optional[Dict[str, int]] = None,
+                 recovery_successes: int = 20, min_rate_factor: float = 0.05, metrics: Optional[Metrics] = None):
+        self.base_rates = dict(DEFAULT_RATES, **(rates or {}))
+        bursts = dict(DEFAULT_BURSTS, **(bursts or {}))
+        self.recovery_successes = max(1, recovery_successes)
+        self.min_rate_factor = min_rate_factor
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._buckets = {name: TokenBucket(rate, bursts.get(name, 1)) for name, rate in self.base_rates.items()}
+        self._lock = threading.Lock()
+        self._success_streak = {name: 0 for name in self.base_rates}
+        self._wait_seconds = {name: 0.0 for name in self.base_rates}
+        self._throttle_count = {name: 0 for name in self.base_rates}
+
+    def _bucket(self, endpoint: str) -> TokenBucket:
+        bucket = self._buckets.get(endpoint)
+        if bucket is None:
+            raise KeyError(f"未知的限速端点: {endpoint}")
+        return bucket
+
+    def _record_wait(self, endpoint: str, seconds: float):
+        if seconds > 0:
+            with self._lock:
+                self._wait_seconds[endpoint] += seconds
+
+    def acquire(self, endpoint: str) -> float:
+        """阻塞直到该端点允许发出下一个请求，返回本次等待的秒数。"""
+        delay = self._bucket(endpoint).reserve()
+        if delay > 0:
+            time.sleep(delay)
+            self._record_wait(endpoint, delay)
+        self.metrics.observe(rate_limit_stage(endpoint), max(delay, 0.0))
+        return delay
+
+    def backoff(self, endpoint: str, attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+        """非限流类错误 (超时、连接中断等) 重试前的指数退避 (带随机抖动)，等待时间计入统计。"""
+        delay = min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+        time.sleep(delay)
+        self._record_wait(endpoint, delay)
+        self.metrics.observe(backoff_stage(endpoint), delay)
+        return delay
+
+    async def acquire_async(self, endpoint: str) -> float:
+        """【新增】acquire 的协程版本 (asyncio 下载后端使用)，等待期间不阻塞事件循环。"""
+        delay = self._bucket(endpoint).reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+            self._record_wait(endpoint, delay)
+        self.metrics.observe(rate_limit_stage(endpoint), max(delay, 0.0))
+        return delay
+
+    async def backoff_async(self, endpoint: str, attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+        """【新增】backoff 的协程版本。"""
+        delay = min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+        await asyncio.sleep(delay)
+        self._record_wait(endpoint, delay)
+        self.metrics.observe(backoff_stage(endpoint), delay)
+        return delay
+
+    def current_rate(self, endpoint: str) -> float:
+        """【新增】返回端点当前的速度 (次/秒)。"""
+        return self._bucket(endpoint).rate
+
+    def report_success(self, endpoint: str):
+        """记录一次成功请求；连续成功足够多次后提高速度。"""
+        bucket = self._bucket(endpoint)
+        base_rate = self.base_rates[endpoint]
+        with self._lock:
+            self._success_streak[endpoint] += 1
+            if self._success_streak[endpoint] < self.recovery_successes or bucket.rate >= base_rate:
+                return
+            self._success_streak[endpoint] = 0
+            new_rate = min(base_rate, bucket.rate * 1.5)
+        bucket.set_rate(new_rate)
+
+    def report_throttled(self, endpoint: str):
+        """记录一次被限流的请求：速度减半并清空已积累的令牌。"""
+        bucket = self._bucket(endpoint)
+        base_rate = self.base_rates[endpoint]
+        with self._lock:
+            self._success_streak[endpoint] = 0
+            self._throttle_count[endpoint] += 1
+            new_rate = max(base_rate * self.min_rate_factor, bucket.rate / 2)
+        print(f"  - [限速] 检测到 {endpoint} 被限流，速度降低到 {new_rate:.2f} 次/秒。")
+        bucket.set_rate(new_rate, drain=True)
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """返回各端点的当前速度、累计等待时间与被限流次数。"""
+        with self._lock:
+            return {
+                name: {
+                    "rate": round(self._buckets[name].rate, 3),
+                    "wait_seconds": round(self._wait_seconds[name], 2),
+                    "throttled": self._throttle_count[name],
+                }
+                for name in self.base_rates
+            }
@@ -0,0 +1,126 @@
+# src/services/retry_queue.py
+
+import time
+import heapq
+import random
+import itertools
+import threading
+import contextvars
+from typing import Dict, List, Tuple
+
+from database import KIND_VIDEO, kind_from_filename
+from services.downloader import Downloader
+from services.metrics import COUNTER_DOWNLOAD_RETRIES, COUNTER_DOWNLOAD_FAILURES
+
+class DeferredRetryQueue:
+    """
+    【新增】单个用户的延迟重试队列。
+    下载失败的资源不再在原地退避等待，而是按指数退避 (带随机抖动) 安排到稍后重试，
+    由后台线程在到期时交给下载器重新下载，同时主流程继续处理后续动态。
+    用户处理结束时调用 flush() 等待队列清空，只有用完全部尝试次数仍失败的资源才会写入失败表。
+    需要配合 Downloader.defer_failures = True 使用 (下载器每次只尝试一次)。
+    """
+
+    def __init__(self, downloader: Downloader, max_attempts: int = 3, base_delay: float = 2.0, max_delay: float = 60.0):
+        """
+        :param max_attempts: 每个资源的总尝试次数 (包括第一次下载)。
+        :param base_delay: 第一次重试前的基础等待秒数，之后每次翻倍。
+        :param max_delay: 单次等待的上限秒数。
+        """
+        self.downloader = downloader
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._cond = threading.Condition()
+        # 按到期时间排列的 (到期时间, 序号, 已尝试次数, 下载任务)
+        self._heap: List[Tuple[float, int, int, Dict]] = []
+        self._sequence = itertools.count()
+        self._closing = False
+        self._succeeded: List[Dict] = []
+        self._failed: List[Dict] = []
+        # 后台线程继承调用方的上下文 (并行用户的输出前缀与 metrics 用户作用域)
+        self._thread = threading.Thread(target=contextvars.copy_context().run, args=(self._drain,),
+                                        name="retry-queue", daemon=True)
+        self._thread.start()
+
+    def _delay(self, attempts: int) -> float:
+        """已尝试 attempts 次后，下一次重试前的等待时间。"""
+        return min(self.max_delay, self.base_delay * (2 ** (attempts - 1))) * random.uniform(0.5, 1.0)
+
+    def submit(self, tasks: List[Dict], attempts: int = 1):
+        """把下载失败的任务加入队列。:param attempts: 这些任务已经尝试过的次数。"""
+        if not tasks:
+            return
+        with self._cond:
+            for task in tasks:
+                filename = Downloader.build_filename(task['url'], task['pub_ts'], task['id_str'], task['index'])
+                if attempts >= self.max_attempts:
+                    print(f"  - {filename} 尝试 {attempts} 次后仍然失败，跳过此文件。")
+                    self.downloader.metrics.count(COUNTER_DOWNLOAD_FAILURES)
+                    self._failed.append(task)
+                    continue
+                delay = self._delay(attempts)
+                heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), attempts, task))
+                print(f"  - {filename} 已加入延迟重试队列，{delay:.1f} 秒后重试 (尝试 {attempts + 1}/{self.max_attempts})")
+            self._cond.notify()
+
+    def _next_due(self) -> List[Tuple[int, Dict]]:
+        """等待并取出所有已到期的任务；队列已关闭且为空时返回空列表。"""
+        with self._cond:
+            while True:
+                if self._heap:
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                elif self._closing:
+                    return []
+                else:
+                    self._cond.wait()
+            now = time.monotonic()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                _, _, attempts, task = heapq.heappop(self._heap)
+                due.append((attempts, task))
+            return due
+
+    def _drain(self):
+        """后台线程：到期的任务按批次交给下载器 (批内并发)，失败的按更长的退避重新入队。"""
+        while True:
+            due = self._next_due()
+            if not due:
+                return
+            self.downloader.metrics.count(COUNTER_DOWNLOAD_RETRIES, len(due))
+            tasks = [task for _, task in due]
+            try:
+                results = self.downloader.download_batch(tasks)
+            except Exception as e:
+                print(f"  - 延迟重试时出错: {e}")
+                results = ["FAILED"] * len(tasks)
+            for (attempts, task), result in zip(due, results):
+                if result == "FAILED":
+                    self.submit([task], attempts + 1)
+                elif result == "SUCCESS":
+                    self.downloader.record_success(task)
+                    with self._cond:
+                        self._succeeded.append(task)
+
+    def flush(self) -> Tuple[int, int, List[Dict]]:
+        """
+        等待队列中的任务全部完成 (成功或用完尝试次数)，并停止后台线程。
+        返回 (重试成功的图片数, 重试成功的视频数, 最终失败的任务列表)。
+        """
+        with self._cond:
+            pending = len(self._heap)
+            self._closing = True
+            self._cond.notify()
+        if pending:
+            print(f"\n  - 等待延迟重试队列中剩余的 {pending} 个项目...")
+        self._thread.join()
+
+        videos = sum(1 for task in self._succeeded if kind_from_filename(
+            Downloader.build_filename(task['url'], task['pub_ts'], task['id_str'], task['index'])) == KIND_VIDEO)
+        if self._succeeded or self._failed:
+            print(f"  - 延迟重试完成: {len(self._succeeded)} 个成功 (图片:{len(self._succeeded) - videos}/实况图片:{videos}), "
+                  f"{len(self._failed)} 个失败。")
+        return len(self._succeeded) - videos, videos, self._failed
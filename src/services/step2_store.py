@@ -0,0 +1,145 @@
+# src/services/step2_store.py
+
+import os
+import re
+import gzip
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+# step2 元数据的存储格式 (对应 config.toml 中的 step2_format)
+STEP2_FORMAT_COMPACT = "compact"
+STEP2_FORMAT_JSON = "json"
+SUPPORTED_STEP2_FORMATS = (STEP2_FORMAT_COMPACT, STEP2_FORMAT_JSON)
+
+LEGACY_SUFFIX = ".json"
+COMPACT_SUFFIX = ".json.gz"
+# step2 文件名: 日期_动态ID.json 或 日期_动态ID.json.gz
+STEP2_FILE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2}|unknown_date)_(\d+)\.json(?:\.gz)?$')
+# 紧凑格式文件中的格式标记
+COMPACT_MARKER = "bilibili-step2-compact"
+COMPACT_VERSION = 1
+
+def step2_dir(user_folder: str) -> str:
+    """用户文件夹下保存 step2 元数据的目录。"""
+    return os.path.join(user_folder, 'metadata', 'step2')
+
+def step2_filename(date_str: str, id_str: str, step2_format: str = STEP2_FORMAT_COMPACT) -> str:
+    """step2 元数据文件名：'日期_动态ID' 加上对应格式的扩展名。"""
+    suffix = COMPACT_SUFFIX if step2_format == STEP2_FORMAT_COMPACT else LEGACY_SUFFIX
+    return f"{date_str}_{id_str}{suffix}"
+
+def is_step2_file(filename: str) -> bool:
+    """是否为 step2 元数据文件 (两种格式均可)。"""
+    return filename.endswith(COMPACT_SUFFIX) or filename.endswith(LEGACY_SUFFIX)
+
+def parse_step2_filename(filename: str) -> Optional[Tuple[str, str]]:
+    """从 step2 文件名中解析 (日期字符串, 动态ID)，不是 step2 文件时返回 None。"""
+    match = STEP2_FILE_PATTERN.match(filename)
+    return (match.group(1), match.group(2)) if match else None
+
+def find_step2_file(user_folder: str, date_str: str, id_str: str) -> Optional[str]:
+    """查找动态已保存的 step2 元数据文件，优先返回紧凑格式；都不存在时返回 None。"""
+    for step2_format in (STEP2_FORMAT_COMPACT, STEP2_FORMAT_JSON):
+        path = os.path.join(step2_dir(user_folder), step2_filename(date_str, id_str, step2_format))
+        if os.path.exists(path):
+            return path
+    return None
+
+def compact(images_data: List[Any]) -> Dict[str, Any]:
+    """
+    把 gallery-dl 的原始输出转换为紧凑结构。
+    原始输出中每一项的最后一个元素是元数据字典，动态级别的字段 (detail、username 等) 在每张图片中都重复一份；
+    这里把所有项中取值完全相同的字段提取到 shared 中只保存一次，每一项只保留自己特有的字段。
+    转换是无损的，expand 可以还原出与原始输出相等的数据。
+    """
+    dicts = [entry[-1] for entry in images_data if isinstance(entry, list) and entry and isinstance(entry[-1], dict)]
+    shared: Dict[str, Any] = {}
+    # 只有每一项都以元数据字典结尾时才能提取公共字段
+    if dicts and len(dicts) == len(images_data):
+        first = dicts[0]
+        shared = {key: value for key, value in first.items()
+                  if all(key in other and other[key] == value for other in dicts[1:])}
+
+    entries = []
+    for entry in images_data:
+        if shared:
+            own = {key: value for key, value in entry[-1].items() if key not in shared}
+            entries.append(entry[:-1] + [own])
+        else:
+            entries.append(entry)
+    return {"format": COMPACT_MARKER, "version": COMPACT_VERSION, "shared": shared, "entries": entries}
+
+def expand(document: Dict[str, Any]) -> List[Any]:
+    """把紧凑结构还原为 gallery-dl 的原始输出格式。"""
+    shared = document.get("shared") or {}
+    entries = document.get("entries", [])
+    if not shared:
+        return entries
+    return [entry[:-1] + [{**shared, **entry[-1]}] for entry in entries]
+
+def dumps_compact(images_data: List[Any]) -> bytes:
+    """序列化为紧凑格式的文件内容：无缩进的 JSON，gzip 压缩 (固定 mtime，相同数据得到相同字节)。"""
+    text = json.dumps(compact(images_data), ensure_ascii=False, separators=(',', ':'))
+    return gzip.compress(text.encode('utf-8'), mtime=0)
+
+def _write_file(path: str, content: bytes):
+    """先写临时文件再替换，避免中断时留下不完整的文件。"""
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+def load_step2_file(path: str) -> List[Any]:
+    """
+    读取 step2 元数据文件，返回 gallery-dl 原始输出格式的数据 (两种格式均可)。
+    文件损坏时抛出 OSError 或 ValueError。
+    """
+    if path.endswith(COMPACT_SUFFIX):
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                document = json.load(f)
+        except EOFError as e:
+            raise ValueError(f"压缩文件不完整: {e}")
+        if not isinstance(document, dict) or document.get("format") != COMPACT_MARKER:
+            raise ValueError("不是紧凑格式的 step2 元数据")
+        return expand(document)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_step2_file(user_folder: str, date_str: str, id_str: str, images_data: List[Any],
+                     step2_format: str = STEP2_FORMAT_COMPACT) -> str:
+    """
+    按指定格式写入 step2 元数据 (先写临时文件再替换)，并删除另一种格式的旧文件，返回写入的路径。
+    """
+    metadata_dir = step2_dir(user_folder)
+    os.makedirs(metadata_dir, exist_ok=True)
+    path = os.path.join(metadata_dir, step2_filename(date_str, id_str, step2_format))
+    if step2_format == STEP2_FORMAT_COMPACT:
+        content = dumps_compact(images_data)
+    else:
+        content = json.dumps(images_data, indent=4, ensure_ascii=False).encode('utf-8')
+    _write_file(path, content)
+
+    other_format = STEP2_FORMAT_JSON if step2_format == STEP2_FORMAT_COMPACT else STEP2_FORMAT_COMPACT
+    other_path = os.path.join(metadata_dir, step2_filename(date_str, id_str, other_format))
+    if os.path.exists(other_path):
+        os.remove(other_path)
+    return path
+
+def convert_legacy_file(path: str) -> Tuple[int, int]:
+    """
+    把一个旧格式 (缩进 JSON) 的 step2 文件转换为紧凑格式，返回 (转换前字节数, 转换后字节数)。
+    写入后重新读取并与原数据比较，一致时才删除旧文件。
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        images_data = json.load(f)
+    compact_path = path[:-len(LEGACY_SUFFIX)] + COMPACT_SUFFIX
+    content = dumps_compact(images_data)
+    _write_file(compact_path, content)
+
+    if load_step2_file(compact_path) != images_data:
+        os.remove(compact_path)
+        raise ValueError("转换后的数据与原文件不一致")
+    size_before = os.path.getsize(path)
+    os.remove(path)
+    return size_before, len(content)
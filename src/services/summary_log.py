@@ -0,0 +1,162 @@
+# src/services/summary_log.py
+
+import os
+import json
+import math
+import datetime
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+# 按月轮转的摘要日志：log/YYYY-MM/processing_time_log.jsonl，每行一条记录
+SUMMARY_LOG_FILENAME = "processing_time_log.jsonl"
+# 旧版摘要日志：log/processing_time_log.json，整个文件是一个 JSON 数组
+LEGACY_SUMMARY_LOG_FILENAME = "processing_time_log.json"
+LEGACY_MIGRATED_SUFFIX = ".migrated"
+
+@dataclass
+class UserStats:
+    """【新增】一个用户所有处理记录的汇总。"""
+    user_id: int
+    user_name: str
+    runs: int
+    mean_duration: float
+    p95_duration: float
+    images_per_second: float
+    failure_rate: float
+
+def _percentile(values: List[float], percent: float) -> float:
+    """最近秩法计算百分位数。"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+class SummaryLog:
+    """
+    【新增】只追加的处理摘要日志 (JSON Lines，按月轮转)。
+    每处理完一个用户只在当月文件末尾追加一行，不再读取并重写整个日志文件。
+    """
+
+    def __init__(self, log_dir: str):
+        self.log_dir = log_dir
+        self._lock = threading.Lock()
+
+    def path_for(self, month: Optional[str] = None) -> str:
+        """指定月份 (YYYY-MM，默认当前月份) 的摘要日志路径。"""
+        month = month or datetime.datetime.now().strftime('%Y-%m')
+        return os.path.join(self.log_dir, month, SUMMARY_LOG_FILENAME)
+
+    def append(self, entry: Dict[str, Any]) -> str:
+        """追加一条记录，返回写入的文件路径。多个用户并行处理时可以同时调用。"""
+        path = self.path_for()
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line)
+        return path
+
+    def _monthly_files(self) -> List[str]:
+        if not os.path.isdir(self.log_dir):
+            return []
+        paths = []
+        for month in sorted(os.listdir(self.log_dir)):
+            path = os.path.join(self.log_dir, month, SUMMARY_LOG_FILENAME)
+            if os.path.isfile(path):
+                paths.append(path)
+        return paths
+
+    def iter_entries(self) -> Iterator[Dict[str, Any]]:
+        """按时间顺序逐条读取所有月份的记录，跳过无法解析的行 (例如写入中断留下的半行)。"""
+        for path in self._monthly_files():
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if isinstance(entry, dict):
+                        yield entry
+
+    def aggregate(self) -> List[UserStats]:
+        """
+        按用户汇总所有记录：平均耗时、P95 耗时、每秒下载图片数 (图片 + 实况视频) 与失败率。
+        按最近一次处理的顺序返回。
+        """
+        grouped: Dict[int, List[Dict[str, Any]]] = {}
+        for entry in self.iter_entries():
+            user_id = entry.get('user_id')
+            if user_id is None:
+                continue
+            # 重新插入，使字典顺序反映最近一次处理的时间
+            entries = grouped.pop(user_id, [])
+            entries.append(entry)
+            grouped[user_id] = entries
+
+        results = []
+        for user_id, entries in grouped.items():
+            durations = [float(e.get('duration_seconds', 0)) for e in entries]
+            downloaded = sum(e.get('downloaded_images', 0) + e.get('downloaded_videos', 0) for e in entries)
+            failed = sum(e.get('failed_images', 0) for e in entries)
+            total_duration = sum(durations)
+            results.append(UserStats(
+                user_id=user_id,
+                user_name=entries[-1].get('user_name', str(user_id)),
+                runs=len(entries),
+                mean_duration=total_duration / len(entries),
+                p95_duration=_percentile(durations, 95),
+                images_per_second=downloaded / total_duration if total_duration > 0 else 0.0,
+                failure_rate=failed / (downloaded + failed) if downloaded + failed > 0 else 0.0,
+            ))
+        return results
+
+    def migrate_legacy(self) -> int:
+        """
+        把旧版的 processing_time_log.json 按记录的月份拆分追加到各月的 JSON Lines 文件中，
+        完成后将旧文件重命名为 processing_time_log.json.migrated，返回迁移的记录数。
+        旧文件不存在时什么也不做，因此可以在每次启动时调用。
+        """
+        legacy_path = os.path.join(self.log_dir, LEGACY_SUMMARY_LOG_FILENAME)
+        if not os.path.isfile(legacy_path):
+            return 0
+        try:
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"  - 警告：无法读取旧版摘要日志，跳过迁移: {e}")
+            return 0
+        if not isinstance(records, list):
+            records = []
+
+        by_month: Dict[str, List[Dict[str, Any]]] = {}
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            try:
+                month = datetime.datetime.strptime(record.get('timestamp', ''), '%Y-%m-%d %H:%M:%S').strftime('%Y-%m')
+            except ValueError:
+                month = datetime.datetime.now().strftime('%Y-%m')
+            by_month.setdefault(month, []).append(record)
+
+        with self._lock:
+            for month, month_records in by_month.items():
+                path = self.path_for(month)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                existing = self._read_lines(path)
+                # 旧记录早于新格式的记录，写在文件开头
+                with open(path, 'w', encoding='utf-8') as f:
+                    for record in month_records:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    f.writelines(existing)
+            os.replace(legacy_path, legacy_path + LEGACY_MIGRATED_SUFFIX)
+        return sum(len(month_records) for month_records in by_month.values())
+
+    @staticmethod
+    def _read_lines(path: str) -> List[str]:
+        if not os.path.isfile(path):
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            return [line if line.endswith("\n") else line + "\n" for line in f if line.strip()]